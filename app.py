@@ -1,7 +1,7 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import openai
+from flask import Flask, Request, render_template, request, jsonify, send_file, Response, stream_with_context, session, g, abort, make_response
 import os
 import tempfile
+import io
 import uuid
 from datetime import datetime
 from waitress import serve
@@ -10,20 +10,182 @@ from werkzeug.utils import secure_filename
 import yt_dlp
 import subprocess
 import re
+import shutil
+import copy
+import base64
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse, parse_qs
+import metrics
+from jobs import JobManager
+from artifacts import ArtifactManager
+from batch import BatchRunner, RateLimiter, load_csv_items, expand_source
+from image_store import ImageStore
+from openai_clients import ApiKeyStore, ClientRegistry
+from openai_scheduler import OpenAIScheduler
+from transcription_cache import TranscriptionCache, youtube_cache_key, segments_cache_key, file_cache_key, hash_file
+from timed_transcript import TimedTranscript, opening_quote
+from post_history import PostHistory
+from generation_store import GenerationStore, generation_key
+from transcript_compaction import count_tokens, extractive_summary, split_chunks
+from uploads import UploadSink, UploadStore
+from transcription_engines import OpenAIWhisperEngine, FasterWhisperEngine
+from worker_slots import WorkerSlots
+from segment_detection import analyse_audio, audio_candidates, chapter_candidates
+from audio_profiles import (
+    LOSSLESS_EXTENSIONS, choose_profile, ffmpeg_output_args, profile_extension, transcode_file
+)
+from audio_chunking import (
+    WHISPER_MAX_BYTES, CHUNK_MAX_BYTES,
+    probe_duration, detect_silences, plan_chunks, split_audio, stitch_transcripts
+)
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25MB max file size (Whisper limit)
+# Upload scritti a blocchi su disco durante la ricezione; oltre i 25MB di Whisper vengono ricodificati e divisi.
+# Il limite vale solo per le route di upload (UPLOAD_ENDPOINTS), le altre richieste restano entro REQUEST_MAX_MB
+app.config['UPLOAD_MAX_MB'] = int(os.environ.get('UPLOAD_MAX_MB', 1024))
+app.config['REQUEST_MAX_MB'] = int(os.environ.get('REQUEST_MAX_MB', 16))
+app.config['MAX_CONTENT_LENGTH'] = app.config['REQUEST_MAX_MB'] * 1024 * 1024
+# Upload ripresi (/api/uploads): dimensione dei blocchi PATCH e durata delle sessioni incomplete
+app.config['UPLOAD_CHUNK_MB'] = int(os.environ.get('UPLOAD_CHUNK_MB', 8))
+app.config['UPLOAD_RESUME_HOURS'] = float(os.environ.get('UPLOAD_RESUME_HOURS', 24))
 app.config['UPLOAD_FOLDER'] = 'temp_uploads'
 app.config['YOUTUBE_FOLDER'] = 'youtube_downloads'
+app.config['CACHE_FOLDER'] = 'cache'
+app.config['IMAGE_FOLDER'] = 'generated_images'
+app.config['IMAGE_STORE_MAX_IMAGES'] = int(os.environ.get('IMAGE_STORE_MAX_IMAGES', 200))
+# Scarica solo l'intervallo richiesto invece dell'intero video (0 per disattivare)
+app.config['YOUTUBE_RANGE_DOWNLOAD'] = os.environ.get('YOUTUBE_RANGE_DOWNLOAD', '1') != '0'
+# Modalità streaming: ffmpeg legge lo stream e codifica su pipe, senza file temporanei (0 per disattivare)
+app.config['YOUTUBE_STREAMING'] = os.environ.get('YOUTUBE_STREAMING', '1') != '0'
+# Numero di job di elaborazione (download/ffmpeg/Whisper) eseguiti in parallelo
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get('JOB_MAX_PENDING', 20))
+# Trascrizione a chunk: audio più lunghi di ~1.5 chunk vengono divisi e trascritti in parallelo
+app.config['MAX_SEGMENT_SECONDS'] = int(os.environ.get('MAX_SEGMENT_SECONDS', 4 * 3600))
+app.config['TRANSCRIBE_CHUNK_SECONDS'] = int(os.environ.get('TRANSCRIBE_CHUNK_SECONDS', 600))
+app.config['TRANSCRIBE_CHUNK_OVERLAP'] = float(os.environ.get('TRANSCRIBE_CHUNK_OVERLAP', 1.5))
+app.config['WHISPER_MAX_CONCURRENCY'] = int(os.environ.get('WHISPER_MAX_CONCURRENCY', 4))
+# Profilo di codifica audio: auto (Opus 16kHz se disponibile), opus, aac o mp3
+app.config['AUDIO_PROFILE'] = os.environ.get('AUDIO_PROFILE', 'auto')
+# Il taglio dei silenzi accorcia la timeline: ignorato se sono attivi i tempi (TRANSCRIBE_TIMESTAMPS)
+app.config['AUDIO_TRIM_SILENCE'] = os.environ.get('AUDIO_TRIM_SILENCE', '0') == '1'
+app.config['AUDIO_NORMALIZE'] = os.environ.get('AUDIO_NORMALIZE', '0') == '1'
+# Client OpenAI per sessione: un pool di connessioni per API key, LRU oltre OPENAI_MAX_CLIENTS
+app.config['OPENAI_MAX_CLIENTS'] = int(os.environ.get('OPENAI_MAX_CLIENTS', 16))
+app.config['OPENAI_MAX_CONNECTIONS'] = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+app.config['OPENAI_MAX_RETRIES'] = int(os.environ.get('OPENAI_MAX_RETRIES', 3))
+app.config['OPENAI_TIMEOUT'] = float(os.environ.get('OPENAI_TIMEOUT', 600))
+# Scheduler condiviso delle chiamate OpenAI: quote per modello dagli header x-ratelimit-*, priorità
+# (interattive prima dei batch) e retry con jitter su 429/5xx fino a OPENAI_RETRY_MAX_DELAY secondi (0 per disattivarlo)
+app.config['OPENAI_SCHEDULER'] = os.environ.get('OPENAI_SCHEDULER', '1') != '0'
+app.config['OPENAI_RETRY_MAX_DELAY'] = float(os.environ.get('OPENAI_RETRY_MAX_DELAY', 60))
+# Cache persistente delle trascrizioni
+app.config['TRANSCRIPTION_CACHE_MAX_MB'] = int(os.environ.get('TRANSCRIPTION_CACHE_MAX_MB', 200))
+app.config['TRANSCRIPTION_CACHE_MAX_AGE_DAYS'] = int(os.environ.get('TRANSCRIPTION_CACHE_MAX_AGE_DAYS', 30))
+# Durata in memoria dei metadati yt-dlp (gli URL degli stream scadono dopo alcune ore)
+app.config['YOUTUBE_INFO_TTL'] = int(os.environ.get('YOUTUBE_INFO_TTL', 1800))
+# Ciclo di vita dei file temporanei: scadenza delle voci, grazia per gli orfani, quota disco
+app.config['ARTIFACT_MAX_AGE_HOURS'] = float(os.environ.get('ARTIFACT_MAX_AGE_HOURS', 6))
+app.config['ARTIFACT_ORPHAN_GRACE'] = int(os.environ.get('ARTIFACT_ORPHAN_GRACE', 3600))
+app.config['ARTIFACT_MAX_MB'] = int(os.environ.get('ARTIFACT_MAX_MB', 2048))
+app.config['ARTIFACT_REAP_INTERVAL'] = int(os.environ.get('ARTIFACT_REAP_INTERVAL', 60))
+# Trascrizioni con tempi di segmenti e parole (esportazione SRT/VTT/JSON e link alla citazione)
+app.config['TRANSCRIBE_TIMESTAMPS'] = os.environ.get('TRANSCRIBE_TIMESTAMPS', '1') != '0'
+if app.config['AUDIO_TRIM_SILENCE'] and app.config['TRANSCRIBE_TIMESTAMPS']:
+    # Senza le pause i tempi di segmenti, SRT/VTT e link ?t= non corrisponderebbero all'originale
+    print("⚠️ AUDIO_TRIM_SILENCE ignorato: incompatibile con TRANSCRIBE_TIMESTAMPS (imposta TRANSCRIBE_TIMESTAMPS=0)")
+    app.config['AUDIO_TRIM_SILENCE'] = False
+# Storico dei post: un post troppo simile a uno recente viene rigenerato evitando aperture e hashtag già usati
+app.config['POST_HISTORY_MAX'] = int(os.environ.get('POST_HISTORY_MAX', 200))
+app.config['POST_DEDUP_THRESHOLD'] = float(os.environ.get('POST_DEDUP_THRESHOLD', 0.5))
+app.config['POST_DEDUP_RETRIES'] = int(os.environ.get('POST_DEDUP_RETRIES', 1))
+# Post e immagini memorizzati per (input, topic_hint, versione del prompt, modello, parametri): varianti per chiave, LRU su quota
+app.config['GENERATION_STORE_MAX_MB'] = int(os.environ.get('GENERATION_STORE_MAX_MB', 50))
+app.config['GENERATION_MAX_VARIANTS'] = int(os.environ.get('GENERATION_MAX_VARIANTS', 5))
+# Immagini progressive: IMAGE_DRAFT_COUNT bozze economiche in una sola chiamata (0 per l'immagine unica in alta qualità),
+# poi solo la bozza scelta viene resa in alta qualità in background, partendo dalla bozza (edit) o dal solo prompt
+app.config['IMAGE_DRAFT_COUNT'] = int(os.environ.get('IMAGE_DRAFT_COUNT', 3))
+app.config['IMAGE_DRAFT_QUALITY'] = os.environ.get('IMAGE_DRAFT_QUALITY', 'low')
+app.config['IMAGE_FINAL_FROM_DRAFT'] = os.environ.get('IMAGE_FINAL_FROM_DRAFT', '1') != '0'
+# Compattazione delle trascrizioni lunghe prima del post: oltre POST_INPUT_MAX_TOKENS token restano i passaggi
+# più centrali (extractive, TextRank locale) o i riassunti paralleli dei blocchi (map_reduce); off per disattivarla
+app.config['POST_COMPACTION'] = os.environ.get('POST_COMPACTION', 'extractive')
+app.config['POST_INPUT_MAX_TOKENS'] = int(os.environ.get('POST_INPUT_MAX_TOKENS', 3000))
+app.config['POST_COMPACTION_TARGET_TOKENS'] = int(os.environ.get('POST_COMPACTION_TARGET_TOKENS', 1500))
+app.config['POST_SUMMARY_MODEL'] = os.environ.get('POST_SUMMARY_MODEL', 'gpt-4o-mini')
+app.config['POST_SUMMARY_CHUNK_TOKENS'] = int(os.environ.get('POST_SUMMARY_CHUNK_TOKENS', 3000))
+app.config['POST_SUMMARY_CONCURRENCY'] = int(os.environ.get('POST_SUMMARY_CONCURRENCY', 4))
+# Motore di trascrizione predefinito: openai (Whisper API) o local (faster-whisper su CPU, senza API key)
+app.config['TRANSCRIBE_ENGINE'] = os.environ.get('TRANSCRIBE_ENGINE', 'openai')
+# Modello locale: dimensione (tiny, base, small, medium, large-v3) o cartella di un modello CTranslate2
+app.config['LOCAL_WHISPER_MODEL'] = os.environ.get('LOCAL_WHISPER_MODEL', 'small')
+app.config['LOCAL_WHISPER_COMPUTE_TYPE'] = os.environ.get('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+app.config['LOCAL_WHISPER_THREADS'] = int(os.environ.get('LOCAL_WHISPER_THREADS', os.cpu_count() or 4))
+app.config['LOCAL_WHISPER_BATCH_SIZE'] = int(os.environ.get('LOCAL_WHISPER_BATCH_SIZE', 8))
+# Rilevamento automatico della predicazione (analisi audio a bassa risoluzione dell'intero video)
+app.config['SEGMENT_DETECTION'] = os.environ.get('SEGMENT_DETECTION', '1') != '0'
+app.config['SEGMENT_MIN_SECONDS'] = int(os.environ.get('SEGMENT_MIN_SECONDS', 600))
+# Analisi avviate da /api/youtube-info: pool proprio, a bassa priorità rispetto alle trascrizioni
+app.config['SEGMENT_JOB_WORKERS'] = int(os.environ.get('SEGMENT_JOB_WORKERS', 1))
+# Header Server-Timing con la durata delle fasi di ogni richiesta (0 per disattivare); le metriche sono su /metrics
+app.config['METRICS_SERVER_TIMING'] = os.environ.get('METRICS_SERVER_TIMING', '1') != '0'
+# Con più processi /metrics somma le metriche di tutti: ognuno scrive il proprio stato in METRICS_DIR
+# ogni METRICS_FLUSH_SECONDS (server.py svuota la cartella all'avvio)
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join('cache', 'metrics'))
+app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+# Elaborazione in blocco: cartella dei risultati e limiti OpenAI (0 = nessun limite)
+app.config['BATCH_FOLDER'] = 'batch_output'
+app.config['BATCH_RPM'] = int(os.environ.get('BATCH_RPM', 0))
+app.config['BATCH_TPM'] = int(os.environ.get('BATCH_TPM', 0))
+# Batch eseguiti contemporaneamente, in un pool separato da quello dei job interattivi (JOB_WORKERS)
+app.config['BATCH_JOB_WORKERS'] = int(os.environ.get('BATCH_JOB_WORKERS', 1))
+# Modalità multi-processo (server.py): processi e thread per processo; con più processi job, API key e cache
+# sono condivisi tramite SQLite in CACHE_FOLDER
+app.config['SERVER_PROCESSES'] = int(os.environ.get('SERVER_PROCESSES', 1))
+app.config['SERVER_THREADS'] = int(os.environ.get('SERVER_THREADS', 4))
+# Con più processi le API key degli operatori sono salvate (in chiaro, file 0600) in cache/api_keys.sqlite3:
+# scadono dopo API_KEY_TTL_HOURS ore senza utilizzo
+app.config['API_KEY_TTL_HOURS'] = float(os.environ.get('API_KEY_TTL_HOURS', 24))
+# Elaborazioni ffmpeg (taglio, ricodifica, analisi) contemporanee su tutta la macchina, sommando i processi
+app.config['TRANSCODE_WORKERS'] = int(os.environ.get('TRANSCODE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
 
 # Assicurati che le directory esistano
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['YOUTUBE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
+
+def load_secret_key(path):
+    """Chiave per firmare i cookie di sessione, generata una volta e conservata su disco"""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    secret = os.urandom(32)
+    temp_path = f"{path}.{os.getpid()}"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    try:
+        # Più processi avviati insieme: vince il primo, gli altri leggono la sua chiave
+        os.link(temp_path, path)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            secret = f.read()
+    finally:
+        os.remove(temp_path)
+    return secret
+
+app.secret_key = os.environ.get('SECRET_KEY') or load_secret_key(
+    os.path.join(app.config['CACHE_FOLDER'], 'secret_key')
+)
 
 # Formati audio supportati da OpenAI Whisper
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'm4a', 'mp4', 'mpeg', 'mpga', 'webm', 'flac'}
 
+# Protocolli yt-dlp che ffmpeg può leggere direttamente dall'URL dello stream
+STREAMABLE_PROTOCOLS = {'http', 'https', 'm3u8', 'm3u8_native'}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -62,6 +224,17 @@ def seconds_to_hhmmss(seconds):
     secs = seconds % 60
     return f"{hours:02d}:{minutes:02d}:{secs:02d}"
 
+def encoding_for(duration):
+    """Profilo, bitrate e argomenti ffmpeg per codificare audio vocale della durata indicata"""
+    profile, bitrate = choose_profile(duration, preferred=app.config['AUDIO_PROFILE'])
+    metrics.AUDIO_BITRATE.observe(bitrate, profile=profile)
+    args = ffmpeg_output_args(
+        profile, bitrate,
+        trim_silence=app.config['AUDIO_TRIM_SILENCE'],
+        normalize=app.config['AUDIO_NORMALIZE']
+    )
+    return profile, bitrate, args
+
 def validate_youtube_url(url):
     """Valida URL YouTube e estrae video ID"""
     youtube_regex = re.compile(
@@ -72,81 +245,379 @@ def validate_youtube_url(url):
     return match.group(6) if match else None
 
 class TranscriptionService:
-    def __init__(self):
-        self.api_key = None
-        self.client = None
+    def __init__(self, openai_client=None):
+        self.client = openai_client
+        self.openai_engine = OpenAIWhisperEngine(openai_client)
     
-    def set_api_key(self, api_key):
+    def engine_for(self, name=None):
+        """Motore richiesto (o quello predefinito): restituisce (success, motore o errore)"""
+        name = name or app.config['TRANSCRIBE_ENGINE']
+        if name == 'openai':
+            if not self.client:
+                return False, "API Key non configurata"
+            return True, self.openai_engine
+        error = engine_error(name)
+        if error:
+            return False, error
+        return True, local_engine
+    
+    def transcribe_audio(self, audio_file_path, language="it", progress=None, use_cache=True, timed=False,
+                         engine=None):
+        """Trascrive un file audio, dividendolo in chunk paralleli se lungo o oltre i 25MB.
+
+        Con timed=True il risultato è un TimedTranscript (testo con tempi di segmenti e parole).
+        """
+        cache_key = None
+        if use_cache:
+            # Stesso contenuto, lingua e motore: nessuna nuova trascrizione
+            cache_key = file_cache_key(hash_file(audio_file_path), language, engine or app.config['TRANSCRIBE_ENGINE'])
+            cached = transcription_cache.get(cache_key)
+            if cached and not timed:
+                return True, cached['text']
+            if cached and cached['timing']:
+                return True, TimedTranscript.from_dict(cached['timing'])
+        
+        success, engine = self.engine_for(engine)
+        if not success:
+            return False, engine
+        
+        success, result = self._transcribe(audio_file_path, language, progress, timed, engine)
+        if success and cache_key:
+            if timed:
+                transcription_cache.put(cache_key, result.text, timing=result.to_dict())
+            else:
+                transcription_cache.put(cache_key, result)
+        return success, result
+    
+    def _engine_request(self, engine, audio, language, timed, progress=None, size=None):
+        """Una richiesta al motore, misurata come fase whisper_<motore>"""
+        with metrics.span(f'whisper_{engine.name}', bytes_in=size) as stage:
+            return stage.result(engine.transcribe(audio, language, timed, progress))
+    
+    def _transcribe(self, audio_file_path, language, progress, timed, engine):
         try:
-            self.api_key = api_key
-            self.client = openai.OpenAI(api_key=api_key)
-            # Test della connessione
-            self.client.models.list()
+            if engine.max_upload_bytes is None:
+                # Motore locale: legge direttamente il file, senza chunk
+                return self._engine_request(
+                    engine, audio_file_path, language, timed, progress, os.path.getsize(audio_file_path)
+                )
+            
+            file_size = os.path.getsize(audio_file_path)
+            try:
+                duration = probe_duration(audio_file_path)
+            except OSError:
+                duration = None  # ffmpeg non disponibile
             
-            # Inizializza anche i generatori
-            global facebook_generator, image_generator
-            facebook_generator = FacebookPostGenerator(self.client)
-            image_generator = ImageGenerator(self.client)
+            chunk_seconds = app.config['TRANSCRIBE_CHUNK_SECONDS']
+            too_long = chunk_seconds and duration and duration > chunk_seconds * 1.5
+            if file_size > engine.max_upload_bytes or too_long:
+                if not duration:
+                    return False, "File troppo grande per Whisper API (max 25MB)"
+                return self.transcribe_audio_chunked(audio_file_path, language, duration, progress, timed, engine)
             
-            return True, "API Key configurata correttamente"
+            return self._transcribe_single(audio_file_path, language, timed, engine)
         except Exception as e:
-            return False, f"Errore API Key: {str(e)}"
+            return False, f"Errore nella trascrizione: {str(e)}"
     
-    def transcribe_audio(self, audio_file_path, language="it"):
-        if not self.client:
-            return False, "API Key non configurata"
+    def transcribe_audio_chunked(self, audio_file_path, language, duration, progress=None, timed=False, engine=None):
+        """Divide l'audio sulle pause, trascrive i chunk in parallelo e ricompone il testo"""
+        engine = engine or self.openai_engine
+        file_size = os.path.getsize(audio_file_path)
+        # Ogni chunk deve restare sotto il limite di upload di Whisper
+        bytes_per_second = file_size / duration
+        chunk_seconds = min(app.config['TRANSCRIBE_CHUNK_SECONDS'] or 600, CHUNK_MAX_BYTES / bytes_per_second)
         
+        with transcode_pool.slot(), metrics.span('silence_detect'):
+            silences = detect_silences(audio_file_path)
+        chunks = plan_chunks(duration, silences, chunk_seconds, app.config['TRANSCRIBE_CHUNK_OVERLAP'])
+        
+        work_dir = tempfile.mkdtemp(prefix='chunks_', dir=os.path.dirname(audio_file_path) or None)
+        owner = artifact_manager.track(work_dir)
         try:
-            # Verifica dimensioni file (max 25MB per Whisper)
-            file_size = os.path.getsize(audio_file_path)
-            if file_size > 25 * 1024 * 1024:
-                return False, "File troppo grande per Whisper API (max 25MB)"
-            
-            with open(audio_file_path, "rb") as audio_file:
-                transcript = self.client.audio.transcriptions.create(
-                    model="whisper-1",  # Nuovo modello 2025 - migliore e più economico
-                    file=audio_file,
-                    language=language if language != "auto" else None,
-                    response_format="text"  # Formato compatibile con gpt-4o-mini-transcribe
+            with transcode_pool.slot(), metrics.span('audio_split', bytes_in=file_size):
+                chunk_paths = split_audio(audio_file_path, chunks, work_dir)
+            texts = [None] * len(chunk_paths)
+            completed = 0
+            with ThreadPoolExecutor(max_workers=app.config['WHISPER_MAX_CONCURRENCY']) as pool:
+                futures = {
+                    pool.submit(metrics.bind(self._transcribe_single), path, language, timed, engine): index
+                    for index, path in enumerate(chunk_paths)
+                }
+                for future in as_completed(futures):
+                    success, text = future.result()
+                    if not success:
+                        for pending in futures:
+                            pending.cancel()
+                        return False, text
+                    texts[futures[future]] = text
+                    completed += 1
+                    if progress:
+                        progress('transcribing', completed * 100 / len(chunk_paths),
+                                 f'Trascrizione chunk {completed}/{len(chunk_paths)}...')
+            if timed:
+                # Tempi dei chunk riportati all'inizio del file; sovrapposizioni risolte sui tempi
+                return True, TimedTranscript.concat(
+                    part.shift(start) for part, (start, _) in zip(texts, chunks)
                 )
+            return True, stitch_transcripts(texts)
+        finally:
+            artifact_manager.release(owner)
+    
+    def transcribe_stream(self, audio_stream, filename, language="it", duration=None, progress=None, timed=False,
+                          engine=None):
+        """Trascrive un buffer audio inviandolo direttamente al motore.
+
+        Solo se il buffer supera i limiti di una singola richiesta viene
+        riversato su disco per la trascrizione a chunk.
+        """
+        success, engine = self.engine_for(engine)
+        if not success:
+            return False, engine
+        
+        try:
+            audio_stream.seek(0, os.SEEK_END)
+            size = audio_stream.tell()
+            audio_stream.seek(0)
             
-            # Estrai il testo dalla risposta
-            text = transcript if isinstance(transcript, str) else str(transcript)
-            return True, text
+            chunk_seconds = app.config['TRANSCRIBE_CHUNK_SECONDS']
+            too_long = chunk_seconds and duration and duration > chunk_seconds * 1.5
+            if engine.max_upload_bytes is None or (size <= engine.max_upload_bytes and not too_long):
+                return self._engine_request(engine, (filename, audio_stream), language, timed, progress, size)
             
+            fd, spill_path = tempfile.mkstemp(
+                suffix=os.path.splitext(filename)[1], dir=app.config['YOUTUBE_FOLDER']
+            )
+            owner = artifact_manager.track(spill_path)
+            try:
+                with os.fdopen(fd, 'wb') as spill_file:
+                    shutil.copyfileobj(audio_stream, spill_file)
+                return self._transcribe(spill_path, language, progress, timed, engine)
+            finally:
+                artifact_manager.release(owner)
         except Exception as e:
-            error_msg = str(e)
-            if "file size" in error_msg.lower():
-                return False, "File troppo grande. OpenAI Whisper accetta max 25MB"
-            elif "invalid file format" in error_msg.lower():
-                return False, "Formato file non supportato da Whisper"
-            else:
-                return False, f"Errore nella trascrizione: {error_msg}"
+            return False, f"Errore nella trascrizione: {str(e)}"
+    
+    def _transcribe_single(self, audio_file_path, language, timed, engine):
+        """Singola richiesta al motore (il file deve stare nel limite di upload)"""
+        # Verifica dimensioni file (max 25MB per Whisper)
+        file_size = os.path.getsize(audio_file_path)
+        if file_size > engine.max_upload_bytes:
+            return False, "File troppo grande per Whisper API (max 25MB)"
+        
+        with open(audio_file_path, "rb") as audio_file:
+            return self._engine_request(engine, audio_file, language, timed, size=file_size)
 
 class YouTubeProcessor:
-    def __init__(self):
+    def __init__(self, info_ttl=1800, info_cache_size=128):
         self.download_folder = app.config['YOUTUBE_FOLDER']
+        # Cache delle estrazioni yt-dlp per video id: {video_id: (scadenza, info)}
+        self.info_ttl = info_ttl
+        self.info_cache_size = info_cache_size
+        self.info_cache = {}
+        self.info_lock = threading.Lock()
+        self.info_hits = 0
+        self.info_misses = 0
+    
+    def extract_info(self, url):
+        """Estrae (senza risolvere i formati) le info del video, riusando la cache entro il TTL"""
+        video_id = validate_youtube_url(url) or url
+        now = time.time()
+        with self.info_lock:
+            entry = self.info_cache.get(video_id)
+            if entry and entry[0] > now:
+                self.info_hits += 1
+                return copy.deepcopy(entry[1])
+            self.info_misses += 1
+        
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+        }
+        with metrics.span('youtube_extract'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # process=False: la selezione del formato avviene al download con process_ie_result
+            info = ydl.extract_info(url, download=False, process=False)
+        
+        with self.info_lock:
+            self.info_cache[video_id] = (now + self.info_ttl, info)
+            if len(self.info_cache) > self.info_cache_size:
+                expired = [k for k, (expires, _) in self.info_cache.items() if expires <= now]
+                for key in expired or sorted(self.info_cache, key=lambda k: self.info_cache[k][0])[:1]:
+                    del self.info_cache[key]
+        return copy.deepcopy(info)
+    
+    def info_cache_stats(self):
+        with self.info_lock:
+            lookups = self.info_hits + self.info_misses
+            return {
+                'entries': len(self.info_cache),
+                'hits': self.info_hits,
+                'misses': self.info_misses,
+                'hit_rate': round(self.info_hits / lookups, 3) if lookups else 0.0
+            }
     
     def get_video_info(self, url):
         """Ottiene informazioni sul video YouTube"""
         try:
+            info = self.extract_info(url)
+            return {
+                'title': info.get('title', 'Unknown'),
+                'duration': info.get('duration', 0),
+                'uploader': info.get('uploader', 'Unknown'),
+                'view_count': info.get('view_count', 0),
+                'chapters': info.get('chapters') or []
+            }
+        except Exception as e:
+            return None
+    
+    def detect_segments(self, url, progress=None):
+        """Propone i segmenti della predicazione: capitoli del video e tratti di parlato continuo.
+
+        L'audio viene letto una sola volta nel formato più leggero, ricampionato a 8kHz.
+        """
+        info = self.extract_info(url)
+        candidates = chapter_candidates(info.get('chapters'))
+        duration = info.get('duration')
+        
+        fmt = self._resolve_stream(info)
+        audio_file = None
+        if fmt:
+            input_args = []
+            headers = ''.join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+            if headers:
+                input_args += ['-headers', headers]
+            input_args += ['-i', fmt['url']]
+        else:
+            # Stream a frammenti: scarica l'audio più leggero e analizza il file
+            unique_id = str(uuid.uuid4())
+            artifact_manager.track(os.path.join(self.download_folder, f'{unique_id}_*'), owner=unique_id)
             ydl_opts = {
+                'format': 'worstaudio/worst',
+                'outtmpl': os.path.join(self.download_folder, f'{unique_id}_temp.%(ext)s'),
                 'quiet': True,
                 'no_warnings': True,
             }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                return {
-                    'title': info.get('title', 'Unknown'),
-                    'duration': info.get('duration', 0),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'view_count': info.get('view_count', 0)
-                }
-        except Exception as e:
+            try:
+                audio_file = self._download_audio(info, ydl_opts, unique_id, progress=progress)
+            except Exception:
+                artifact_manager.release(unique_id)
+                raise
+            if not audio_file:
+                artifact_manager.release(unique_id)
+                raise RuntimeError('Download audio non riuscito')
+            input_args = ['-i', audio_file]
+        
+        try:
+            with transcode_pool.slot(), metrics.span('segment_analysis'):
+                levels, silences = analyse_audio(input_args, duration, progress)
+        finally:
+            if audio_file:
+                artifact_manager.release_path(audio_file)
+        return candidates + audio_candidates(levels, silences, min_seconds=app.config['SEGMENT_MIN_SECONDS'])
+    
+    def _resolve_stream(self, info):
+        """Seleziona il formato solo audio e restituisce il formato se leggibile direttamente da ffmpeg"""
+        ydl_opts = {
+            'format': 'worstaudio/worst',
+            'quiet': True,
+            'no_warnings': True,
+        }
+        with metrics.span('youtube_resolve'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            resolved = ydl.process_ie_result(copy.deepcopy(info), download=False)
+        fmt = (resolved.get('requested_formats') or [resolved])[0]
+        # I formati a frammenti DASH richiedono il downloader di yt-dlp
+        if not fmt.get('url') or fmt.get('protocol') not in STREAMABLE_PROTOCOLS:
+            return None
+        return fmt
+    
+    def stream_segment(self, info, start_seconds, duration, encode_args, progress):
+        """Codifica il segmento leggendo lo stream con ffmpeg e raccogliendo l'output dalla pipe.
+
+        Restituisce un SpooledTemporaryFile (in memoria fino a 25MB) oppure None
+        se il formato non è leggibile direttamente.
+        """
+        fmt = self._resolve_stream(info)
+        if not fmt:
             return None
+        
+        ffmpeg_cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-progress', 'pipe:2']
+        headers = ''.join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+        if headers:
+            ffmpeg_cmd += ['-headers', headers]
+        ffmpeg_cmd += [
+            '-ss', str(start_seconds),
+            '-i', fmt['url'],
+            '-t', str(duration),
+            *encode_args,
+            'pipe:1'
+        ]
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        
+        errors = []
+        def read_stderr():
+            # -progress scrive coppie chiave=valore; il resto sono messaggi d'errore
+            for raw_line in process.stderr:
+                line = raw_line.decode('utf-8', errors='replace').strip()
+                key, _, value = line.partition('=')
+                if key == 'out_time_us' and value.isdigit():
+                    progress('downloading', min(100, int(value) / 1e6 * 100 / duration))
+                elif not re.match(r'^[a-z_0-9]+=', line) and line:
+                    errors.append(line)
+        stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+        stderr_thread.start()
+        
+        audio_stream = tempfile.SpooledTemporaryFile(max_size=WHISPER_MAX_BYTES, dir=self.download_folder)
+        try:
+            # Lettura dello stream e codifica avvengono insieme nello stesso ffmpeg
+            with metrics.span('youtube_stream') as stage:
+                for block in iter(lambda: process.stdout.read(64 * 1024), b''):
+                    audio_stream.write(block)
+                process.wait()
+                stderr_thread.join()
+                stage.set(bytes_out=audio_stream.tell())
+                if process.returncode != 0 or audio_stream.tell() == 0:
+                    raise RuntimeError(f"Errore nella conversione audio: {' '.join(errors[-5:])}")
+        except Exception:
+            process.kill()
+            audio_stream.close()
+            raise
+        return audio_stream
+    
+    def _download_audio(self, info, ydl_opts, unique_id, section=None, progress=None):
+        """Scarica l'audio (opzionalmente solo la sezione start-end) e restituisce il percorso"""
+        opts = dict(ydl_opts)
+        if progress:
+            def hook(d):
+                if d.get('status') == 'downloading':
+                    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                    if total:
+                        progress('downloading', d.get('downloaded_bytes', 0) * 100 / total)
+            opts['progress_hooks'] = [hook]
+        if section:
+            # yt-dlp legge con ffmpeg -ss/-to direttamente dallo stream,
+            # scaricando solo i frammenti che coprono il segmento
+            opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [section])
+        with metrics.span('youtube_download', ranged=bool(section)) as stage:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                # Riusa le info già estratte: nessuna nuova richiesta alla pagina del video
+                ydl.process_ie_result(copy.deepcopy(info), download=True)
+            
+            downloaded_files = [f for f in os.listdir(self.download_folder) if f.startswith(f"{unique_id}_temp")]
+            if not downloaded_files:
+                stage.ok = False
+                return None
+            path = os.path.join(self.download_folder, downloaded_files[0])
+            stage.set(bytes_in=os.path.getsize(path))
+            return path
     
-    def download_and_extract_segment(self, url, start_time, end_time, language="it"):
+    def download_and_extract_segment(self, url, start_time, end_time, language="it", range_download=None,
+                                     progress=None, streaming=None):
         """Scarica e estrae segmento audio da YouTube"""
+        if progress is None:
+            progress = lambda stage, percent=None, message=None: None
+        if range_download is None:
+            range_download = app.config['YOUTUBE_RANGE_DOWNLOAD']
+        use_streaming = app.config['YOUTUBE_STREAMING'] if streaming is None else streaming
+        unique_id = None
         try:
             start_seconds = parse_time_to_seconds(start_time)
             end_seconds = parse_time_to_seconds(end_time)
@@ -155,29 +626,54 @@ class YouTubeProcessor:
                 return False, "Tempo di fine deve essere maggiore del tempo di inizio"
             
             duration = end_seconds - start_seconds
-            if duration > 3600:  # Max 1 ora
-                return False, "Segmento troppo lungo (max 1 ora)"
+            max_duration = app.config['MAX_SEGMENT_SECONDS']
+            if duration > max_duration:
+                return False, f"Segmento troppo lungo (max {seconds_to_hhmmss(max_duration)})"
             
-            # Genera nomi file unici
+            # Genera nomi file unici, registrati prima di crearli: se il processo
+            # si interrompe vengono recuperati al riavvio
             unique_id = str(uuid.uuid4())
+            artifact_manager.track(os.path.join(self.download_folder, f"{unique_id}_*"), owner=unique_id)
             temp_audio = os.path.join(self.download_folder, f"{unique_id}_temp.%(ext)s")
-            final_audio = os.path.join(self.download_folder, f"{unique_id}_final.mp3")
             
-            # Calcola bitrate ottimale per rimanere sotto i 25MB
-            target_size_mb = 23  # Margine di sicurezza
-            target_size_bytes = target_size_mb * 1024 * 1024
-            bitrate = min(128, max(32, (target_size_bytes * 8) // (duration * 1000)))
+            # Profilo vocale e bitrate scelti per stare sotto i 25MB; i segmenti troppo
+            # lunghi anche al bitrate minimo vengono trascritti a chunk
+            profile, bitrate, encode_args = encoding_for(duration)
+            extension = profile_extension(profile)
+            final_audio = os.path.join(self.download_folder, f"{unique_id}_final.{extension}")
             
-            # 1. Ottieni info video per capire se era una live
-            ydl_info_opts = {
-                'quiet': True,
-                'no_warnings': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_info_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                is_live = info.get('is_live') or info.get('was_live') or False
+            progress('downloading', message='Download audio in corso...')
+            
+            # 1. Ottieni info video (dalla cache se già estratte) per capire se era una live
+            info = self.extract_info(url)
+            is_live = (
+                info.get('is_live') or info.get('was_live')
+                or info.get('live_status') in ('is_live', 'was_live', 'post_live')
+            )
+            
+            # 2. Streaming: ffmpeg legge solo il segmento e l'audio resta in un buffer
+            if use_streaming:
+                try:
+                    audio_stream = self.stream_segment(info, start_seconds, duration, encode_args, progress)
+                except Exception:
+                    audio_stream = None  # Ripiega sul download su file
+                if audio_stream:
+                    artifact_manager.release(unique_id)
+                    file_size = audio_stream.tell()
+                    audio_stream.seek(0)
+                    return True, {
+                        'file_path': None,
+                        'audio_stream': audio_stream,
+                        'file_name': f"{unique_id}.{extension}",
+                        'file_size': file_size,
+                        'duration': duration,
+                        'bitrate': bitrate,
+                        'profile': profile,
+                        'start_time': seconds_to_hhmmss(start_seconds),
+                        'end_time': seconds_to_hhmmss(end_seconds)
+                    }
             
-            # 2. Configura yt-dlp per scaricare solo audio
+            # 3. Configura yt-dlp per scaricare solo audio
             ydl_opts = {
                 'format': 'worstaudio/worst',
                 'outtmpl': temp_audio,
@@ -189,82 +685,169 @@ class YouTubeProcessor:
             if is_live:
                 ydl_opts['hls_use_mpegts'] = True
             
-            # Scarica il video
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            # Scarica solo l'intervallo richiesto; in caso di errore ripiega sul download completo
+            downloaded_file = None
+            seek_seconds = start_seconds
+            if range_download:
+                try:
+                    downloaded_file = self._download_audio(
+                        info, ydl_opts, unique_id, section=(start_seconds, end_seconds), progress=progress
+                    )
+                    # Il file scaricato inizia già da start_seconds
+                    seek_seconds = 0
+                except Exception:
+                    downloaded_file = None
+                if not downloaded_file:
+                    seek_seconds = start_seconds
+                    for f in os.listdir(self.download_folder):
+                        if f.startswith(f"{unique_id}_temp"):
+                            os.remove(os.path.join(self.download_folder, f))
             
-            # Trova il file scaricato
-            downloaded_files = [f for f in os.listdir(self.download_folder) if f.startswith(f"{unique_id}_temp")]
-            if not downloaded_files:
+            if not downloaded_file:
+                downloaded_file = self._download_audio(info, ydl_opts, unique_id, progress=progress)
+            if not downloaded_file:
+                artifact_manager.release(unique_id)
                 return False, "Errore nel download del video"
             
-            downloaded_file = os.path.join(self.download_folder, downloaded_files[0])
+            progress('cutting', message='Estrazione segmento audio...')
             
-            # Estrai segmento e converti in MP3 con ffmpeg
+            # Estrai segmento e converti con il profilo vocale scelto
             ffmpeg_cmd = [
                 'ffmpeg', '-y',
-                '-ss', str(start_seconds),
+                '-ss', str(seek_seconds),
                 '-i', downloaded_file,
                 '-t', str(duration),
-                '-acodec', 'mp3',
-                '-ab', f'{bitrate}k',
-                '-ac', '1',  # Mono per risparmiare spazio
-                '-ar', '22050',  # Sample rate ridotto ma sufficiente per speech
+                *encode_args,
                 final_audio
             ]
             
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+            with transcode_pool.slot(), metrics.span('ffmpeg_cut', bytes_in=os.path.getsize(downloaded_file)) as stage:
+                result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+                stage.ok = result.returncode == 0
+                if stage.ok and os.path.exists(final_audio):
+                    stage.set(bytes_out=os.path.getsize(final_audio))
             
             # Rimuovi file temporaneo
             if os.path.exists(downloaded_file):
                 os.remove(downloaded_file)
             
             if result.returncode != 0:
+                artifact_manager.release(unique_id)
                 return False, f"Errore nella conversione audio: {result.stderr}"
             
-            # Verifica dimensioni file finale
             if os.path.exists(final_audio):
                 file_size = os.path.getsize(final_audio)
-                if file_size > 25 * 1024 * 1024:
-                    os.remove(final_audio)
-                    return False, "File risultante troppo grande, riduci la durata del segmento"
-                
                 return True, {
                     'file_path': final_audio,
                     'file_size': file_size,
                     'duration': duration,
                     'bitrate': bitrate,
+                    'profile': profile,
                     'start_time': seconds_to_hhmmss(start_seconds),
                     'end_time': seconds_to_hhmmss(end_seconds)
                 }
             else:
+                artifact_manager.release(unique_id)
                 return False, "Errore nella creazione del file audio"
                 
         except Exception as e:
+            if unique_id:
+                artifact_manager.release(unique_id)
             return False, f"Errore nell'elaborazione: {str(e)}"
-    
-    def cleanup_old_files(self):
-        """Pulisce file più vecchi di 1 ora"""
-        try:
-            current_time = datetime.now().timestamp()
-            for filename in os.listdir(self.download_folder):
-                filepath = os.path.join(self.download_folder, filename)
-                if os.path.isfile(filepath):
-                    file_time = os.path.getctime(filepath)
-                    if current_time - file_time > 3600:  # 1 ora
-                        os.remove(filepath)
-        except Exception:
-            pass
 
 class FacebookPostGenerator:
+    MODEL = "gpt-4.5-preview"
+    # Versione del prompt e parametri fanno parte della chiave dei post memorizzati:
+    # incrementare PROMPT_VERSION a ogni modifica del prompt
+    PROMPT_VERSION = 1
+    PARAMS = {'max_tokens': 1000, 'temperature': 0.8, 'presence_penalty': 0.2, 'frequency_penalty': 0.2}
+    # Da incrementare quando cambiano la selezione estrattiva o il prompt di riassunto
+    COMPACTION_VERSION = 1
+
     def __init__(self, openai_client):
         self.client = openai_client
 
-    def generate_facebook_post(self, transcribed_text, topic_hint=""):
-        """Genera un post Facebook ottimizzato dal testo trascritto"""
+    def compaction_settings(self):
+        return {
+            'mode': app.config['POST_COMPACTION'],
+            'max_tokens': app.config['POST_INPUT_MAX_TOKENS'],
+            'target_tokens': app.config['POST_COMPACTION_TARGET_TOKENS'],
+            'summary_model': app.config['POST_SUMMARY_MODEL']
+        }
+
+    def memo_key(self, transcribed_text, topic_hint=""):
+        params = {**self.PARAMS, 'compaction': self.compaction_settings()}
+        return generation_key('post', self.MODEL, self.PROMPT_VERSION, params, transcribed_text, topic_hint)
+
+    def condense(self, transcribed_text):
+        """Materiale da inviare al modello del post.
+
+        Sotto POST_INPUT_MAX_TOKENS la trascrizione resta intera, oltre viene
+        ridotta a circa POST_COMPACTION_TARGET_TOKENS (risultato memorizzato).
+        Restituisce {'text', 'method', 'tokens_before', 'tokens_after'}; method è None se non compattata.
+        """
+        settings = self.compaction_settings()
+        tokens = count_tokens(transcribed_text, self.MODEL)
+        if settings['mode'] == 'off' or tokens <= settings['max_tokens']:
+            return {'text': transcribed_text, 'method': None, 'tokens_before': tokens, 'tokens_after': tokens}
+        key = generation_key('condense', self.MODEL, self.COMPACTION_VERSION, settings, transcribed_text)
+        stored = generation_store.get(key)
+        if stored:
+            return stored['value']
+
+        method = 'map_reduce' if settings['mode'] == 'map_reduce' else 'extractive'
+        with metrics.span('transcript_compaction', method=method, tokens_in=tokens) as stage:
+            if method == 'map_reduce':
+                text = self._map_reduce(transcribed_text, settings['target_tokens'])
+            else:
+                text = extractive_summary(transcribed_text, settings['target_tokens'], self.MODEL)
+            condensed_tokens = count_tokens(text, self.MODEL)
+            stage.set(tokens_out=condensed_tokens)
+        metrics.COMPACTION_SAVED_TOKENS.inc(max(0, tokens - condensed_tokens), method=method)
+        result = {'text': text, 'method': method, 'tokens_before': tokens, 'tokens_after': condensed_tokens}
+        generation_store.put(key, result)
+        return result
+
+    def _map_reduce(self, transcribed_text, target_tokens):
+        """Riassume i blocchi in parallelo con POST_SUMMARY_MODEL; i riassunti in ordine sono il materiale del post"""
+        chunks = split_chunks(transcribed_text, app.config['POST_SUMMARY_CHUNK_TOKENS'], self.MODEL)
+        budget = max(150, target_tokens // len(chunks))
+        with ThreadPoolExecutor(max_workers=max(1, min(len(chunks), app.config['POST_SUMMARY_CONCURRENCY']))) as pool:
+            futures = [pool.submit(metrics.bind(self._summarize_chunk), chunk, budget) for chunk in chunks]
+            return '\n\n'.join(future.result() for future in futures)
+
+    def _summarize_chunk(self, chunk, budget_tokens):
+        """Riassunto di un blocco; se la chiamata fallisce resta la selezione estrattiva del blocco"""
+        model = app.config['POST_SUMMARY_MODEL']
         try:
-            # Prompt specifico per post Facebook con le nuove linee guida
-            system_prompt = """Sei un esperto copywriter specializzato in content marketing per Facebook, con focus su contenuti spirituali e motivazionali.
+            with metrics.span('gpt_condense') as stage:
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": (
+                                "Riceverai una parte della trascrizione di una predicazione. "
+                                f"Riassumila nella stessa lingua in al massimo {budget_tokens * 3 // 4} parole, conservando "
+                                "citazioni bibliche con il riferimento, le frasi più forti riportate testualmente tra virgolette, "
+                                "esempi e storie concrete e le applicazioni pratiche. "
+                                "Rispondi SOLO con il riassunto, senza introduzioni."
+                            )
+                        },
+                        {"role": "user", "content": chunk}
+                    ],
+                    max_tokens=budget_tokens + 100,
+                    temperature=0.3
+                )
+                stage.set(tokens=metrics.record_usage(model, response.usage))
+            return response.choices[0].message.content.strip()
+        except Exception:
+            return extractive_summary(chunk, budget_tokens, self.MODEL)
+
+    def _build_messages(self, transcribed_text, topic_hint="", avoid=""):
+        """Prompt di sistema e utente per la generazione del post (avoid: aperture e hashtag da non ripetere)"""
+        # Prompt specifico per post Facebook con le nuove linee guida
+        system_prompt = """Sei un esperto copywriter specializzato in content marketing per Facebook, con focus su contenuti spirituali e motivazionali.
 Il tuo compito è trasformare trascrizioni audio in post Facebook coinvolgenti e ottimizzati.
 
 REGOLE FONDAMENTALI:
@@ -304,7 +887,7 @@ IMPORTANTE:
 - Le emoji devono essere pertinenti, non decorative
 - La domanda finale deve essere profonda ma accessibile"""
 
-            user_prompt = f"""Trascrizione da elaborare:
+        user_prompt = f"""Trascrizione da elaborare:
 {transcribed_text}
 
 {f'Argomento/Contesto: {topic_hint}' if topic_hint else ''}
@@ -317,94 +900,564 @@ RICORDA:
 - Chiudi con domanda di riflessione
 
 Crea il post seguendo ESATTAMENTE la struttura richiesta."""
+        if avoid:
+            user_prompt += f"\n\n{avoid}"
 
-            response = self.client.chat.completions.create(
-                model="gpt-4.5-preview",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.8,
-                presence_penalty=0.2,
-                frequency_penalty=0.2
-            )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
 
-            post_content = response.choices[0].message.content
+    def _finalize(self, post_content):
+        """Tronca i post troppo lunghi"""
+        word_count = len(post_content.split())
+        if word_count > 450:
+            words = post_content.split()[:400]
+            post_content = ' '.join(words) + "\n\n[Post abbreviato per ottimizzare l'engagement]"
+        return post_content
 
-            word_count = len(post_content.split())
-            if word_count > 450:
-                words = post_content.split()[:400]
-                post_content = ' '.join(words) + "\n\n[Post abbreviato per ottimizzare l'engagement]"
+    def generate_facebook_post(self, transcribed_text, topic_hint="", fresh=False, variant=None):
+        """Genera un post Facebook ottimizzato dal testo trascritto.
 
-            return True, post_content
+        Se il post è troppo simile a uno recente dello storico viene rigenerato
+        (fino a POST_DEDUP_RETRIES volte) chiedendo di evitare aperture e hashtag già usati.
+        Per un input già elaborato restituisce il post memorizzato (l'ultima
+        variante o quella richiesta); fresh genera una nuova variante.
+        Le trascrizioni lunghe arrivano al modello già compattate (condense).
+        """
+        key = self.memo_key(transcribed_text, topic_hint)
+        if not fresh:
+            stored = generation_store.get(key, variant)
+            if stored:
+                return True, stored['value']
+            if variant is not None:
+                return False, 'Versione del post non disponibile'
+        material = self.condense(transcribed_text)['text']
+        avoid = ""
+        best = None
+        for attempt in range(app.config['POST_DEDUP_RETRIES'] + 1):
+            try:
+                with metrics.span('gpt_post') as stage:
+                    response = self.client.chat.completions.create(
+                        model=self.MODEL,
+                        messages=self._build_messages(material, topic_hint, avoid),
+                        **self.PARAMS
+                    )
+                    stage.set(tokens=metrics.record_usage(self.MODEL, response.usage))
+            except Exception as e:
+                if best:
+                    break  # Resta il miglior post già ottenuto
+                return False, f"Errore nella generazione del post: {str(e)}"
 
-        except Exception as e:
-            return False, f"Errore nella generazione del post: {str(e)}"
+            post_content = self._finalize(response.choices[0].message.content)
+            check = post_history.check(post_content)
+            if best is None or check['score'] < best[1]['score']:
+                best = (post_content, check)
+            if not check['duplicate']:
+                break
+            metrics.RETRIES.inc(stage='gpt_post', reason='duplicate')
+            avoid = post_history.avoid_prompt(check)
+
+        post_history.add(best[0])
+        generation_store.put(key, best[0])
+        return True, best[0]
+
+    def stream_facebook_post(self, transcribed_text, topic_hint="", fresh=False, variant=None):
+        """Genera il post in streaming.
+
+        Produce tuple ('delta', testo) man mano che arrivano i token,
+        ('retry', controllo) quando il post somiglia troppo a uno recente e viene
+        rigenerato, poi ('done', post_finale) oppure ('error', messaggio).
+        Un post memorizzato arriva subito come ('done', post).
+        """
+        key = self.memo_key(transcribed_text, topic_hint)
+        if not fresh:
+            stored = generation_store.get(key, variant)
+            if stored:
+                yield 'done', stored['value']
+                return
+            if variant is not None:
+                yield 'error', 'Versione del post non disponibile'
+                return
+        material = self.condense(transcribed_text)['text']
+        avoid = ""
+        best = None
+        for attempt in range(app.config['POST_DEDUP_RETRIES'] + 1):
+            try:
+                with metrics.span('gpt_post', stream=True) as stage:
+                    stream = self.client.chat.completions.create(
+                        model=self.MODEL,
+                        messages=self._build_messages(material, topic_hint, avoid),
+                        **self.PARAMS,
+                        stream=True,
+                        # L'ultimo chunk riporta i token usati
+                        stream_options={"include_usage": True}
+                    )
+                    parts = []
+                    for chunk in stream:
+                        if getattr(chunk, 'usage', None):
+                            stage.set(tokens=metrics.record_usage(self.MODEL, chunk.usage))
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            yield 'delta', delta
+            except Exception as e:
+                if best:
+                    break
+                yield 'error', f"Errore nella generazione del post: {str(e)}"
+                return
+
+            post_content = self._finalize(''.join(parts))
+            check = post_history.check(post_content)
+            if best is None or check['score'] < best[1]['score']:
+                best = (post_content, check)
+            if not check['duplicate'] or attempt == app.config['POST_DEDUP_RETRIES']:
+                break
+            metrics.RETRIES.inc(stage='gpt_post', reason='duplicate')
+            avoid = post_history.avoid_prompt(check)
+            yield 'retry', check
+
+        post_history.add(best[0])
+        generation_store.put(key, best[0])
+        yield 'done', best[0]
 
 # in app.py
 # Sostituisca l'INTERA classe ImageGenerator con questa versione aggiornata
 
 class ImageGenerator:
+    # Descrizione del testo in ingresso per l'estrazione del prompt
+    SOURCES = {
+        'post': "Riceverai il testo di un post Facebook. ",
+        'transcription': "Riceverai la trascrizione di una predicazione. ",
+    }
+    PROMPT_MODEL = "gpt-4.5-preview"
+    IMAGE_MODEL = "gpt-image-1"
+    # Come per i post: incrementare a ogni modifica del prompt di estrazione
+    PROMPT_VERSION = 1
+    IMAGE_PARAMS = {
+        'size': "1024x1536",
+        'quality': "high",
+        'background': "auto",
+        'output_format': "png",
+        'output_compression': 100,
+        'moderation': "auto"
+    }
+
     def __init__(self, openai_client):
         self.client = openai_client
 
-    def generate_image_from_summary(self, facebook_post_text):
+    def extract_image_prompt(self, text, source='post', fresh=False):
+        """Estrae dal testo un prompt di immagine compatto con gpt-4.5-preview (memorizzato per testo e sorgente)"""
+        key = generation_key('image_prompt', self.PROMPT_MODEL, self.PROMPT_VERSION, {}, text, source)
+        stored = None if fresh else generation_store.get(key)
+        if stored:
+            return True, stored['value']
         try:
-            prompt_response = self.client.chat.completions.create(
-                model="gpt-4.5-preview",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Riceverai il testo di un post Facebook. "+
-                            "Estrai SOLO le informazioni essenziali per generare un prompt di immagine compatto seguendo questa pipeline: "
-                            "[Soggetto + dettagli] + [Azione/Posa] + [Ambiente/Contesto] + [Illuminazione] + [Dettagli fotocamera] + stile artistico. "
-                            "Lo stile deve essere sempre: colori vividi, ampie pennellate, nessun fronzolo, nessun elemento allucinato, nessun testo, nessun riferimento a social o grafica. "
-                            "NON generare mai immagini iconografiche di Cristo o del suo volto, né immagini in stile iconografia cattolica. Siamo protestanti e non desideriamo questo tipo di rappresentazione. "
-                            "Rispondi SOLO con il prompt finale, senza spiegazioni."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": facebook_post_text
-                    }
-                ]
-            )
+            with metrics.span('gpt_image_prompt') as stage:
+                prompt_response = self.client.chat.completions.create(
+                    model=self.PROMPT_MODEL,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": (
+                                self.SOURCES.get(source, self.SOURCES['post'])+
+                                "Estrai SOLO le informazioni essenziali per generare un prompt di immagine compatto seguendo questa pipeline: "
+                                "[Soggetto + dettagli] + [Azione/Posa] + [Ambiente/Contesto] + [Illuminazione] + [Dettagli fotocamera] + stile artistico. "
+                                "Lo stile deve essere sempre: colori vividi, ampie pennellate, nessun fronzolo, nessun elemento allucinato, nessun testo, nessun riferimento a social o grafica. "
+                                "NON generare mai immagini iconografiche di Cristo o del suo volto, né immagini in stile iconografia cattolica. Siamo protestanti e non desideriamo questo tipo di rappresentazione. "
+                                "Rispondi SOLO con il prompt finale, senza spiegazioni."
+                            )
+                        },
+                        {
+                            "role": "user",
+                            "content": text
+                        }
+                    ]
+                )
+                stage.set(tokens=metrics.record_usage(self.PROMPT_MODEL, prompt_response.usage))
             prompt = prompt_response.choices[0].message.content.strip()
-            image_response = self.client.images.generate(
-                model="gpt-image-1",
-                prompt=prompt,
-                n=1,
-                size="1024x1536",
-                quality="high",
-                background="auto",
-                output_format="png",
-                output_compression=100,
-                moderation="auto"
-            )
+        except Exception as e:
+            return False, str(e)
+        generation_store.put(key, prompt)
+        return True, prompt
+
+    def render_image(self, prompt):
+        """Genera l'immagine con gpt-image-1, restituisce il base64 del PNG"""
+        success, images = self.render_images(prompt, 1, self.IMAGE_PARAMS)
+        return (True, images[0]) if success else (False, images)
+
+    def render_images(self, prompt, n, params, reference=None, stage_name='image_render'):
+        """n immagini (base64) in una sola chiamata; reference = (percorso, mimetype) di un'immagine da rifinire"""
+        try:
+            with metrics.span(stage_name, quality=params['quality'], images=n) as stage:
+                if reference:
+                    path, mimetype = reference
+                    with open(path, 'rb') as f:
+                        image_response = self.client.images.edit(
+                            model=self.IMAGE_MODEL,
+                            image=(os.path.basename(path), f.read(), mimetype),
+                            prompt=prompt,
+                            n=n,
+                            # L'edit non accetta moderation
+                            **{name: value for name, value in params.items() if name != 'moderation'}
+                        )
+                else:
+                    image_response = self.client.images.generate(
+                        model=self.IMAGE_MODEL,
+                        prompt=prompt,
+                        n=n,
+                        **params
+                    )
+                if getattr(image_response, 'usage', None):
+                    stage.set(tokens=metrics.record_usage(self.IMAGE_MODEL, image_response.usage))
+                if getattr(image_response, 'data', None):
+                    stage.set(bytes_out=sum(len(item.b64_json or '') for item in image_response.data) * 3 // 4)
             if (
                 image_response
                 and hasattr(image_response, "data")
                 and isinstance(image_response.data, list)
                 and len(image_response.data) > 0
-                and hasattr(image_response.data[0], "b64_json")
+                and all(getattr(item, "b64_json", None) for item in image_response.data)
             ):
-                return True, (image_response.data[0].b64_json, prompt)
+                return True, [item.b64_json for item in image_response.data]
             else:
                 return False, "Risposta inattesa dall'API immagini"
         except Exception as e:
             return False, str(e)
 
+    def generate_image_from_summary(self, facebook_post_text):
+        success, prompt = self.extract_image_prompt(facebook_post_text)
+        if not success:
+            return False, prompt
+        success, b64_img = self.render_image(prompt)
+        if not success:
+            return False, b64_img
+        return True, (b64_img, prompt)
+
+    def memo_key(self, text, source='post'):
+        return generation_key(
+            'image', [self.PROMPT_MODEL, self.IMAGE_MODEL], self.PROMPT_VERSION, self.IMAGE_PARAMS, text, source
+        )
+
+    def generate_image(self, text, source='post', fresh=False, variant=None):
+        """Prompt + immagine salvata nell'archivio; restituisce (success, image_data).
+
+        Per un testo già illustrato restituisce l'immagine memorizzata (l'ultima
+        variante o quella richiesta) se è ancora nell'archivio.
+        """
+        key = self.memo_key(text, source)
+        if not fresh:
+            stored = generation_store.get(key, variant)
+            if stored and image_store.original_path(stored['value']['image_id']):
+                return True, stored['value']
+            if stored:
+                # Immagine eliminata dall'archivio: la variante non è più utilizzabile
+                generation_store.discard(key, stored['variant'])
+            if variant is not None:
+                return False, 'Versione dell\'immagine non disponibile'
+        success, prompt = self.extract_image_prompt(text, source, fresh)
+        if not success:
+            return False, prompt
+        success, b64_img = self.render_image(prompt)
+        if not success:
+            return False, b64_img
+        image_data = store_generated_image(b64_img, prompt)
+        generation_store.put(key, image_data)
+        return True, image_data
+
+    def draft_params(self):
+        """Bozze: stessa inquadratura dell'immagine finale, qualità bassa e JPEG leggero"""
+        return {
+            **self.IMAGE_PARAMS,
+            'quality': app.config['IMAGE_DRAFT_QUALITY'],
+            'output_format': "jpeg",
+            'output_compression': 80
+        }
+
+    def drafts_key(self, text, source='post'):
+        return generation_key(
+            'image_drafts', [self.PROMPT_MODEL, self.IMAGE_MODEL], self.PROMPT_VERSION,
+            {**self.draft_params(), 'n': app.config['IMAGE_DRAFT_COUNT']}, text, source
+        )
+
+    def generate_drafts(self, text, source='post', fresh=False, variant=None):
+        """Prompt + IMAGE_DRAFT_COUNT bozze economiche in una sola chiamata; restituisce (success, voce).
+
+        voce = {'value': {'prompt', 'drafts', 'image_key'}, 'variant', ...}
+        come in GenerationStore: la chiave delle bozze, l'identificativo della
+        variante e la posizione della bozza scelta bastano a finalize_image.
+        """
+        key = self.drafts_key(text, source)
+        if not fresh:
+            stored = generation_store.get(key, variant)
+            if stored and all(image_store.original_path(draft['image_id']) for draft in stored['value']['drafts']):
+                return True, stored
+            if stored:
+                generation_store.discard(key, stored['variant'])
+            if variant is not None:
+                return False, 'Versione delle bozze non disponibile'
+        success, prompt = self.extract_image_prompt(text, source, fresh)
+        if not success:
+            return False, prompt
+        success, images = self.render_images(
+            prompt, app.config['IMAGE_DRAFT_COUNT'], self.draft_params(), stage_name='image_draft'
+        )
+        if not success:
+            return False, images
+        drafts = [store_generated_image(b64_img, prompt, 'jpeg') for b64_img in images]
+        return True, generation_store.put(
+            key, {'prompt': prompt, 'drafts': drafts, 'image_key': self.memo_key(text, source)}
+        )
+
+    def final_key(self, draft_id, from_draft):
+        return generation_key(
+            'image_final', self.IMAGE_MODEL, self.PROMPT_VERSION, {**self.IMAGE_PARAMS, 'from_draft': from_draft},
+            draft_id
+        )
+
+    def finalize_image(self, drafts_key, variant, index, fresh=False):
+        """Immagine in alta qualità della bozza scelta; restituisce (success, image_data).
+
+        Con IMAGE_FINAL_FROM_DRAFT la bozza fa da riferimento (edit), così
+        composizione e soggetto restano quelli scelti dall'operatore.
+        """
+        # Sempre la variante indicata: con None get restituirebbe l'ultima, cioè un altro gruppo di bozze
+        stored = generation_store.get(drafts_key, variant) if variant is not None else None
+        if not stored or not 0 <= index < len(stored['value']['drafts']):
+            return False, 'Bozza non trovata, genera nuove bozze'
+        drafts = stored['value']
+        draft = drafts['drafts'][index]
+        from_draft = app.config['IMAGE_FINAL_FROM_DRAFT']
+        key = self.final_key(draft['image_id'], from_draft)
+        if not fresh:
+            final = generation_store.get(key)
+            if final and image_store.original_path(final['value']['image_id']):
+                return True, final['value']
+        reference = image_store.get(draft['image_id']) if from_draft else None
+        if from_draft and not reference:
+            return False, 'Bozza non più disponibile, genera nuove bozze'
+        success, images = self.render_images(drafts['prompt'], 1, self.IMAGE_PARAMS, reference)
+        if not success:
+            return False, images
+        image_data = store_generated_image(images[0], drafts['prompt'])
+        generation_store.put(key, image_data)
+        # Diventa anche l'ultima versione dell'immagine per il testo: generate_image la restituisce senza rigenerarla
+        generation_store.put(drafts['image_key'], image_data)
+        return True, image_data
+
+class OpenAIServices:
+    """Servizi legati a un client OpenAI (uno per API key, condivisi tra le sessioni)"""
+    def __init__(self, openai_client=None):
+        self.transcription_service = TranscriptionService(openai_client)
+        self.facebook_generator = FacebookPostGenerator(openai_client) if openai_client else None
+        self.image_generator = ImageGenerator(openai_client) if openai_client else None
+
+TRANSCRIPTION_ENGINES = {
+    'openai': 'OpenAI Whisper (API)',
+    'local': 'Whisper locale (CPU)'
+}
+
+def engine_error(name):
+    """Messaggio di errore se il motore non esiste o non è installato, altrimenti None"""
+    if name not in TRANSCRIPTION_ENGINES:
+        return f"Motore di trascrizione non supportato: {name}"
+    if name == 'local' and not local_engine.available():
+        return "Motore locale non disponibile (installa faster-whisper)"
+    return None
+
 # Istanza globale dei servizi
-transcription_service = TranscriptionService()
-youtube_processor = YouTubeProcessor()
-facebook_generator = None  # Inizializzato quando API key è configurata
-image_generator = None     # Inizializzato quando API key è configurata
+artifact_manager = ArtifactManager(
+    os.path.join(app.config['CACHE_FOLDER'], 'artifacts.sqlite3'),
+    roots=[app.config['UPLOAD_FOLDER'], app.config['YOUTUBE_FOLDER']],
+    max_age_seconds=app.config['ARTIFACT_MAX_AGE_HOURS'] * 3600,
+    orphan_grace_seconds=app.config['ARTIFACT_ORPHAN_GRACE'],
+    max_bytes=app.config['ARTIFACT_MAX_MB'] * 1024 * 1024,
+    interval=app.config['ARTIFACT_REAP_INTERVAL']
+)
+# File lasciati da un'esecuzione interrotta, poi pulizia periodica fuori dalle richieste
+artifact_manager.recover()
+artifact_manager.reap()
+artifact_manager.start()
+transcription_cache = TranscriptionCache(
+    os.path.join(app.config['CACHE_FOLDER'], 'transcriptions.sqlite3'),
+    max_bytes=app.config['TRANSCRIPTION_CACHE_MAX_MB'] * 1024 * 1024,
+    max_age_seconds=app.config['TRANSCRIPTION_CACHE_MAX_AGE_DAYS'] * 24 * 3600
+)
+openai_scheduler = OpenAIScheduler(
+    max_retries=app.config['OPENAI_MAX_RETRIES'], max_delay=app.config['OPENAI_RETRY_MAX_DELAY'],
+    # Con più processi quote, pause e priorità sono condivise: la quota della key non viene moltiplicata
+    db_path=os.path.join(
+        app.config['CACHE_FOLDER'], 'openai_scheduler.sqlite3'
+    ) if app.config['SERVER_PROCESSES'] > 1 else None
+) if app.config['OPENAI_SCHEDULER'] else None
+client_registry = ClientRegistry(
+    OpenAIServices,
+    max_clients=app.config['OPENAI_MAX_CLIENTS'],
+    max_connections=app.config['OPENAI_MAX_CONNECTIONS'],
+    timeout=app.config['OPENAI_TIMEOUT'],
+    max_retries=app.config['OPENAI_MAX_RETRIES'],
+    scheduler=openai_scheduler,
+    # Con più processi la sessione può arrivare a un processo che non ha mai visto la key
+    key_store=ApiKeyStore(
+        os.path.join(app.config['CACHE_FOLDER'], 'api_keys.sqlite3'), ttl=app.config['API_KEY_TTL_HOURS'] * 3600
+    ) if app.config['SERVER_PROCESSES'] > 1 else None
+)
+# Ogni scrape può arrivare a un processo diverso: senza somma ognuno vedrebbe solo le proprie metriche
+shared_metrics = metrics.SharedMetrics(
+    app.config['METRICS_DIR'], interval=app.config['METRICS_FLUSH_SECONDS']
+) if app.config['SERVER_PROCESSES'] > 1 else None
+# Senza API key restano disponibili solo le trascrizioni già in cache
+no_key_services = OpenAIServices()
+# API key opzionale da ambiente, usata dalle sessioni che non ne hanno configurata una
+default_key_id = None
+if os.environ.get('OPENAI_API_KEY'):
+    registered, result = client_registry.register(os.environ['OPENAI_API_KEY'], pinned=True)
+    default_key_id = result if registered else None
+post_history = PostHistory(
+    os.path.join(app.config['CACHE_FOLDER'], 'post_history.sqlite3'),
+    max_posts=app.config['POST_HISTORY_MAX'],
+    threshold=app.config['POST_DEDUP_THRESHOLD']
+)
+image_store = ImageStore(app.config['IMAGE_FOLDER'], max_images=app.config['IMAGE_STORE_MAX_IMAGES'])
+generation_store = GenerationStore(
+    os.path.join(app.config['CACHE_FOLDER'], 'generations.sqlite3'),
+    max_bytes=app.config['GENERATION_STORE_MAX_MB'] * 1024 * 1024,
+    max_variants=app.config['GENERATION_MAX_VARIANTS']
+)
+youtube_processor = YouTubeProcessor(info_ttl=app.config['YOUTUBE_INFO_TTL'])
+job_manager = JobManager(
+    max_workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_MAX_PENDING'],
+    db_path=os.path.join(app.config['CACHE_FOLDER'], 'jobs.sqlite3'),
+    # Un batch dura ore: non deve occupare i worker di trascrizioni e immagini
+    pools={'batch': app.config['BATCH_JOB_WORKERS'], 'segments': app.config['SEGMENT_JOB_WORKERS']}
+)
+# Analisi dei segmenti in corso per video: aprire di nuovo lo stesso URL non ne accoda un'altra
+segment_jobs = {}
+segment_jobs_lock = threading.Lock()
+# Posti per ffmpeg e Whisper locale condivisi da tutti i processi del server tramite file di lock
+transcode_pool = WorkerSlots(
+    'transcode', app.config['TRANSCODE_WORKERS'], lock_dir=os.path.join(app.config['CACHE_FOLDER'], 'locks')
+)
+# Modello locale caricato alla prima trascrizione e condiviso da tutte le sessioni
+local_engine = FasterWhisperEngine(
+    app.config['LOCAL_WHISPER_MODEL'],
+    compute_type=app.config['LOCAL_WHISPER_COMPUTE_TYPE'],
+    cpu_threads=app.config['LOCAL_WHISPER_THREADS'],
+    batch_size=app.config['LOCAL_WHISPER_BATCH_SIZE'],
+    download_root=os.path.join(app.config['CACHE_FOLDER'], 'models'),
+    # Il modello usa già tutti i core: una trascrizione locale alla volta sull'intera macchina
+    run_slots=WorkerSlots('local_whisper', 1, lock_dir=os.path.join(app.config['CACHE_FOLDER'], 'locks'))
+)
+# Condiviso tra tutti i batch: i limiti RPM/TPM sono per organizzazione OpenAI
+# Con più processi ognuno riceve la sua parte, così la somma resta entro BATCH_RPM/BATCH_TPM
+batch_limiter = RateLimiter(
+    app.config['BATCH_RPM'] / max(1, app.config['SERVER_PROCESSES']) or None,
+    app.config['BATCH_TPM'] / max(1, app.config['SERVER_PROCESSES']) or None
+)
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    os.path.join(app.config['CACHE_FOLDER'], 'uploads.sqlite3'),
+    max_bytes=app.config['UPLOAD_MAX_MB'] * 1024 * 1024,
+    chunk_size=app.config['UPLOAD_CHUNK_MB'] * 1024 * 1024,
+    ttl=app.config['UPLOAD_RESUME_HOURS'] * 3600
+)
+
+# Route che ricevono file audio: solo queste accettano body fino a UPLOAD_MAX_MB
+UPLOAD_ENDPOINTS = {'transcribe_file', 'submit_file_job', 'append_upload'}
+
+class UploadRequest(Request):
+    """I file multipart vengono scritti direttamente nella cartella degli upload, verificati durante la lettura"""
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint in UPLOAD_ENDPOINTS:
+            return app.config['UPLOAD_MAX_MB'] * 1024 * 1024
+        return super().max_content_length
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        unique_id = str(uuid.uuid4())
+        # Copre il file ricevuto, quello rinominato e la versione ricodificata (<id>_<nome>_encoded.<ext>)
+        artifact_manager.track(os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_id}_*"), owner=unique_id)
+        error = None
+        if filename and not allowed_file(filename):
+            error = f'Formato non supportato. Usa: {", ".join(ALLOWED_EXTENSIONS)}'
+        sink = UploadSink(
+            os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_id}_upload.part"),
+            max_bytes=self.max_content_length, owner=unique_id, error=error
+        )
+        g.setdefault('upload_sinks', []).append(sink)
+        return sink
+
+app.request_class = UploadRequest
+
+def current_services():
+    """Servizi OpenAI della sessione corrente (API key scelta dall'operatore)"""
+    key_id = session.get('openai_key_id')
+    if key_id:
+        entry = client_registry.get(key_id)
+        if not entry:
+            # Uscita dal registro (LRU o riavvio): meglio dirlo che proseguire senza key
+            session.pop('openai_key_id', None)
+            abort(make_response(jsonify({'success': False, 'message': 'API Key scaduta, reinseriscila'}), 401))
+        return entry.services
+    entry = client_registry.get(default_key_id) if default_key_id else None
+    return entry.services if entry else no_key_services
+
+def default_services():
+    """Servizi della API key da ambiente (OPENAI_API_KEY), usati fuori dalle richieste HTTP"""
+    entry = client_registry.get(default_key_id) if default_key_id else None
+    return entry.services if entry else no_key_services
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_spans, g.request_metrics_token = metrics.start_collecting()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    metrics.HTTP_SECONDS.observe(
+        elapsed, endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code
+    )
+    if app.config['METRICS_SERVER_TIMING']:
+        response.headers['Server-Timing'] = metrics.server_timing(g.request_spans, elapsed)
+    return response
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    token = g.pop('request_metrics_token', None)
+    if token is not None:
+        metrics.stop_collecting(token)
+
+@app.teardown_request
+def release_upload_sinks(exc):
+    # File ricevuti ma non passati a un job (richiesta rifiutata o interrotta)
+    for sink in g.pop('upload_sinks', []):
+        sink.close()
+        if not sink.claimed:
+            artifact_manager.release(sink.owner)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    body = shared_metrics.render() if shared_metrics else metrics.REGISTRY.render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    engines = [
+        {'name': name, 'label': label, 'available': engine_error(name) is None}
+        for name, label in TRANSCRIPTION_ENGINES.items()
+    ]
+    return render_template(
+        'index.html', engines=engines, default_engine=app.config['TRANSCRIBE_ENGINE'],
+        upload_max_mb=app.config['UPLOAD_MAX_MB'], image_draft_count=app.config['IMAGE_DRAFT_COUNT']
+    )
 
 @app.route('/api/set-api-key', methods=['POST'])
 def set_api_key():
@@ -414,8 +1467,44 @@ def set_api_key():
     if not api_key:
         return jsonify({'success': False, 'message': 'API Key richiesta'})
     
-    success, message = transcription_service.set_api_key(api_key)
-    return jsonify({'success': success, 'message': message})
+    success, result = client_registry.register(api_key)
+    if not success:
+        return jsonify({'success': False, 'message': result})
+    
+    # In sessione solo l'hash: la key resta nel registro lato server
+    session['openai_key_id'] = result
+    session.permanent = True
+    return jsonify({'success': True, 'message': 'API Key configurata correttamente'})
+
+def detect_segments_pipeline(progress, url):
+    """Job di rilevamento dei segmenti, con risultato conservato in cache per video"""
+    cache_key = segments_cache_key(validate_youtube_url(url))
+    cached = transcription_cache.get(cache_key)
+    if cached:
+        return True, {'segments': json.loads(cached['text'])}
+    progress('analysing', message='Analisi audio in corso...')
+    segments = youtube_processor.detect_segments(url, progress=progress)
+    transcription_cache.put(cache_key, json.dumps(segments))
+    return True, {'segments': segments}
+
+def submit_segments_job(video_id, url):
+    """Id del job di analisi del video: quello già in corso oppure uno nuovo (None se la coda è piena)"""
+    with segment_jobs_lock:
+        job_id = segment_jobs.get(video_id)
+        running = job_manager.get(job_id) if job_id else None
+        if running and not running.to_dict()['finished']:
+            return job_id
+        submitted, job = job_manager.submit('segments', detect_segments_pipeline, url)
+        if not submitted:
+            segment_jobs.pop(video_id, None)
+            return None
+        segment_jobs[video_id] = job.id
+        # Solo i job ancora vivi: il dizionario non cresce con i video visti
+        for other, other_id in list(segment_jobs.items()):
+            other_job = job_manager.get(other_id)
+            if not other_job or other_job.to_dict()['finished']:
+                del segment_jobs[other]
+        return job.id
 
 @app.route('/api/youtube-info', methods=['POST'])
 def get_youtube_info():
@@ -436,6 +1525,17 @@ def get_youtube_info():
     # Converti durata in formato leggibile
     duration_str = seconds_to_hhmmss(info['duration'])
     
+    # Segmenti proposti: dalla cache se il video è già stato analizzato,
+    # altrimenti i capitoli subito e l'analisi audio in un job
+    segments_job_id = None
+    cached = transcription_cache.get(segments_cache_key(video_id))
+    if cached:
+        segments = json.loads(cached['text'])
+    else:
+        segments = chapter_candidates(info['chapters'])
+        if app.config['SEGMENT_DETECTION'] and data.get('detect_segments', True):
+            segments_job_id = submit_segments_job(video_id, url)
+    
     return jsonify({
         'success': True,
         'info': {
@@ -444,167 +1544,585 @@ def get_youtube_info():
             'duration_seconds': info['duration'],
             'uploader': info['uploader'],
             'view_count': info.get('view_count', 0)
-        }
+        },
+        'segments': segments,
+        'segments_job_id': segments_job_id
     })
 
-@app.route('/api/process-youtube', methods=['POST'])
-def process_youtube():
-    data = request.get_json()
+def process_youtube_pipeline(progress, transcription_service, url, start_time, end_time, language, engine=None):
+    """Pipeline YouTube completa: download, taglio, trascrizione e pulizia"""
+    # Segmento già trascritto: risposta immediata senza rete né ffmpeg
+    engine = engine or app.config['TRANSCRIBE_ENGINE']
+    start_seconds = parse_time_to_seconds(start_time)
+    end_seconds = parse_time_to_seconds(end_time)
+    cache_key = youtube_cache_key(validate_youtube_url(url), start_seconds, end_seconds, language, engine)
+    cached = transcription_cache.get(cache_key)
+    if cached:
+        return True, {
+            'text': cached['text'],
+            'timestamp': datetime.now().strftime("%H:%M:%S"),
+            'metadata': {**cached['metadata'], 'cached': True},
+            'transcript_key': cache_key if cached['timing'] else None
+        }
+    
+    # Elabora il video
+    success, result = youtube_processor.download_and_extract_segment(
+        url, start_time, end_time, language, progress=progress
+    )
+    
+    if not success:
+        return False, result
+    
+    # Trascrivi l'audio estratto
+    progress('transcribing', message='Trascrizione in corso...')
+    timed = app.config['TRANSCRIBE_TIMESTAMPS']
+    audio_stream = result.get('audio_stream')
+    if audio_stream:
+        try:
+            success_transcription, transcription_result = transcription_service.transcribe_stream(
+                audio_stream, result['file_name'], language, result['duration'], progress=progress, timed=timed,
+                engine=engine
+            )
+        finally:
+            audio_stream.close()
+    else:
+        audio_file = result['file_path']
+        try:
+            success_transcription, transcription_result = transcription_service.transcribe_audio(
+                audio_file, language, progress=progress, use_cache=False, timed=timed, engine=engine
+            )
+        finally:
+            # Rimuovi file audio temporaneo
+            artifact_manager.release_path(audio_file)
+    
+    if not success_transcription:
+        return False, transcription_result
+    
+    timing = None
+    if timed:
+        # Tempi riferiti al video intero, non al segmento estratto
+        timing = transcription_result.shift(start_seconds).to_dict()
+        transcription_result = transcription_result.text
+    
+    file_size_mb = round(result['file_size'] / (1024 * 1024), 2)
+    metadata = {
+        'source': 'YouTube',
+        'duration': f"{result['duration']}s",
+        'file_size': f"{file_size_mb} MB",
+        'bitrate': f"{result['bitrate']}k",
+        'profile': result['profile'],
+        'engine': engine,
+        'segment': f"{result['start_time']} - {result['end_time']}"
+    }
+    transcription_cache.put(cache_key, transcription_result, metadata, timing)
+    return True, {
+        'text': transcription_result,
+        'timestamp': datetime.now().strftime("%H:%M:%S"),
+        'metadata': metadata,
+        'transcript_key': cache_key if timing else None
+    }
+
+def prepare_upload_audio(file_path, file_size):
+    """Ricodifica con il profilo vocale i file senza perdita o oltre i 25MB.
+
+    Restituisce il percorso da trascrivere (il file originale se non serve
+    ricodificarlo o se ffmpeg non è disponibile).
+    """
+    extension = file_path.rsplit('.', 1)[-1].lower()
+    if extension not in LOSSLESS_EXTENSIONS and file_size <= WHISPER_MAX_BYTES:
+        return file_path
+    try:
+        duration = probe_duration(file_path)
+    except OSError:
+        return file_path
+    if not duration:
+        return file_path
+    
+    profile, bitrate = choose_profile(duration, preferred=app.config['AUDIO_PROFILE'])
+    encoded_path = f"{os.path.splitext(file_path)[0]}_encoded.{profile_extension(profile)}"
+    with transcode_pool.slot(), metrics.span('ffmpeg_transcode', bytes_in=file_size) as stage:
+        success, error = stage.result(transcode_file(
+            file_path, encoded_path, profile, bitrate,
+            trim_silence=app.config['AUDIO_TRIM_SILENCE'],
+            normalize=app.config['AUDIO_NORMALIZE']
+        ))
+        if success:
+            stage.set(bytes_out=os.path.getsize(encoded_path))
+    if not success:
+        if os.path.exists(encoded_path):
+            os.remove(encoded_path)
+        return file_path
+    return encoded_path
+
+def transcribe_file_pipeline(progress, transcription_service, file_path, filename, file_size, language, engine=None,
+                             file_hash=None):
+    """Pipeline upload: ricodifica, trascrizione e rimozione dei temporanei (file_hash: SHA-256 già calcolato)"""
+    engine = engine or app.config['TRANSCRIBE_ENGINE']
+    encoded_path = file_path
+    timed = app.config['TRANSCRIBE_TIMESTAMPS']
+    has_timing = False
+    try:
+        # La cache usa l'hash del file originale: la ricodifica non è deterministica
+        cache_key = file_cache_key(file_hash or hash_file(file_path), language, engine)
+        cached = transcription_cache.get(cache_key)
+        if cached:
+            success, result = True, cached['text']
+            has_timing = bool(cached['timing'])
+        else:
+            progress('encoding', message='Conversione audio...')
+            encoded_path = prepare_upload_audio(file_path, file_size)
+            progress('transcribing', message='Trascrizione in corso...')
+            success, result = transcription_service.transcribe_audio(
+                encoded_path, language, progress=progress, use_cache=False, timed=timed, engine=engine
+            )
+            if success and timed:
+                transcription_cache.put(cache_key, result.text, timing=result.to_dict())
+                result, has_timing = result.text, True
+            elif success:
+                transcription_cache.put(cache_key, result)
+    finally:
+        # Rimuovi i file temporanei (originale e ricodificato)
+        artifact_manager.release_path(file_path)
+    
+    if not success:
+        return False, result
+    
+    file_size_mb = round(file_size / (1024 * 1024), 2)
+    return True, {
+        'text': result,
+        'timestamp': datetime.now().strftime("%H:%M:%S"),
+        'filename': filename,
+        'file_size': f"{file_size_mb} MB",
+        'transcript_key': cache_key if has_timing else None
+    }
+
+def no_progress(stage, percent=None, message=None):
+    pass
+
+def build_batch_stages(services, generate_image=True, engine=None):
+    """Fasi della pipeline in blocco: YouTube -> trascrizione -> post -> immagine"""
+    engine = engine or app.config['TRANSCRIBE_ENGINE']
+    
+    def transcribe(item):
+        if not validate_youtube_url(item['url']):
+            return False, 'URL YouTube non valido'
+        if not item['start_time'] or not item['end_time']:
+            return False, 'Tempo di inizio e fine sono richiesti'
+        return process_youtube_pipeline(
+            no_progress, services.transcription_service,
+            item['url'], item['start_time'], item['end_time'], item['language'], engine
+        )
+    
+    def post(item, text):
+        success, result = services.facebook_generator.generate_facebook_post(text, item['topic_hint'])
+        if not success:
+            return False, result
+        # Stessa chiave della pipeline YouTube: i tempi salvati puntano il link alla citazione
+        transcript_key = youtube_cache_key(
+            validate_youtube_url(item['url']), parse_time_to_seconds(item['start_time']),
+            parse_time_to_seconds(item['end_time']), item['language'], engine
+        )
+        return True, append_youtube_link(result, item['url'], item['start_time'], transcript_key)
+    
+    def image(item, post_text):
+        return services.image_generator.generate_image_from_summary(post_text)
+    
+    return {
+        'transcribe': transcribe,
+        'post': post,
+        'image': image if generate_image else None
+    }
+
+def batch_pipeline(progress, services, batch_id, source, generate_image, concurrency):
+    """Job in blocco: espande la sorgente ed elabora gli elementi non ancora completati"""
+    progress('queued', message='Lettura della sorgente...')
+    if source.get('csv'):
+        items = load_csv_items(source['csv'], source['language'], source['topic_hint'])
+    else:
+        items = expand_source(
+            source['source_url'], source['start_time'], source['end_time'],
+            source['language'], source['topic_hint'],
+            max_duration=app.config['MAX_SEGMENT_SECONDS']
+        )
+    if not items:
+        return False, 'Nessun video trovato nella sorgente'
+    
+    runner = BatchRunner(
+        build_batch_stages(services, generate_image, source.get('engine')),
+        os.path.join(app.config['BATCH_FOLDER'], batch_id),
+        concurrency=concurrency,
+        limiter=batch_limiter,
+        progress=progress
+    )
+    summary = runner.run(items)
+    summary['batch_id'] = batch_id
+    summary['manifest_url'] = f"/api/batch/{batch_id}/manifest"
+    return True, summary
+
+def parse_youtube_request(data):
+    """Valida i parametri di una richiesta YouTube, restituisce (params, errore)"""
     url = data.get('url', '').strip()
     start_time = data.get('start_time', '').strip()
     end_time = data.get('end_time', '').strip()
     language = data.get('language', 'it')
+    engine = data.get('engine') or app.config['TRANSCRIBE_ENGINE']
     
     if not all([url, start_time, end_time]):
-        return jsonify({'success': False, 'message': 'URL, tempo di inizio e fine sono richiesti'})
+        return None, 'URL, tempo di inizio e fine sono richiesti'
     
     video_id = validate_youtube_url(url)
     if not video_id:
-        return jsonify({'success': False, 'message': 'URL YouTube non valido'})
+        return None, 'URL YouTube non valido'
+    
+    error = engine_error(engine)
+    if error:
+        return None, error
+    
+    if not artifact_manager.has_capacity():
+        return None, 'Spazio temporaneo esaurito, riprova tra qualche minuto'
+    
+    return (url, start_time, end_time, language, engine), None
+
+def save_uploaded_audio(req):
+    """Valida il file caricato (già scritto su disco durante la ricezione).
+
+    Restituisce ((path, filename, size, language, engine, sha256), errore).
+    """
+    if 'audio_file' not in req.files:
+        return None, 'Nessun file caricato'
+    
+    file = req.files['audio_file']
+    language = req.form.get('language', 'it')
+    engine = req.form.get('engine') or app.config['TRANSCRIBE_ENGINE']
+    error = engine_error(engine)
+    if error:
+        return None, error
+    
+    if file.filename == '':
+        return None, 'Nessun file selezionato'
+    
+    if not allowed_file(file.filename):
+        return None, f'Formato non supportato. Usa: {", ".join(ALLOWED_EXTENSIONS)}'
+    
+    # Dimensione, firma e hash sono stati verificati durante la scrittura
+    sink = file.stream
+    success, error = sink.finish()
+    if not success:
+        return None, error
+    
+    if not artifact_manager.has_capacity():
+        return None, 'Spazio temporaneo esaurito, riprova tra qualche minuto'
+    
+    # Rinomina nella stessa cartella: nessuna copia
+    filename = secure_filename(file.filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{sink.owner}_{filename}")
+    os.replace(sink.path, file_path)
+    sink.claimed = True
+    return (file_path, filename, sink.size, language, engine, sink.hexdigest), None
+
+@app.route('/api/process-youtube', methods=['POST'])
+def process_youtube():
+    params, error = parse_youtube_request(request.get_json())
+    if error:
+        return jsonify({'success': False, 'message': error})
     
     try:
-        # Pulisci file vecchi
-        youtube_processor.cleanup_old_files()
-        
-        # Elabora il video
-        success, result = youtube_processor.download_and_extract_segment(
-            url, start_time, end_time, language
+        success, result = process_youtube_pipeline(
+            no_progress, current_services().transcription_service, *params
         )
-        
         if not success:
             return jsonify({'success': False, 'message': result})
-        
-        # Trascrivi l'audio estratto
-        audio_file = result['file_path']
-        success_transcription, transcription_result = transcription_service.transcribe_audio(
-            audio_file, language
-        )
-        
-        # Rimuovi file audio temporaneo
-        if os.path.exists(audio_file):
-            os.remove(audio_file)
-        
-        if success_transcription:
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            file_size_mb = round(result['file_size'] / (1024 * 1024), 2)
-            
-            return jsonify({
-                'success': True,
-                'text': transcription_result,
-                'timestamp': timestamp,
-                'metadata': {
-                    'source': 'YouTube',
-                    'duration': f"{result['duration']}s",
-                    'file_size': f"{file_size_mb} MB",
-                    'bitrate': f"{result['bitrate']}k",
-                    'segment': f"{result['start_time']} - {result['end_time']}"
-                }
-            })
-        else:
-            return jsonify({'success': False, 'message': transcription_result})
+        return jsonify({'success': True, **result})
             
     except Exception as e:
         return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
 
 @app.route('/api/transcribe-file', methods=['POST'])
 def transcribe_file():
-    if 'audio_file' not in request.files:
-        return jsonify({'success': False, 'message': 'Nessun file caricato'})
+    try:
+        params, error = save_uploaded_audio(request)
+        if error:
+            return jsonify({'success': False, 'message': error})
+        
+        success, result = transcribe_file_pipeline(
+            no_progress, current_services().transcription_service, *params
+        )
+        if not success:
+            return jsonify({'success': False, 'message': result})
+        return jsonify({'success': True, **result})
+            
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
+
+@app.route('/api/jobs/process-youtube', methods=['POST'])
+def submit_youtube_job():
+    params, error = parse_youtube_request(request.get_json())
+    if error:
+        return jsonify({'success': False, 'message': error})
     
-    file = request.files['audio_file']
-    language = request.form.get('language', 'it')
+    success, job = job_manager.submit(
+        'youtube', process_youtube_pipeline, current_services().transcription_service, *params
+    )
+    if not success:
+        return jsonify({'success': False, 'message': job}), 503
+    return jsonify({'success': True, 'message': 'Job accodato', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+@app.route('/api/jobs/transcribe-file', methods=['POST'])
+def submit_file_job():
+    try:
+        params, error = save_uploaded_audio(request)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
+    if error:
+        return jsonify({'success': False, 'message': error})
     
-    if file.filename == '':
-        return jsonify({'success': False, 'message': 'Nessun file selezionato'})
+    success, job = job_manager.submit(
+        'file', transcribe_file_pipeline, current_services().transcription_service, *params
+    )
+    if not success:
+        artifact_manager.release_path(params[0])
+        return jsonify({'success': False, 'message': job}), 503
+    return jsonify({'success': True, 'message': 'Job accodato', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Apre un upload ripreso: il client invia poi i blocchi con PATCH e l'header Upload-Offset"""
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename', ''))
+    size = data.get('size')
+    language = data.get('language', 'it')
+    engine = data.get('engine') or app.config['TRANSCRIBE_ENGINE']
     
-    if not allowed_file(file.filename):
+    if not filename or not allowed_file(filename):
         return jsonify({'success': False, 'message': f'Formato non supportato. Usa: {", ".join(ALLOWED_EXTENSIONS)}'})
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'success': False, 'message': 'Dimensione del file non valida'})
+    if size > app.config['UPLOAD_MAX_MB'] * 1024 * 1024:
+        return jsonify({'success': False, 'message': f"File troppo grande (max {app.config['UPLOAD_MAX_MB']}MB)"}), 413
+    error = engine_error(engine)
+    if error:
+        return jsonify({'success': False, 'message': error})
+    if not artifact_manager.has_capacity():
+        return jsonify({'success': False, 'message': 'Spazio temporaneo esaurito, riprova tra qualche minuto'})
+    
+    upload = upload_store.create(filename, size, language, engine)
+    # Il file parziale resta protetto finché la sessione può essere ripresa
+    artifact_manager.track(
+        os.path.join(app.config['UPLOAD_FOLDER'], f"{upload['id']}_*"),
+        owner=upload['id'], ttl=app.config['UPLOAD_RESUME_HOURS'] * 3600
+    )
+    response = jsonify({'success': True, 'upload': upload})
+    response.headers['Location'] = f"/api/uploads/{upload['id']}"
+    return response, 201
+
+def upload_response(upload, status=200, **extra):
+    response = jsonify({'success': status < 400, 'upload': upload, **extra})
+    response.headers['Upload-Offset'] = str(upload['offset'])
+    response.headers['Upload-Length'] = str(upload['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response, status
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Offset confermato (anche via HEAD): il client riprende da qui dopo un'interruzione"""
+    upload = upload_store.get(upload_id)
+    if not upload:
+        return jsonify({'success': False, 'message': 'Upload non trovato o scaduto'}), 404
+    return upload_response(upload)
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    upload = upload_store.get(upload_id)
+    if not upload:
+        return jsonify({'success': False, 'message': 'Upload non trovato o scaduto'}), 404
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Header Upload-Offset mancante'}), 400
+    if offset != upload['offset'] or upload_store.busy(upload_id):
+        return upload_response(upload, 409, message='Offset non corrispondente, riprendi da quello indicato')
+    
+    success, result = upload_store.append(upload_id, request.stream)
+    if not success:
+        # Blocco rifiutato (firma, dimensione): l'upload resta all'ultimo offset valido
+        return upload_response(upload_store.get(upload_id) or upload, 422, message=result)
+    return upload_response(result)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    upload_store.close(upload_id)
+    artifact_manager.release(upload_id)
+    return jsonify({'success': True, 'message': 'Upload annullato'})
+
+@app.route('/api/jobs/transcribe-upload/<upload_id>', methods=['POST'])
+def submit_upload_job(upload_id):
+    upload = upload_store.get(upload_id)
+    if not upload:
+        return jsonify({'success': False, 'message': 'Upload non trovato o scaduto'}), 404
+    if not upload['complete']:
+        return upload_response(upload, 409, message='Upload incompleto')
     
-    # Controlla dimensioni file prima del salvataggio
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
+    file_path = upload_store.path(upload_id, upload['filename'])
+    success, job = job_manager.submit(
+        'file', transcribe_file_pipeline, current_services().transcription_service,
+        file_path, upload['filename'], upload['size'], upload['language'], upload['engine'],
+        upload_store.digest(upload_id)
+    )
+    if not success:
+        # L'upload resta disponibile: il client può riprovare senza ricaricare il file
+        return jsonify({'success': False, 'message': job}), 503
+    upload_store.close(upload_id)
+    return jsonify({'success': True, 'message': 'Job accodato', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+@app.route('/api/jobs/batch', methods=['POST'])
+def submit_batch_job():
+    data = request.get_json()
+    services = current_services()
+    if not services.facebook_generator:
+        return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
+    
+    source = {
+        'source_url': data.get('source_url', '').strip(),
+        'csv': data.get('csv', ''),
+        'start_time': data.get('start_time', '').strip(),
+        'end_time': data.get('end_time', '').strip(),
+        'language': data.get('language', 'it'),
+        'topic_hint': data.get('topic_hint', '').strip(),
+        'engine': data.get('engine') or app.config['TRANSCRIBE_ENGINE']
+    }
+    if not source['source_url'] and not source['csv'].strip():
+        return jsonify({'success': False, 'message': 'URL di playlist/canale o CSV richiesto'})
+    error = engine_error(source['engine'])
+    if error:
+        return jsonify({'success': False, 'message': error})
     
-    if file_size > 25 * 1024 * 1024:
-        return jsonify({'success': False, 'message': 'File troppo grande (max 25MB per OpenAI Whisper)'})
+    # Con batch_id di un batch precedente si riprende dagli elementi non completati
+    batch_id = data.get('batch_id') or uuid.uuid4().hex
+    if not re.fullmatch(r'[0-9a-f]{32}', batch_id):
+        return jsonify({'success': False, 'message': 'batch_id non valido'})
     
     try:
-        # Salva il file temporaneamente
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
-        
-        # Trascrivi l'audio
-        success, result = transcription_service.transcribe_audio(file_path, language)
-        
-        # Rimuovi il file temporaneo
-        os.remove(file_path)
-        
-        if success:
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            file_size_mb = round(file_size / (1024 * 1024), 2)
-            return jsonify({
-                'success': True, 
-                'text': result,
-                'timestamp': timestamp,
-                'filename': filename,
-                'file_size': f"{file_size_mb} MB"
-            })
-        else:
-            return jsonify({'success': False, 'message': result})
-            
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
+        concurrency = {
+            stage: max(1, int(data[f'{stage}_workers']))
+            for stage in ('transcribe', 'post', 'image') if data.get(f'{stage}_workers')
+        }
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Numero di worker non valido'})
+    success, job = job_manager.submit(
+        'batch', batch_pipeline, services, batch_id, source,
+        data.get('generate_image', True), concurrency
+    )
+    if not success:
+        return jsonify({'success': False, 'message': job}), 503
+    return jsonify({
+        'success': True, 'message': 'Job accodato', 'job_id': job.id,
+        'batch_id': batch_id, 'job': job.to_dict()
+    }), 202
+
+@app.route('/api/batch/<batch_id>/manifest', methods=['GET'])
+def get_batch_manifest(batch_id):
+    manifest_path = os.path.join(app.config['BATCH_FOLDER'], batch_id, 'manifest.jsonl')
+    if not re.fullmatch(r'[0-9a-f]{32}', batch_id) or not os.path.exists(manifest_path):
+        return jsonify({'success': False, 'message': 'Batch non trovato'}), 404
+    return send_file(manifest_path, mimetype='application/x-ndjson', max_age=0)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'success': True,
+        'transcriptions': transcription_cache.stats(),
+        'youtube_info': youtube_processor.info_cache_stats(),
+        'openai_clients': client_registry.stats(),
+        'openai_scheduler': openai_scheduler.stats() if openai_scheduler else None,
+        'artifacts': artifact_manager.stats(),
+        'post_history': post_history.stats(),
+        'uploads': upload_store.stats(),
+        'generations': generation_store.stats(),
+        'transcode_pool': transcode_pool.stats(),
+        'server': {'pid': os.getpid(), 'processes': app.config['SERVER_PROCESSES']}
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job non trovato'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+TRANSCRIPT_KEY_RE = re.compile(r'^(yt|file):[\w:.-]+$')
+
+def load_timing(transcript_key):
+    """TimedTranscript salvato in cache per la trascrizione, None se non disponibile"""
+    if not transcript_key or not TRANSCRIPT_KEY_RE.match(transcript_key):
+        return None
+    cached = transcription_cache.get(transcript_key)
+    if not cached or not cached['timing']:
+        return None
+    return TimedTranscript.from_dict(cached['timing'])
+
+def append_youtube_link(post, youtube_url, youtube_start, transcript_key=None):
+    """Aggiunge in coda al post il link YouTube al minuto di inizio.
+
+    Con i tempi della trascrizione il link punta alla citazione con cui si apre il post.
+    """
+    t_sec = parse_time_to_seconds(youtube_start)
+    timing = load_timing(transcript_key)
+    if timing:
+        quote_seconds = timing.find_quote(opening_quote(post))
+        if quote_seconds is not None:
+            t_sec = int(quote_seconds)
+    sep = '\n\n' if not post.endswith('\n') else '\n'
+    return f"{post}{sep}Clicca sul seguente link per ascoltare la Parola di DIO: {youtube_url}?t={t_sec}"
+
+def parse_post_request(data):
+    """Estrae (testo, topic_hint, youtube_url, youtube_start, transcript_key) dalla richiesta"""
+    text = data.get('text', '').strip()
+    topic_hint = data.get('topic_hint', '').strip()
+    youtube_url = data.get('youtube_url', '').strip() if 'youtube_url' in data else None
+    youtube_start = data.get('youtube_start', '').strip() if 'youtube_start' in data else None
+    transcript_key = data.get('transcript_key') or None
+    return text, topic_hint, youtube_url, youtube_start, transcript_key
+
+def compaction_summary(condensed):
+    """Token risparmiati dalla compattazione, per l'interfaccia (senza il testo)"""
+    return {key: condensed[key] for key in ('method', 'tokens_before', 'tokens_after')}
+
+def parse_generation_options(data):
+    """(fresh, variant): fresh forza una nuova generazione, variant (identificativo da GenerationStore) sceglie una versione memorizzata"""
+    variant = data.get('variant')
+    return bool(data.get('fresh')), variant if isinstance(variant, int) and not isinstance(variant, bool) else None
+
+def sse_event(event, data):
+    """Formatta un evento Server-Sent Events con payload JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/api/generate-facebook-post', methods=['POST'])
 def generate_facebook_post():
+    facebook_generator = current_services().facebook_generator
     if not facebook_generator:
         return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
     
     data = request.get_json()
-    text = data.get('text', '').strip()
-    topic_hint = data.get('topic_hint', '').strip()
-    youtube_url = data.get('youtube_url', '').strip() if 'youtube_url' in data else None
-    youtube_start = data.get('youtube_start', '').strip() if 'youtube_start' in data else None
+    text, topic_hint, youtube_url, youtube_start, transcript_key = parse_post_request(data)
+    fresh, variant = parse_generation_options(data)
     
     if not text:
         return jsonify({'success': False, 'message': 'Testo richiesto per generare il post'})
     
     try:
-        success, result = facebook_generator.generate_facebook_post(text, topic_hint)
+        success, result = facebook_generator.generate_facebook_post(text, topic_hint, fresh, variant)
         
         if success:
             # Se presenti, aggiungi il link YouTube in coda
             if youtube_url and youtube_start:
-                def parse_time_to_seconds(time_str):
-                    import re
-                    if not time_str:
-                        return 0
-                    time_str = re.sub(r'[^\d:]', '', time_str)
-                    if len(time_str) == 6 and ':' not in time_str:
-                        hours = int(time_str[:2])
-                        minutes = int(time_str[2:4])
-                        seconds = int(time_str[4:6])
-                    elif ':' in time_str:
-                        parts = time_str.split(':')
-                        if len(parts) == 3:
-                            hours, minutes, seconds = map(int, parts)
-                        elif len(parts) == 2:
-                            hours = 0
-                            minutes, seconds = map(int, parts)
-                        else:
-                            return 0
-                    else:
-                        return 0
-                    return hours * 3600 + minutes * 60 + seconds
-                t_sec = parse_time_to_seconds(youtube_start)
-                sep = '\n\n' if not result.endswith('\n') else '\n'
-                result = f"{result}{sep}Clicca sul seguente link per ascoltare la Parola di DIO: {youtube_url}?t={t_sec}"
+                result = append_youtube_link(result, youtube_url, youtube_start, transcript_key)
             return jsonify({
                 'success': True,
                 'facebook_post': result,
-                'timestamp': datetime.now().strftime("%H:%M:%S")
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'variant': generation_store.position(facebook_generator.memo_key(text, topic_hint), variant),
+                # Già calcolata (e memorizzata) dalla generazione
+                'compaction': compaction_summary(facebook_generator.condense(text))
             })
         else:
             return jsonify({'success': False, 'message': result})
@@ -612,28 +2130,157 @@ def generate_facebook_post():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
 
+@app.route('/api/generate-facebook-post/stream', methods=['POST'])
+def stream_facebook_post():
+    """Come /api/generate-facebook-post ma inoltra i token via SSE (eventi delta, done, error)"""
+    generator = current_services().facebook_generator
+    if not generator:
+        return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
+    
+    data = request.get_json()
+    text, topic_hint, youtube_url, youtube_start, transcript_key = parse_post_request(data)
+    fresh, variant = parse_generation_options(data)
+    
+    if not text:
+        return jsonify({'success': False, 'message': 'Testo richiesto per generare il post'})
+    
+    def events():
+        # Prima dei token: quanto della trascrizione arriva al modello (la generazione riusa il risultato)
+        yield sse_event('condensed', compaction_summary(generator.condense(text)))
+        for kind, payload in generator.stream_facebook_post(text, topic_hint, fresh, variant):
+            if kind == 'delta':
+                yield sse_event('delta', {'text': payload})
+            elif kind == 'retry':
+                # Il client scarta la bozza: arriva un nuovo post
+                yield sse_event('retry', {'similarity': round(payload['score'], 2)})
+            elif kind == 'done':
+                # Troncamento e link YouTube applicati solo a fine stream
+                if youtube_url and youtube_start:
+                    payload = append_youtube_link(payload, youtube_url, youtube_start, transcript_key)
+                yield sse_event('done', {
+                    'success': True,
+                    'facebook_post': payload,
+                    'timestamp': datetime.now().strftime("%H:%M:%S"),
+                    'variant': generation_store.position(generator.memo_key(text, topic_hint), variant)
+                })
+            else:
+                yield sse_event('error', {'success': False, 'message': payload})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def store_generated_image(b64_img, prompt, extension='png'):
+    """Decodifica una sola volta l'immagine e la rende disponibile come file da /api/images/<id>"""
+    image_id = image_store.save(base64.b64decode(b64_img), extension)
+    return {
+        "image_id": image_id,
+        "image_url": f"/api/images/{image_id}",
+        "revised_prompt": prompt
+    }
+
+def generate_all_pipeline(post_generator, img_generator, text, topic_hint, fresh=False):
+    """Genera post e immagine come due rami paralleli del grafo delle dipendenze.
+
+    Ramo post: trascrizione compattata -> post. Ramo immagine: trascrizione
+    compattata -> prompt -> immagine. Dopo la compattazione la latenza è quella
+    del ramo più lento, non la somma delle fasi.
+    I risultati memorizzati vengono riusati se fresh è False.
+    """
+    timings = {}
+    
+    def timed(stage, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            timings[stage] = round(time.perf_counter() - started, 2)
+    
+    started = time.perf_counter()
+    # La compattazione precede i due rami: il prompt dell'immagine parte dallo stesso materiale del post
+    condensed = timed('condense', post_generator.condense, text)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # Gli span dei due rami finiscono nell'header Server-Timing della richiesta
+        post_future = pool.submit(
+            metrics.bind(timed), 'post', post_generator.generate_facebook_post, text, topic_hint, fresh
+        )
+        # Con le immagini progressive il ramo immagine si ferma alle bozze: la finale la sceglie l'operatore
+        image_func = img_generator.generate_drafts if app.config['IMAGE_DRAFT_COUNT'] > 0 else img_generator.generate_image
+        image_future = pool.submit(
+            metrics.bind(timed), 'image', image_func, condensed['text'], 'transcription', fresh
+        )
+        post_result = post_future.result()
+        image_result = image_future.result()
+    timings['total'] = round(time.perf_counter() - started, 2)
+    return post_result, image_result, timings, condensed
+
+@app.route('/api/generate-all', methods=['POST'])
+def generate_all():
+    services = current_services()
+    if not services.facebook_generator or not services.image_generator:
+        return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
+    
+    data = request.get_json()
+    text, topic_hint, youtube_url, youtube_start, transcript_key = parse_post_request(data)
+    fresh, _ = parse_generation_options(data)
+    
+    if not text:
+        return jsonify({'success': False, 'message': 'Testo richiesto per generare il post'})
+    
+    try:
+        (post_ok, post), (image_ok, image), timings, condensed = generate_all_pipeline(
+            services.facebook_generator, services.image_generator, text, topic_hint, fresh
+        )
+        if not post_ok:
+            return jsonify({'success': False, 'message': post, 'timings': timings})
+        
+        if youtube_url and youtube_start:
+            post = append_youtube_link(post, youtube_url, youtube_start, transcript_key)
+        response = {
+            'success': True,
+            'facebook_post': post,
+            'timestamp': datetime.now().strftime("%H:%M:%S"),
+            'timings': timings,
+            'variant': generation_store.position(services.facebook_generator.memo_key(text, topic_hint)),
+            'compaction': compaction_summary(condensed)
+        }
+        # Il post resta valido anche se l'immagine fallisce
+        if image_ok and app.config['IMAGE_DRAFT_COUNT'] > 0:
+            response['image_drafts'] = drafts_response(
+                services.image_generator.drafts_key(condensed['text'], 'transcription'), image
+            )
+        elif image_ok:
+            response['image_data'] = image
+        else:
+            response['image_error'] = image
+        return jsonify(response)
+            
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
+
 @app.route('/api/generate-image', methods=['POST'])
 def generate_image():
+    image_generator = current_services().image_generator
     if not image_generator:
         return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
     
     data = request.get_json()
     facebook_post = data.get('facebook_post', '').strip()
+    fresh, variant = parse_generation_options(data)
     
     if not facebook_post:
         return jsonify({'success': False, 'message': 'Post Facebook richiesto per generare immagine'})
     
     try:
-        success, result = image_generator.generate_image_from_summary(facebook_post)
+        success, result = image_generator.generate_image(facebook_post, 'post', fresh, variant)
         
         if success:
-            b64_img, prompt = result if isinstance(result, tuple) else (result, facebook_post)
             return jsonify({
                 "success": True,
-                "image_data": {
-                    "image_b64": b64_img,
-                    "revised_prompt": prompt
-                }
+                "image_data": result,
+                "variant": generation_store.position(image_generator.memo_key(facebook_post), variant)
             })
         else:
             print("Errore generazione immagine:", result)
@@ -642,32 +2289,149 @@ def generate_image():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
 
+DRAFTS_KEY_RE = re.compile(r'^image_drafts:[0-9a-f]{64}$')
+
+def drafts_response(drafts_key, entry):
+    """Bozze per il client: chiave, variante e posizione della bozza servono a chiedere l'immagine finale"""
+    return {
+        'key': drafts_key,
+        'prompt': entry['value']['prompt'],
+        'drafts': entry['value']['drafts'],
+        'variant': {name: entry[name] for name in ('variant', 'position', 'variants', 'previous', 'next')}
+    }
+
+@app.route('/api/generate-image-drafts', methods=['POST'])
+def generate_image_drafts():
+    """Prima fase: bozze a bassa qualità dello stesso prompt, pronte in pochi secondi"""
+    image_generator = current_services().image_generator
+    if not image_generator:
+        return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
+    if app.config['IMAGE_DRAFT_COUNT'] <= 0:
+        return jsonify({'success': False, 'message': 'Bozze disattivate (IMAGE_DRAFT_COUNT=0)'})
+    
+    data = request.get_json()
+    facebook_post = data.get('facebook_post', '').strip()
+    fresh, variant = parse_generation_options(data)
+    
+    if not facebook_post:
+        return jsonify({'success': False, 'message': 'Post Facebook richiesto per generare immagine'})
+    
+    try:
+        success, result = image_generator.generate_drafts(facebook_post, 'post', fresh, variant)
+        if not success:
+            return jsonify({'success': False, 'message': result})
+        return jsonify({'success': True, **drafts_response(image_generator.drafts_key(facebook_post), result)})
+            
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Errore del server: {str(e)}'})
+
+def finalize_image_pipeline(progress, image_generator, drafts_key, variant, index, fresh=False):
+    """Seconda fase (in un job): la bozza scelta in alta qualità"""
+    progress('rendering', message='Immagine in alta qualità in corso...')
+    return image_generator.finalize_image(drafts_key, variant, index, fresh)
+
+@app.route('/api/jobs/image-final', methods=['POST'])
+def submit_image_final_job():
+    image_generator = current_services().image_generator
+    if not image_generator:
+        return jsonify({'success': False, 'message': 'API Key OpenAI non configurata'})
+    
+    data = request.get_json()
+    drafts_key = data.get('key', '')
+    index = data.get('draft')
+    fresh, variant = parse_generation_options(data)
+    if (
+        not DRAFTS_KEY_RE.match(drafts_key) or variant is None
+        or not isinstance(index, int) or isinstance(index, bool)
+    ):
+        return jsonify({'success': False, 'message': 'Bozza non valida'}), 400
+    # Bozze eliminate nel frattempo (varianti più vecchie o evizione): meglio un errore che la finale di un altro gruppo
+    drafts = generation_store.get(drafts_key, variant)
+    if not drafts:
+        return jsonify({'success': False, 'message': 'Bozze non più disponibili, genera nuove bozze'}), 409
+    if not 0 <= index < len(drafts['value']['drafts']):
+        return jsonify({'success': False, 'message': 'Bozza non valida'}), 400
+    
+    success, job = job_manager.submit(
+        'image', finalize_image_pipeline, image_generator, drafts_key, variant, index, fresh
+    )
+    if not success:
+        return jsonify({'success': False, 'message': job}), 503
+    return jsonify({'success': True, 'message': 'Job accodato', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """Serve un'immagine generata; ?format=webp|jpeg|png e ?width=N per varianti/miniature"""
+    fmt = request.args.get('format')
+    width = request.args.get('width', type=int)
+    if width is not None and not 16 <= width <= 4096:
+        return jsonify({'success': False, 'message': 'Larghezza non valida'}), 400
+    
+    try:
+        found = image_store.get(image_id, fmt, width)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Errore nella conversione: {str(e)}'}), 500
+    if not found:
+        return jsonify({'success': False, 'message': 'Immagine non trovata'}), 404
+    
+    path, mimetype = found
+    extension = path.rsplit('.', 1)[1]
+    # Le immagini non cambiano mai: ETag + cache lunga, Range gestito da conditional
+    response = send_file(
+        os.path.abspath(path),
+        mimetype=mimetype,
+        conditional=True,
+        etag=True,
+        max_age=31536000,
+        as_attachment=request.args.get('download') == '1',
+        download_name=f"immagine_post_{image_id[:8]}.{extension}"
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+EXPORT_FORMATS = {
+    'txt': 'text/plain',
+    'srt': 'application/x-subrip',
+    'vtt': 'text/vtt',
+    'json': 'application/json',
+}
+
 @app.route('/api/export-text', methods=['POST'])
 def export_text():
     data = request.get_json()
     text = data.get('text', '')
+    export_format = data.get('format', 'txt')
+    
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Formato di esportazione non supportato'})
+    
+    if export_format != 'txt':
+        # Sottotitoli e JSON dai tempi salvati: nessuna nuova chiamata a Whisper
+        timing = load_timing(data.get('transcript_key'))
+        if not timing:
+            return jsonify({'success': False, 'message': 'Tempi non disponibili per questa trascrizione'})
+        text = getattr(timing, f'to_{export_format}')()
     
     if not text:
         return jsonify({'success': False, 'message': 'Nessun testo da esportare'})
     
     try:
-        # Crea un file temporaneo
-        temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8')
-        temp_file.write(text)
-        temp_file.close()
-        
+        # In memoria: nessun file temporaneo da ripulire
         return send_file(
-            temp_file.name,
+            io.BytesIO(text.encode('utf-8')),
             as_attachment=True,
-            download_name=f'trascrizione_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt',
-            mimetype='text/plain'
+            download_name=f'trascrizione_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}',
+            mimetype=EXPORT_FORMATS[export_format]
         )
     except Exception as e:
         return jsonify({'success': False, 'message': f'Errore nell\'esportazione: {str(e)}'})
 
 @app.errorhandler(413)
 def too_large(e):
-    return jsonify({'success': False, 'message': 'File troppo grande (max 25MB per OpenAI Whisper)'}), 413
+    if request.endpoint in UPLOAD_ENDPOINTS:
+        return jsonify({'success': False, 'message': f"File troppo grande (max {app.config['UPLOAD_MAX_MB']}MB)"}), 413
+    return jsonify({'success': False, 'message': f"Richiesta troppo grande (max {app.config['REQUEST_MAX_MB']}MB)"}), 413
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -699,5 +2463,5 @@ if __name__ == '__main__':
         # Fallback browser predefinito
         webbrowser.open_new(url)
     threading.Thread(target=open_browser).start()
-    # Usa Waitress per servire l'applicazione
-    serve(app, host='0.0.0.0', port=port, threads=4)
+    # Usa Waitress per servire l'applicazione (più processi: python server.py)
+    serve(app, host='0.0.0.0', port=port, threads=app.config['SERVER_THREADS'])
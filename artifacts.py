@@ -0,0 +1,224 @@
+import fnmatch
+import glob
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+def pid_alive(pid):
+    """True se il processo esiste ancora (su Windows os.kill(pid, 0) lo terminerebbe)"""
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path) for name in names
+        )
+    return os.path.getsize(path)
+
+
+class ArtifactManager:
+    """Indice SQLite dei file temporanei e derivati di ogni job, con pulizia in background.
+
+    Ogni voce registra un percorso o un pattern glob (es. youtube_downloads/<id>_*)
+    per un proprietario; il job la rilascia a fine lavoro. Il reaper elimina le
+    voci scadute, i file non registrati più vecchi di orphan_grace_seconds e,
+    oltre max_bytes, i file non protetti più vecchi.
+    """
+
+    def __init__(self, db_path, roots, max_age_seconds=6 * 3600, orphan_grace_seconds=3600,
+                 max_bytes=2 * 1024 * 1024 * 1024, interval=60):
+        self.db_path = db_path
+        self.roots = roots
+        self.max_age_seconds = max_age_seconds
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.total_bytes = 0
+        self.reaped = 0
+        self.last_reap = None
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS artifacts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner TEXT NOT NULL,
+                    pattern TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_owner ON artifacts(owner)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def track(self, pattern, owner=None, ttl=None):
+        """Registra un percorso (o pattern glob) prima di crearlo; restituisce il proprietario"""
+        owner = owner or uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO artifacts (owner, pattern, pid, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (owner, os.path.abspath(pattern), os.getpid(), now, now + (ttl or self.max_age_seconds))
+            )
+        return owner
+
+    def release(self, owner):
+        """Elimina i file del proprietario e le relative voci"""
+        with self.lock, self._connect() as conn:
+            patterns = [row[0] for row in conn.execute(
+                "SELECT pattern FROM artifacts WHERE owner = ?", (owner,)
+            )]
+            conn.execute("DELETE FROM artifacts WHERE owner = ?", (owner,))
+        self._remove_patterns(patterns)
+
+    def release_path(self, path):
+        """Rilascia i proprietari delle voci che coprono path"""
+        path = os.path.abspath(path)
+        with self.lock, self._connect() as conn:
+            rows = conn.execute("SELECT owner, pattern FROM artifacts").fetchall()
+        owners = {owner for owner, pattern in rows if fnmatch.fnmatch(path, pattern)}
+        for owner in owners:
+            self.release(owner)
+        if not owners:
+            _remove(path)
+
+    @contextmanager
+    def scope(self, *patterns, ttl=None):
+        """Registra i pattern per la durata del blocco e li elimina all'uscita"""
+        owner = uuid.uuid4().hex
+        for pattern in patterns:
+            self.track(pattern, owner, ttl)
+        try:
+            yield owner
+        finally:
+            self.release(owner)
+
+    def _remove_patterns(self, patterns):
+        for pattern in patterns:
+            for path in glob.glob(pattern):
+                try:
+                    _remove(path)
+                except OSError:
+                    pass  # Ancora aperto (es. su Windows): ci riproverà il reaper
+
+    def recover(self):
+        """All'avvio: elimina i file dei processi terminati senza rilasciarli"""
+        with self.lock, self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT owner, pid FROM artifacts").fetchall()
+        dead = {owner for owner, pid in rows if not pid_alive(pid)}
+        for owner in dead:
+            self.release(owner)
+        return len(dead)
+
+    def reap(self):
+        """Voci scadute, file orfani e quota disco; restituisce il numero di elementi eliminati"""
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT DISTINCT owner FROM artifacts WHERE expires_at < ?", (now,)
+            )]
+        for owner in expired:
+            self.release(owner)
+        removed = len(expired)
+
+        with self.lock, self._connect() as conn:
+            active = [row[0] for row in conn.execute("SELECT pattern FROM artifacts")]
+
+        entries = []
+        for root in self.roots:
+            for name in os.listdir(root):
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    entries.append((os.path.getmtime(path), _size(path), path))
+                except OSError:
+                    continue  # Eliminato nel frattempo
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if any(fnmatch.fnmatch(path, pattern) for pattern in active):
+                continue
+            # Orfano oltre il periodo di grazia, oppure il più vecchio finché si è oltre quota
+            if now - mtime > self.orphan_grace_seconds or total > self.max_bytes:
+                try:
+                    _remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+
+        with self.lock:
+            self.total_bytes = total
+            self.reaped += removed
+            self.last_reap = now
+        return removed
+
+    def has_capacity(self):
+        """False se all'ultimo controllo i file protetti superavano già la quota"""
+        with self.lock:
+            return self.total_bytes <= self.max_bytes
+
+    def start(self):
+        """Avvia il reaper in background (una sola volta)"""
+        if self.thread:
+            return
+        def loop():
+            while not self.stop_event.wait(self.interval):
+                try:
+                    self.reap()
+                except Exception:
+                    pass  # Il reaper non deve mai fermarsi
+        self.thread = threading.Thread(target=loop, name='artifact-reaper', daemon=True)
+        self.thread.start()
+
+    def stats(self):
+        with self.lock, self._connect() as conn:
+            tracked, owners = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT owner) FROM artifacts"
+            ).fetchone()
+        with self.lock:
+            return {
+                'tracked': tracked,
+                'owners': owners,
+                'size_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'reaped': self.reaped,
+                'last_reap': self.last_reap
+            }
@@ -0,0 +1,125 @@
+import os
+import re
+import subprocess
+
+# Limite di upload dell'API Whisper, con margine di sicurezza per i singoli chunk
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+CHUNK_MAX_BYTES = 23 * 1024 * 1024
+
+_DURATION_RE = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+_SILENCE_START_RE = re.compile(r'silence_start:\s*(-?\d+(?:\.\d+)?)')
+_SILENCE_END_RE = re.compile(r'silence_end:\s*(-?\d+(?:\.\d+)?)')
+_WORD_RE = re.compile(r'[^\w]+', re.UNICODE)
+
+
+def probe_duration(audio_path):
+    """Restituisce la durata in secondi leggendo l'header con ffmpeg (None se non disponibile)"""
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-i', audio_path],
+        capture_output=True, text=True
+    )
+    match = _DURATION_RE.search(result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def detect_silences(audio_path, noise_db=-30, min_silence=0.5):
+    """Individua le pause con il filtro silencedetect di ffmpeg, restituisce [(inizio, fine)]"""
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-nostats', '-i', audio_path,
+         '-af', f'silencedetect=noise={noise_db}dB:d={min_silence}',
+         '-f', 'null', '-'],
+        capture_output=True, text=True
+    )
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        match = _SILENCE_START_RE.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END_RE.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    return silences
+
+
+def plan_chunks(duration, silences, chunk_seconds, overlap_seconds=1.5, search_window=0.2):
+    """Divide [0, duration] in chunk di circa chunk_seconds tagliando preferibilmente nelle pause.
+
+    Ogni chunk (tranne il primo) parte overlap_seconds prima del taglio, così
+    le parole spezzate al confine compaiono intere in almeno un chunk.
+    """
+    chunks = []
+    cut = 0.0
+    while duration - cut > chunk_seconds * (1 + search_window):
+        target = cut + chunk_seconds
+        window_start = target - chunk_seconds * search_window
+        # Ultima pausa il cui centro cade nella finestra prima del taglio ideale
+        candidates = [(s + e) / 2 for s, e in silences if window_start <= (s + e) / 2 <= target]
+        next_cut = candidates[-1] if candidates else target
+        chunks.append((max(0.0, cut - overlap_seconds) if chunks else 0.0, next_cut))
+        cut = next_cut
+    chunks.append((max(0.0, cut - overlap_seconds) if chunks else 0.0, duration))
+    return chunks
+
+
+def split_audio(audio_path, chunks, output_dir):
+    """Estrae i chunk pianificati senza ricodifica (stream copy), restituisce i percorsi in ordine"""
+    ext = os.path.splitext(audio_path)[1] or '.mp3'
+    paths = []
+    for index, (start, end) in enumerate(chunks):
+        chunk_path = os.path.join(output_dir, f"chunk_{index:04d}{ext}")
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', f'{start:.3f}',
+            '-i', audio_path,
+            '-t', f'{end - start:.3f}',
+            '-vn', '-c:a', 'copy',
+            chunk_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Errore nella divisione audio: {result.stderr}")
+        paths.append(chunk_path)
+    return paths
+
+
+def _normalize(word):
+    return _WORD_RE.sub('', word.lower())
+
+
+def merge_overlap(previous_words, next_words, max_overlap=30, max_offset=8):
+    """Rimuove da next_words le parole già presenti in coda a previous_words.
+
+    Cerca la sequenza comune più lunga (almeno 2 parole) che termina vicino
+    alla fine del testo precedente e inizia vicino all'inizio del successivo.
+    """
+    tail = [_normalize(w) for w in previous_words[-max_overlap:]]
+    head = [_normalize(w) for w in next_words[:max_overlap]]
+    best_length, best_end = 0, 0
+    for i in range(len(tail)):
+        for j in range(min(max_offset, len(head))):
+            length = 0
+            while (i + length < len(tail) and j + length < len(head)
+                   and tail[i + length] and tail[i + length] == head[j + length]):
+                length += 1
+            if length > best_length and len(tail) - (i + length) <= max_offset:
+                best_length, best_end = length, j + length
+    if best_length < 2:
+        return next_words
+    return next_words[best_end:]
+
+
+def stitch_transcripts(texts):
+    """Ricompone i testi dei chunk in ordine eliminando le parole duplicate nelle sovrapposizioni"""
+    words = []
+    for text in texts:
+        chunk_words = (text or '').split()
+        if words:
+            chunk_words = merge_overlap(words, chunk_words)
+        words.extend(chunk_words)
+    return ' '.join(words)
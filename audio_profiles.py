@@ -0,0 +1,116 @@
+import subprocess
+from functools import lru_cache
+
+# Profili di codifica per la voce: mono, sample rate basso, bitrate entro [min, max] kbps.
+# Whisper lavora internamente a 16kHz, quindi frequenze più alte sono solo byte in più.
+PROFILES = {
+    'opus': {
+        'encoder': 'libopus',
+        'extension': 'ogg',
+        'format': 'ogg',
+        'sample_rate': 16000,
+        'min_bitrate': 16,
+        'max_bitrate': 32,
+        'extra_args': ['-application', 'voip'],
+    },
+    'aac': {
+        'encoder': 'aac',
+        'extension': 'm4a',
+        'format': 'mp4',
+        'sample_rate': 16000,
+        'min_bitrate': 24,
+        'max_bitrate': 48,
+        # MP4 frammentato: scrivibile anche su pipe non seekable
+        'extra_args': ['-movflags', '+frag_keyframe+empty_moov'],
+    },
+    'mp3': {
+        'encoder': 'libmp3lame',
+        'extension': 'mp3',
+        'format': 'mp3',
+        'sample_rate': 22050,
+        'min_bitrate': 48,
+        'max_bitrate': 128,
+        'extra_args': [],
+    },
+}
+
+# Formati senza perdita (o quasi) che conviene sempre ricodificare prima dell'upload
+LOSSLESS_EXTENSIONS = {'wav', 'flac'}
+
+DEFAULT_TARGET_BYTES = 23 * 1024 * 1024
+
+# Rimuove anche le pause interne e sposta la timeline: non usarlo quando servono i tempi della trascrizione
+SILENCE_TRIM_FILTER = 'silenceremove=stop_periods=-1:stop_duration=1:stop_threshold=-45dB'
+LOUDNESS_FILTER = 'loudnorm=I=-16:TP=-1.5:LRA=11'
+
+
+@lru_cache(maxsize=1)
+def available_encoders():
+    """Encoder audio disponibili nel binario ffmpeg installato"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+    except OSError:
+        return frozenset()
+    encoders = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].startswith('A'):
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+
+def choose_profile(duration, target_bytes=DEFAULT_TARGET_BYTES, preferred='auto'):
+    """Sceglie profilo e bitrate (kbps) per stare entro target_bytes con la durata data.
+
+    In modalità 'auto' usa Opus a 16kHz se disponibile, altrimenti AAC, altrimenti MP3.
+    """
+    if preferred in PROFILES:
+        name = preferred
+    else:
+        encoders = available_encoders()
+        name = next(
+            (n for n in ('opus', 'aac') if PROFILES[n]['encoder'] in encoders),
+            'mp3'
+        )
+    profile = PROFILES[name]
+    ideal = (target_bytes * 8) // (max(duration, 1) * 1000)
+    bitrate = int(min(profile['max_bitrate'], max(profile['min_bitrate'], ideal)))
+    return name, bitrate
+
+
+def ffmpeg_output_args(name, bitrate, trim_silence=False, normalize=False):
+    """Argomenti ffmpeg di output (dopo -i) per codificare con il profilo indicato"""
+    profile = PROFILES[name]
+    filters = []
+    if trim_silence:
+        filters.append(SILENCE_TRIM_FILTER)
+    if normalize:
+        filters.append(LOUDNESS_FILTER)
+
+    args = ['-vn']
+    if filters:
+        args += ['-af', ','.join(filters)]
+    args += [
+        '-c:a', profile['encoder'],
+        '-b:a', f'{bitrate}k',
+        '-ac', '1',
+        '-ar', str(profile['sample_rate']),
+    ]
+    args += profile['extra_args']
+    args += ['-f', profile['format']]
+    return args
+
+
+def profile_extension(name):
+    return PROFILES[name]['extension']
+
+
+def transcode_file(input_path, output_path, name, bitrate, trim_silence=False, normalize=False):
+    """Ricodifica input_path in output_path; restituisce (success, messaggio d'errore)"""
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', input_path]
+    cmd += ffmpeg_output_args(name, bitrate, trim_silence, normalize)
+    cmd.append(output_path)
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return False, result.stderr
+    return True, None
@@ -0,0 +1,330 @@
+"""Elaborazione in blocco di predicazioni archiviate: playlist/canale YouTube o CSV.
+
+Uso da riga di comando (richiede OPENAI_API_KEY nell'ambiente):
+
+    python batch.py --source https://www.youtube.com/playlist?list=... --out batch_output/archivio
+    python batch.py --csv predicazioni.csv --out batch_output/archivio --rpm 60 --tpm 200000
+
+Il CSV deve avere l'intestazione url,start,end,language,topic_hint (language e
+topic_hint facoltativi). I risultati vengono aggiunti a manifest.jsonl nella
+cartella di output; rilanciando lo stesso comando gli elementi già completati
+vengono saltati.
+"""
+import argparse
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import yt_dlp
+
+from openai_scheduler import call_limiter, priority
+
+DEFAULT_CONCURRENCY = {'transcribe': 2, 'post': 4, 'image': 2}
+
+
+class RateLimiter:
+    """Token bucket per richieste al minuto (RPM) e token al minuto (TPM)"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm or 0)
+        self.tokens = float(tpm or 0)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, requests=1, tokens=0):
+        """Attende finché c'è quota per la richiesta"""
+        if tokens and self.tpm:
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.updated_at
+                self.updated_at = now
+                if self.rpm:
+                    self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+                if self.tpm:
+                    self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+                wait = 0.0
+                if self.rpm and self.requests < requests:
+                    wait = max(wait, (requests - self.requests) * 60 / self.rpm)
+                if self.tpm and tokens and self.tokens < tokens:
+                    wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+                if wait == 0.0:
+                    if self.rpm:
+                        self.requests -= requests
+                    if self.tpm:
+                        self.tokens -= tokens
+                    return
+            time.sleep(wait)
+
+
+def item_key(item):
+    """Chiave stabile di un elemento, usata per riprendere un batch interrotto"""
+    return '|'.join(str(item.get(k) or '') for k in ('url', 'start_time', 'end_time', 'language', 'topic_hint'))
+
+
+def image_file_name(key):
+    """Nome leggibile dalla chiave più un hash della chiave intera: chiavi che si riducono allo stesso nome
+    (caratteri sostituiti o troncati) non si sovrascrivono"""
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+    readable = re.sub(r'[^\w.-]+', '_', key)[:100]
+    return f"{readable}_{digest}.png"
+
+
+def make_item(url, start_time, end_time, language='it', topic_hint=''):
+    item = {
+        'url': url.strip(),
+        'start_time': (start_time or '').strip(),
+        'end_time': (end_time or '').strip(),
+        'language': (language or 'it').strip(),
+        'topic_hint': (topic_hint or '').strip(),
+    }
+    item['key'] = item_key(item)
+    return item
+
+
+def load_csv_items(csv_text, language='it', topic_hint=''):
+    """Legge gli elementi da un CSV con intestazione url,start,end,language,topic_hint"""
+    reader = csv.DictReader(io.StringIO(csv_text))
+    items = []
+    for row in reader:
+        row = {(k or '').strip().lower(): (v or '') for k, v in row.items()}
+        if not row.get('url', '').strip():
+            continue
+        items.append(make_item(
+            row['url'], row.get('start'), row.get('end'),
+            row.get('language') or language, row.get('topic_hint') or topic_hint
+        ))
+    return items
+
+
+def expand_source(source_url, start_time='', end_time='', language='it', topic_hint='', max_duration=None):
+    """Espande una playlist o un canale YouTube nei singoli video.
+
+    Senza start/end viene usato l'intero video (limitato a max_duration secondi).
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(source_url, download=False)
+
+    entries = info.get('entries') or [info]
+    items = []
+    for entry in entries:
+        if not entry:
+            continue
+        # I canali restituiscono prima le schede (Video, Live...): espandile
+        if entry.get('_type') == 'playlist' or entry.get('entries'):
+            nested = entry.get('url') or entry.get('webpage_url')
+            if nested and nested != source_url:
+                items.extend(expand_source(nested, start_time, end_time, language, topic_hint, max_duration))
+            continue
+        video_id = entry.get('id')
+        url = f"https://www.youtube.com/watch?v={video_id}" if video_id else entry.get('url')
+        if not url:
+            continue
+        end = end_time
+        if not end and entry.get('duration'):
+            duration = int(entry['duration'])
+            if max_duration:
+                duration = min(duration, max_duration)
+            end = _seconds_to_hhmmss(duration)
+        items.append(make_item(url, start_time or '00:00:00', end, language, topic_hint))
+    return items
+
+
+def _seconds_to_hhmmss(seconds):
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+class BatchRunner:
+    """Esegue trascrizione -> post -> immagine per ogni elemento, con concorrenza per fase.
+
+    stages è un dict di funzioni:
+        transcribe(item) -> (success, {'text': ..., 'metadata': ...})
+        post(item, text) -> (success, post)
+        image(item, post) -> (success, (b64_png, prompt))   [facoltativa]
+    """
+
+    def __init__(self, stages, output_dir, concurrency=None, limiter=None, progress=None):
+        self.stages = stages
+        self.output_dir = output_dir
+        self.concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self.semaphores = {stage: threading.Semaphore(n) for stage, n in self.concurrency.items()}
+        self.limiter = limiter or RateLimiter()
+        self.progress = progress or (lambda stage, percent=None, message=None: None)
+        self.manifest_path = os.path.join(output_dir, 'manifest.jsonl')
+        self.write_lock = threading.Lock()
+        os.makedirs(os.path.join(output_dir, 'images'), exist_ok=True)
+
+    def completed_keys(self):
+        """Chiavi degli elementi già completati nel manifest (per la ripresa)"""
+        keys = set()
+        if not os.path.exists(self.manifest_path):
+            return keys
+        with open(self.manifest_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Riga troncata da un'interruzione
+                if record.get('status') == 'done':
+                    keys.add(record['key'])
+        return keys
+
+    def _write(self, record):
+        with self.write_lock, open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _run_stage(self, stage, timings, func, *args):
+        with self.semaphores[stage]:
+            started = time.perf_counter()
+            try:
+                # Ogni chiamata OpenAI della fase (chunk Whisper, riassunti, rigenerazioni, prompt e immagine)
+                # spende la quota del batch; nello scheduler cedono il passo a quelle dell'operatore
+                with priority('background'), call_limiter(self.limiter):
+                    return func(*args)
+            finally:
+                timings[stage] = round(time.perf_counter() - started, 2)
+
+    def process_item(self, item):
+        timings = {}
+        record = {**item, 'status': 'error', 'timings': timings}
+        try:
+            success, transcription = self._run_stage('transcribe', timings, self.stages['transcribe'], item)
+            if not success:
+                record['error'] = transcription
+                return record
+            text = transcription['text']
+            record['text'] = text
+            record['metadata'] = transcription.get('metadata', {})
+
+            success, post = self._run_stage('post', timings, self.stages['post'], item, text)
+            if not success:
+                record['error'] = post
+                return record
+            record['facebook_post'] = post
+
+            if self.stages.get('image'):
+                success, image = self._run_stage('image', timings, self.stages['image'], item, post)
+                if not success:
+                    record['error'] = image
+                    return record
+                b64_img, prompt = image
+                image_name = image_file_name(item['key'])
+                with open(os.path.join(self.output_dir, 'images', image_name), 'wb') as f:
+                    f.write(base64.b64decode(b64_img))
+                record['image_file'] = os.path.join('images', image_name)
+                record['image_prompt'] = prompt
+
+            record['status'] = 'done'
+            return record
+        except Exception as e:
+            record['error'] = f"Errore del server: {str(e)}"
+            return record
+        finally:
+            record['finished_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self._write(record)
+
+    def run(self, items):
+        done = self.completed_keys()
+        pending = [item for item in items if item['key'] not in done]
+        summary = {
+            'total': len(items),
+            'skipped': len(items) - len(pending),
+            'succeeded': 0,
+            'failed': 0,
+            'output_dir': self.output_dir,
+            'manifest': self.manifest_path,
+        }
+        if not pending:
+            return summary
+
+        workers = sum(self.concurrency.values())
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as pool:
+            futures = [pool.submit(self.process_item, item) for item in pending]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                summary['succeeded' if record['status'] == 'done' else 'failed'] += 1
+                self.progress(
+                    'processing', completed * 100 / len(pending),
+                    f"Elementi completati {completed}/{len(pending)} ({summary['failed']} errori)"
+                )
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Elaborazione in blocco di predicazioni YouTube')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--source', help='URL di playlist o canale YouTube')
+    source.add_argument('--csv', help='CSV con colonne url,start,end,language,topic_hint')
+    parser.add_argument('--out', required=True, help='Cartella di output (contiene manifest.jsonl)')
+    parser.add_argument('--language', default='it')
+    parser.add_argument('--topic-hint', default='')
+    parser.add_argument('--start', default='', help='Inizio per tutti i video della playlist (hh:mm:ss)')
+    parser.add_argument('--end', default='', help='Fine per tutti i video della playlist (hh:mm:ss)')
+    parser.add_argument('--no-image', action='store_true', help='Non generare le immagini')
+    parser.add_argument('--engine', default=None, help='Motore di trascrizione: openai o local (default TRANSCRIBE_ENGINE)')
+    parser.add_argument('--transcribe-workers', type=int, default=DEFAULT_CONCURRENCY['transcribe'])
+    parser.add_argument('--post-workers', type=int, default=DEFAULT_CONCURRENCY['post'])
+    parser.add_argument('--image-workers', type=int, default=DEFAULT_CONCURRENCY['image'])
+    parser.add_argument('--rpm', type=int, default=None, help='Limite richieste/minuto OpenAI (default BATCH_RPM)')
+    parser.add_argument('--tpm', type=int, default=None, help='Limite token/minuto OpenAI (default BATCH_TPM)')
+    args = parser.parse_args(argv)
+
+    # Import ritardato: app configura cache, client OpenAI e pipeline
+    import app as churchpost
+
+    services = churchpost.default_services()
+    if not services.facebook_generator:
+        parser.error('Imposta OPENAI_API_KEY con una API key valida')
+    engine = args.engine or churchpost.app.config['TRANSCRIBE_ENGINE']
+    error = churchpost.engine_error(engine)
+    if error:
+        parser.error(error)
+
+    if args.csv:
+        with open(args.csv, encoding='utf-8') as f:
+            items = load_csv_items(f.read(), args.language, args.topic_hint)
+    else:
+        items = expand_source(
+            args.source, args.start, args.end, args.language, args.topic_hint,
+            max_duration=churchpost.app.config['MAX_SEGMENT_SECONDS']
+        )
+
+    def report(stage, percent=None, message=None):
+        print(f"[{percent:5.1f}%] {message}" if percent is not None else message, flush=True)
+
+    runner = BatchRunner(
+        churchpost.build_batch_stages(services, generate_image=not args.no_image, engine=engine),
+        args.out,
+        concurrency={
+            'transcribe': args.transcribe_workers,
+            'post': args.post_workers,
+            'image': args.image_workers,
+        },
+        limiter=RateLimiter(args.rpm, args.tpm) if args.rpm or args.tpm else churchpost.batch_limiter,
+        progress=report
+    )
+    summary = runner.run(items)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
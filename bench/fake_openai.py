@@ -0,0 +1,248 @@
+"""Server HTTP che imita le API OpenAI usate dall'app, con latenza e dimensioni configurabili.
+
+Avvio autonomo: python bench/fake_openai.py --port 8901
+poi OPENAI_BASE_URL=http://127.0.0.1:8901/v1 e una API key qualsiasi.
+"""
+import argparse
+import base64
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "grazia fede speranza amore parola vita cammino luce pace cuore promessa "
+    "perdono gioia forza verità chiesa preghiera fiducia deserto pane acqua "
+    "sentiero valle monte seme frutto vite radice vento fuoco roccia casa"
+).split()
+
+
+def random_text(words, rng=random):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_png(size_bytes):
+    """PNG valido in scala di grigi con pixel casuali (incomprimibile: pesa circa size_bytes)"""
+    side = max(8, int(size_bytes ** 0.5))
+    rows = b''.join(b'\x00' + random.randbytes(side) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 0, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(rows, 1))
+        + chunk(b'IEND', b'')
+    )
+
+
+class FakeOpenAI:
+    """Latenze in secondi (con jitter relativo), dimensioni delle risposte in parole o byte.
+
+    Con rpm ogni endpoint ha una quota di richieste al minuto come su OpenAI:
+    header x-ratelimit-* su ogni risposta e 429 con retry-after-ms oltre la quota.
+    """
+
+    def __init__(self, port=0, transcribe_latency=0.5, chat_latency=1.0, image_latency=2.0,
+                 jitter=0.2, transcript_words=1500, post_words=300, image_bytes=1500000, draft_latency=0.5,
+                 rpm=None):
+        # draft: immagini a qualità low/medium (bozze)
+        self.latency = {'transcribe': transcribe_latency, 'chat': chat_latency, 'image': image_latency,
+                        'draft': draft_latency}
+        self.jitter = jitter
+        self.transcript_words = transcript_words
+        self.post_words = post_words
+        # Un'immagine sola riusata: generarla a ogni richiesta misurerebbe il server finto
+        self.image_b64 = base64.b64encode(make_png(image_bytes)).decode('ascii')
+        self.requests = {'transcribe': 0, 'chat': 0, 'image': 0, 'draft': 0, 'models': 0, 'rate_limited': 0}
+        self.rpm = rpm
+        self.quota = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}/v1"
+        self.thread = None
+
+    def wait(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+        base = self.latency[kind]
+        time.sleep(max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    def take_quota(self, endpoint):
+        """Consuma una richiesta della quota dell'endpoint: (consentita, header x-ratelimit-*)"""
+        if not self.rpm:
+            return True, {}
+        with self.lock:
+            now = time.monotonic()
+            level, updated_at = self.quota.get(endpoint, (float(self.rpm), now))
+            level = min(self.rpm, level + (now - updated_at) * self.rpm / 60)
+            allowed = level >= 1
+            if allowed:
+                level -= 1
+            else:
+                self.requests['rate_limited'] += 1
+            self.quota[endpoint] = (level, now)
+        headers = {
+            'x-ratelimit-limit-requests': str(self.rpm),
+            'x-ratelimit-remaining-requests': str(int(level)),
+            'x-ratelimit-reset-requests': f"{(self.rpm - level) * 60 / self.rpm:.3f}s"
+        }
+        if not allowed:
+            headers['retry-after-ms'] = str(int((1 - level) * 60000 / self.rpm) + 1)
+        return allowed, headers
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-openai', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def end_headers(self):
+                for name, value in getattr(self, 'limit_headers', {}).items():
+                    self.send_header(name, value)
+                super().end_headers()
+
+            def _send(self, status, body, content_type='application/json'):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def do_GET(self):
+                self.limit_headers = {}
+                if self.path.rstrip('/').endswith('/models'):
+                    # Verifica della key alla registrazione: nessuna latenza
+                    with fake.lock:
+                        fake.requests['models'] += 1
+                    self._send(200, {'object': 'list', 'data': [{'id': 'whisper-1', 'object': 'model'}]})
+                else:
+                    self._send(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self):
+                body = self._body()
+                allowed, self.limit_headers = fake.take_quota(self.path.rsplit('/v1/', 1)[-1])
+                if not allowed:
+                    self._send(429, {'error': {'message': 'Rate limit reached for requests', 'type': 'requests',
+                                               'code': 'rate_limit_exceeded'}})
+                    return
+                if self.path.endswith('/audio/transcriptions'):
+                    self._transcription(body)
+                elif self.path.endswith('/chat/completions'):
+                    self._chat(json.loads(body or b'{}'))
+                elif self.path.endswith('/images/generations'):
+                    request = json.loads(body or b'{}')
+                    self._images(request.get('quality'), request.get('n'))
+                elif self.path.endswith('/images/edits'):
+                    self._images(self._form_field(body, 'quality'), self._form_field(body, 'n'))
+                else:
+                    self._send(404, {'error': {'message': 'not found'}})
+
+            def _images(self, quality, n):
+                # n immagini in una sola risposta, come gpt-image-1
+                fake.wait('draft' if quality in ('low', 'medium') else 'image')
+                data = [{'b64_json': fake.image_b64}] * int(n or 1)
+                self._send(200, {'created': int(time.time()), 'data': data})
+
+            def _form_field(self, body, name):
+                """Valore di un campo semplice del multipart, None se assente"""
+                marker = f'name="{name}"\r\n\r\n'.encode('ascii')
+                index = body.find(marker)
+                if index < 0:
+                    return None
+                start = index + len(marker)
+                return body[start:body.find(b'\r\n', start)].decode('ascii')
+
+            def _transcription(self, body):
+                fake.wait('transcribe')
+                # Basta il campo response_format del multipart
+                response_format = self._form_field(body, 'response_format') or 'json'
+                words = [random.choice(WORDS) for _ in range(fake.transcript_words)]
+                text = ' '.join(words)
+                if response_format == 'text':
+                    self._send(200, text.encode('utf-8'), 'text/plain; charset=utf-8')
+                elif response_format == 'verbose_json':
+                    # 2.5 parole al secondo, segmenti da 12 parole
+                    timed = [{'word': w, 'start': i * 0.4, 'end': i * 0.4 + 0.35} for i, w in enumerate(words)]
+                    segments = [
+                        {'id': n, 'start': timed[i]['start'], 'end': timed[min(i + 11, len(timed) - 1)]['end'],
+                         'text': ' ' + ' '.join(words[i:i + 12])}
+                        for n, i in enumerate(range(0, len(words), 12))
+                    ]
+                    self._send(200, {'text': text, 'language': 'italian', 'duration': len(words) * 0.4,
+                                     'segments': segments, 'words': timed})
+                else:
+                    self._send(200, {'text': text})
+
+            def _chat(self, request):
+                fake.wait('chat')
+                # Testo sempre diverso: lo storico dei post non deve forzare rigenerazioni
+                content = (
+                    f"🔥 {random_text(12).capitalize()}.\n\n{random_text(fake.post_words - 20)}\n\n"
+                    + ' '.join('#' + random.choice(WORDS) + str(random.randint(0, 999)) for _ in range(8))
+                )
+                base = {'id': f"chatcmpl-{random.getrandbits(48):x}", 'created': int(time.time()),
+                        'model': request.get('model', 'gpt-4.5-preview')}
+                usage = {'prompt_tokens': 800, 'completion_tokens': len(content) // 4,
+                         'total_tokens': 800 + len(content) // 4}
+                if not request.get('stream'):
+                    self._send(200, {**base, 'object': 'chat.completion', 'usage': usage, 'choices': [
+                        {'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}
+                    ]})
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for piece in content.split(' '):
+                    chunk = {**base, 'object': 'chat.completion.chunk', 'choices': [
+                        {'index': 0, 'finish_reason': None, 'delta': {'content': piece + ' '}}
+                    ]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server OpenAI finto per i benchmark')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--transcribe-latency', type=float, default=0.5)
+    parser.add_argument('--chat-latency', type=float, default=1.0)
+    parser.add_argument('--image-latency', type=float, default=2.0)
+    parser.add_argument('--draft-latency', type=float, default=0.5)
+    parser.add_argument('--image-bytes', type=int, default=1500000)
+    parser.add_argument('--rpm', type=int, default=None, help='Quota di richieste al minuto per endpoint')
+    args = parser.parse_args()
+    fake = FakeOpenAI(args.port, args.transcribe_latency, args.chat_latency, args.image_latency,
+                      image_bytes=args.image_bytes, draft_latency=args.draft_latency, rpm=args.rpm)
+    print(f"OPENAI_BASE_URL={fake.base_url}", flush=True)
+    fake.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
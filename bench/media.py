@@ -0,0 +1,105 @@
+"""Fixture audio locale e server HTTP con supporto Range, al posto dei server di YouTube"""
+import os
+import re
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def make_fixture(path, duration, bitrate='64k'):
+    """Audio simile al parlato (rumore rosa modulato a 4Hz) generato con ffmpeg, riusato se esiste"""
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    subprocess.run([
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'anoisesrc=d={duration}:c=pink:r=44100:a=0.3',
+        '-af', "volume='0.6+0.4*sin(2*PI*4*t)':eval=frame",
+        '-ac', '1', '-b:a', bitrate, path
+    ], check=True)
+    return path
+
+
+class MediaServer:
+    """Serve i file di una cartella con richieste Range (ffmpeg le usa per -ss sugli URL http)"""
+
+    def __init__(self, directory, port=0):
+        self.directory = os.path.abspath(directory)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.port}/{name}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='media-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        media = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                path = os.path.join(media.directory, os.path.basename(self.path.split('?')[0]))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                match = _RANGE_RE.fullmatch(self.headers.get('Range', ''))
+                if match and (match.group(1) or match.group(2)):
+                    if match.group(1):
+                        start = int(match.group(1))
+                        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    else:
+                        start = max(0, size - int(match.group(2)))
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                length = end - start + 1
+                self.send_header('Content-Type', 'audio/mpeg')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(length))
+                self.end_headers()
+                if head:
+                    return
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    remaining = length
+                    try:
+                        while remaining:
+                            block = f.read(min(64 * 1024, remaining))
+                            if not block:
+                                break
+                            self.wfile.write(block)
+                            remaining -= len(block)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # ffmpeg chiude la connessione quando ha letto il segmento
+                with media.lock:
+                    media.bytes_sent += length - remaining
+
+        return Handler
@@ -0,0 +1,381 @@
+"""Benchmark end-to-end: l'app sotto waitress con OpenAI e YouTube locali.
+
+Esegue ogni scenario (process-youtube, transcribe-file, generate-facebook-post,
+generate-image, generate-image-drafts) a più livelli di concorrenza e riporta p50/p95, throughput,
+picco di RSS (server e processi figli, es. ffmpeg) e picco di disco temporaneo.
+
+    python bench/run.py --concurrency 1,4,8 --requests 20 --json risultati.json
+    python bench/run.py --compare risultati.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_openai import FakeOpenAI, random_text
+from media import MediaServer, make_fixture
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SCENARIOS = ('youtube', 'file', 'post', 'image', 'drafts')
+TEMP_FOLDERS = ('temp_uploads', 'youtube_downloads')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _proc_rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def tree_rss_bytes(root_pid):
+    """RSS del processo e dei discendenti (solo Linux: /proc); None altrove"""
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # Il nome del comando può contenere spazi: ppid è dopo l'ultima ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += _proc_rss_bytes(pid)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+def folder_bytes(paths):
+    total = 0
+    for path in paths:
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass  # Rimosso durante la scansione
+    return total
+
+
+class Sampler:
+    """Campiona RSS e disco temporaneo del server e ne conserva i picchi dall'ultimo reset"""
+
+    def __init__(self, pid, temp_paths, interval=0.1):
+        self.pid = pid
+        self.temp_paths = temp_paths
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.peak_rss = self.peak_disk = 0
+        self.thread = threading.Thread(target=self._loop, name='bench-sampler', daemon=True)
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            rss = tree_rss_bytes(self.pid)
+            disk = folder_bytes(self.temp_paths)
+            with self.lock:
+                self.peak_rss = None if rss is None else max(self.peak_rss or 0, rss)
+                self.peak_disk = max(self.peak_disk, disk)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def reset(self):
+        with self.lock:
+            peaks = (self.peak_rss, self.peak_disk)
+            self.peak_rss = self.peak_disk = 0
+        return peaks
+
+
+def post_json(url, body, timeout):
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def post_file(url, fields, file_field, file_path, timeout):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+        f'filename="{os.path.basename(file_path)}"\r\nContent-Type: audio/mpeg\r\n\r\n'.encode('utf-8')
+        + content + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    request = urllib.request.Request(
+        url, data=b''.join(parts), headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def build_requests(args, base_url, upload_path):
+    """Per ogni scenario una funzione (indice richiesta) -> risposta JSON"""
+    segment = args.segment_seconds
+    latest_start = max(0, args.media_seconds - segment)
+
+    def youtube(i):
+        # Inizi diversi: senza cache conta solo la pipeline, con --cache si misurano gli hit
+        start = (i * 37) % (latest_start + 1)
+        return post_json(f'{base_url}/api/process-youtube', {
+            'url': 'https://www.youtube.com/watch?v=benchvideo0',
+            'start_time': f'{start // 3600:02d}:{start % 3600 // 60:02d}:{start % 60:02d}',
+            'end_time': f'{(start + segment) // 3600:02d}:{(start + segment) % 3600 // 60:02d}:{(start + segment) % 60:02d}',
+            'language': 'it'
+        }, args.timeout)
+
+    def file(i):
+        return post_file(f'{base_url}/api/transcribe-file', {'language': 'it'}, 'audio_file', upload_path, args.timeout)
+
+    transcript = random_text(1500, random.Random(1))
+
+    def post(i):
+        return post_json(f'{base_url}/api/generate-facebook-post', {'text': transcript}, args.timeout)
+
+    def image(i):
+        return post_json(f'{base_url}/api/generate-image', {'facebook_post': transcript[:2000]}, args.timeout)
+
+    def drafts(i):
+        # Tempo alla prima immagine con le bozze progressive
+        return post_json(f'{base_url}/api/generate-image-drafts', {'facebook_post': transcript[:2000]}, args.timeout)
+
+    return {'youtube': youtube, 'file': file, 'post': post, 'image': image, 'drafts': drafts}
+
+
+def run_level(send, concurrency, count):
+    latencies, errors = [], []
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            result = send(i)
+            ok = result.get('success')
+            message = None if ok else result.get('message')
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            ok, message = False, str(e)
+        elapsed = time.perf_counter() - started
+        return ok, elapsed, message
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ok, elapsed, message in pool.map(one, range(count)):
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(message)
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+def wait_ready(base_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Il server è terminato durante l\'avvio')
+        try:
+            with urllib.request.urlopen(f'{base_url}/api/cache/stats', timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Il server non risponde')
+
+
+def format_row(row):
+    def num(value, digits=2):
+        return '-' if value is None else f'{value:.{digits}f}'
+    return (
+        f"{row['scenario']:<8} {row['concurrency']:>4} {row['requests']:>4} {row['errors']:>4} "
+        f"{num(row['p50']):>7} {num(row['p95']):>7} {num(row['max']):>7} {num(row['throughput']):>7} "
+        f"{num(row['peak_rss_mb'], 0):>7} {num(row['peak_temp_mb'], 1):>8}"
+    )
+
+
+HEADER = (
+    f"{'scenario':<8} {'conc':>4} {'n':>4} {'err':>4} {'p50 s':>7} {'p95 s':>7} {'max s':>7} "
+    f"{'req/s':>7} {'rss MB':>7} {'temp MB':>8}"
+)
+
+
+def compare(previous_path, rows):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    old = {(r['scenario'], r['concurrency']): r for r in previous['results']}
+    print(f"\nConfronto con {previous.get('commit') or previous_path}:")
+    for row in rows:
+        before = old.get((row['scenario'], row['concurrency']))
+        if not before:
+            continue
+        deltas = []
+        for key in ('p50', 'p95', 'throughput', 'peak_rss_mb', 'peak_temp_mb'):
+            if before.get(key) and row.get(key) is not None:
+                deltas.append(f"{key} {(row[key] - before[key]) * 100 / before[key]:+.1f}%")
+        print(f"  {row['scenario']:<8} x{row['concurrency']:<3} " + '  '.join(deltas))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark end-to-end con OpenAI e YouTube locali')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,4,8', help='Livelli di concorrenza separati da virgola')
+    parser.add_argument('--requests', type=int, default=20, help='Richieste per livello')
+    parser.add_argument('--media-seconds', type=int, default=3600, help='Durata del video finto')
+    parser.add_argument('--segment-seconds', type=int, default=1200, help='Durata del segmento YouTube richiesto')
+    parser.add_argument('--upload-seconds', type=int, default=600, help='Durata del file caricato')
+    parser.add_argument('--transcribe-latency', type=float, default=0.5)
+    parser.add_argument('--chat-latency', type=float, default=1.0)
+    parser.add_argument('--image-latency', type=float, default=2.0)
+    parser.add_argument('--draft-latency', type=float, default=0.5, help='Latenza delle immagini a bassa qualità')
+    parser.add_argument('--openai-rpm', type=int, default=None, help='Quota RPM per endpoint del server finto (429 oltre)')
+    parser.add_argument('--image-bytes', type=int, default=1500000)
+    parser.add_argument('--threads', type=int, default=None, help='Thread waitress (default: concorrenza massima)')
+    parser.add_argument('--cache', action='store_true', help='Lascia attiva la cache delle trascrizioni')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--json', help='Salva i risultati in JSON')
+    parser.add_argument('--compare', help='JSON di un run precedente da confrontare')
+    parser.add_argument('--keep', action='store_true', help='Non eliminare la cartella di lavoro del server')
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Scenari sconosciuti: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+
+    media_dir = os.path.join(BENCH_DIR, '.media')
+    media_name = f'media_{args.media_seconds}s.mp3'
+    make_fixture(os.path.join(media_dir, media_name), args.media_seconds)
+    upload_path = make_fixture(os.path.join(media_dir, f'upload_{args.upload_seconds}s.mp3'), args.upload_seconds)
+
+    fake = FakeOpenAI(
+        transcribe_latency=args.transcribe_latency, chat_latency=args.chat_latency,
+        image_latency=args.image_latency, image_bytes=args.image_bytes, draft_latency=args.draft_latency,
+        rpm=args.openai_rpm
+    ).start()
+    media = MediaServer(media_dir).start()
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    port = free_port()
+    env = {
+        **os.environ,
+        'OPENAI_BASE_URL': fake.base_url,
+        'OPENAI_API_KEY': 'sk-bench',
+        'BENCH_PORT': str(port),
+        'BENCH_THREADS': str(args.threads or max(levels) + 2),
+        'BENCH_MEDIA_URL': media.url(media_name),
+        'BENCH_MEDIA_DURATION': str(args.media_seconds),
+        'BENCH_NO_CACHE': '0' if args.cache else '1',
+    }
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'serve.py')], cwd=workdir, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    sampler = Sampler(server.pid, [os.path.join(workdir, folder) for folder in TEMP_FOLDERS])
+    rows = []
+    try:
+        wait_ready(base_url, server)
+        sampler.start()
+        requests = build_requests(args, base_url, upload_path)
+        print(HEADER)
+        for scenario in scenarios:
+            for concurrency in levels:
+                sampler.reset()
+                latencies, errors, wall = run_level(requests[scenario], concurrency, args.requests)
+                peak_rss, peak_disk = sampler.reset()
+                row = {
+                    'scenario': scenario,
+                    'concurrency': concurrency,
+                    'requests': args.requests,
+                    'errors': len(errors),
+                    'p50': percentile(latencies, 0.5),
+                    'p95': percentile(latencies, 0.95),
+                    'max': max(latencies) if latencies else None,
+                    'throughput': len(latencies) / wall if wall else None,
+                    'peak_rss_mb': None if peak_rss is None else peak_rss / (1024 * 1024),
+                    'peak_temp_mb': peak_disk / (1024 * 1024),
+                    'sample_errors': sorted(set(e for e in errors if e))[:3],
+                }
+                rows.append(row)
+                print(format_row(row), flush=True)
+                for message in row['sample_errors']:
+                    print(f"         ! {message}")
+    finally:
+        sampler.stop()
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        fake.stop()
+        media.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nRichieste al server OpenAI finto: {fake.requests}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'settings': vars(args),
+                'results': rows
+            }, f, indent=2)
+    if args.compare:
+        compare(args.compare, rows)
+    return 0 if all(row['errors'] == 0 for row in rows) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+"""Avvia l'app sotto waitress per i benchmark, con un estrattore YouTube locale.
+
+Le info del video puntano alla fixture servita da bench/media.py: yt-dlp
+risolve il formato e scarica come farebbe da YouTube, ffmpeg legge lo stream
+via http. Variabili: BENCH_PORT, BENCH_THREADS, BENCH_MEDIA_URL,
+BENCH_MEDIA_DURATION, BENCH_NO_CACHE; OPENAI_BASE_URL e OPENAI_API_KEY
+puntano al server OpenAI finto.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from waitress import serve  # noqa: E402
+
+import app as churchpost  # noqa: E402
+
+
+def local_extract_info(url):
+    video_id = churchpost.validate_youtube_url(url) or 'benchvideo0'
+    return {
+        'id': video_id,
+        'title': 'Benchmark',
+        'duration': int(os.environ['BENCH_MEDIA_DURATION']),
+        'uploader': 'bench',
+        'view_count': 0,
+        'chapters': None,
+        'webpage_url': url,
+        'extractor': 'generic',
+        'extractor_key': 'Generic',
+        'formats': [{
+            'format_id': 'audio',
+            'url': os.environ['BENCH_MEDIA_URL'],
+            'ext': 'mp3',
+            'acodec': 'mp3',
+            'vcodec': 'none',
+            'abr': 64,
+            'protocol': 'http',
+        }],
+    }
+
+
+def main():
+    churchpost.youtube_processor.extract_info = local_extract_info
+    if os.environ.get('BENCH_NO_CACHE') == '1':
+        # Ogni richiesta percorre l'intera pipeline (trascrizione, post e immagine)
+        churchpost.transcription_cache.get = lambda key: None
+        churchpost.generation_store.get = lambda key, variant=None: None
+    serve(
+        churchpost.app,
+        host='127.0.0.1',
+        port=int(os.environ.get('BENCH_PORT', 5099)),
+        threads=int(os.environ.get('BENCH_THREADS', 8))
+    )
+
+
+if __name__ == '__main__':
+    main()
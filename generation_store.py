@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+def generation_key(kind, model, prompt_version, params, *inputs):
+    """Hash di (tipo, modello, versione del prompt, parametri di campionamento, input)"""
+    payload = json.dumps(
+        [kind, model, prompt_version, params, list(inputs)], sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class GenerationStore:
+    """Risultati di post e immagini (SQLite) per chiave di generazione, con più varianti per chiave.
+
+    get restituisce l'ultima variante (o quella richiesta, per annullare o
+    rivedere); put aggiunge una variante, tenendo le ultime max_variants.
+    Le varianti hanno identificativi stabili e crescenti, unici nell'archivio.
+    Oltre max_bytes vengono eliminate le chiavi usate meno di recente.
+    """
+
+    def __init__(self, db_path, max_bytes=50 * 1024 * 1024, max_variants=5):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_variants = max_variants
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT NOT NULL,
+                    variant INTEGER NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (key, variant)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_accessed ON generations(accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS variant_ids (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+            # Archivi creati prima della sequenza: i nuovi identificativi partono dopo quelli esistenti
+            conn.execute("INSERT INTO variant_ids (id) SELECT variant FROM generations ORDER BY variant DESC LIMIT 1")
+            conn.execute("DELETE FROM variant_ids")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _variants(self, conn, key):
+        return [row[0] for row in conn.execute(
+            "SELECT variant FROM generations WHERE key = ? ORDER BY variant", (key,)
+        )]
+
+    @staticmethod
+    def _describe(variants, variant):
+        """Identificativo stabile della variante più posizione e vicine, per scorrere le versioni"""
+        index = variants.index(variant)
+        return {
+            'variant': variant,
+            'position': index,
+            'variants': len(variants),
+            'previous': variants[index - 1] if index > 0 else None,
+            'next': variants[index + 1] if index + 1 < len(variants) else None
+        }
+
+    def get(self, key, variant=None):
+        """Restituisce {'value', 'variant', 'position', 'variants', 'previous', 'next'} oppure None.
+
+        variant è l'identificativo restituito da get/put (None = l'ultima): non
+        cambia quando le varianti più vecchie vengono eliminate o se ne
+        aggiungono di nuove. La posizione serve solo a mostrarla.
+        """
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            variants = self._variants(conn, key)
+            if variant is None and variants:
+                variant = variants[-1]
+            if variant not in variants:
+                self.misses += 1
+                return None
+            value = conn.execute(
+                "SELECT value FROM generations WHERE key = ? AND variant = ?", (key, variant)
+            ).fetchone()[0]
+            # L'LRU è per chiave: tutte le varianti restano insieme
+            conn.execute("UPDATE generations SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return {'value': json.loads(value), **self._describe(variants, variant)}
+
+    def position(self, key, variant=None):
+        """Come get ma senza il valore e senza aggiornare l'LRU; None se la variante non c'è più"""
+        with self.lock, self._connect() as conn:
+            variants = self._variants(conn, key)
+        if variant is None and variants:
+            variant = variants[-1]
+        return self._describe(variants, variant) if variant in variants else None
+
+    def put(self, key, value):
+        """Aggiunge value come ultima variante; restituisce la voce come get"""
+        now = time.time()
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self.lock, self._connect() as conn:
+            # Identificativi mai riusati (AUTOINCREMENT), anche dopo l'eliminazione di tutte le varianti di una chiave
+            variant = conn.execute("INSERT INTO variant_ids DEFAULT VALUES").lastrowid
+            conn.execute("DELETE FROM variant_ids")
+            conn.execute(
+                "INSERT INTO generations (key, variant, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, variant, encoded, len(encoded.encode('utf-8')), now, now)
+            )
+            variants = self._variants(conn, key)
+            for old in variants[:max(0, len(variants) - self.max_variants)]:
+                conn.execute("DELETE FROM generations WHERE key = ? AND variant = ?", (key, old))
+            variants = variants[-self.max_variants:]
+            self._evict(conn, key)
+        return {'value': value, **self._describe(variants, variant)}
+
+    def discard(self, key, variant):
+        """Elimina una variante (es. un'immagine non più disponibile su disco)"""
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM generations WHERE key = ? AND variant = ?", (key, variant))
+
+    def _evict(self, conn, keep):
+        """Elimina le chiavi usate meno di recente finché lo store non rientra nella quota"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, SUM(size) FROM generations WHERE key != ? GROUP BY key ORDER BY MAX(accessed_at)", (keep,)
+        ).fetchall():
+            conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock, self._connect() as conn:
+            keys, entries, total = conn.execute(
+                "SELECT COUNT(DISTINCT key), COUNT(*), COALESCE(SUM(size), 0) FROM generations"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'keys': keys,
+            'variants': entries,
+            'size_bytes': total,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
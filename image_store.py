@@ -0,0 +1,95 @@
+import os
+import re
+import threading
+import uuid
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow è opzionale: senza, le immagini vengono servite nel formato originale
+    Image = None
+
+_IMAGE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+MIMETYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+
+
+class ImageStore:
+    """Archivio su disco delle immagini generate, con varianti (formato/miniatura) create su richiesta"""
+
+    def __init__(self, folder, max_images=200):
+        self.folder = folder
+        self.max_images = max_images
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def save(self, image_bytes, extension='png'):
+        """Salva l'immagine decodificata e restituisce il suo id"""
+        image_id = uuid.uuid4().hex
+        path = os.path.join(self.folder, f"{image_id}.{extension}")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+        self._evict()
+        return image_id
+
+    def original_path(self, image_id):
+        """Percorso dell'immagine originale, None se l'id non è valido o non esiste"""
+        if not _IMAGE_ID_RE.match(image_id or ''):
+            return None
+        for extension in MIMETYPES:
+            path = os.path.join(self.folder, f"{image_id}.{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get(self, image_id, fmt=None, width=None):
+        """Restituisce (percorso, mimetype) dell'immagine o della variante richiesta, oppure None.
+
+        Le varianti vengono generate una sola volta e conservate accanto all'originale.
+        """
+        path = self.original_path(image_id)
+        if not path:
+            return None
+        original_format = path.rsplit('.', 1)[1]
+        fmt = fmt if fmt in MIMETYPES else original_format
+        if Image is None or (fmt == original_format and not width):
+            return path, MIMETYPES[original_format]
+
+        suffix = f"_{width}w" if width else ''
+        variant_path = os.path.join(self.folder, 'variants', f"{image_id}{suffix}.{fmt}")
+        if not os.path.exists(variant_path):
+            os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+            with Image.open(path) as image:
+                if width and width < image.width:
+                    height = round(image.height * width / image.width)
+                    image = image.resize((width, height), Image.LANCZOS)
+                if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                tmp_path = f"{variant_path}.{uuid.uuid4().hex}.tmp"
+                image.save(tmp_path, format=fmt.upper(), quality=85)
+                os.replace(tmp_path, variant_path)
+        return variant_path, MIMETYPES[fmt]
+
+    def _evict(self):
+        """Mantiene al massimo max_images originali eliminando i più vecchi con le loro varianti"""
+        with self.lock:
+            originals = [
+                os.path.join(self.folder, name) for name in os.listdir(self.folder)
+                if name.rsplit('.', 1)[-1] in MIMETYPES
+            ]
+            if len(originals) <= self.max_images:
+                return
+            originals.sort(key=os.path.getmtime)
+            variants_folder = os.path.join(self.folder, 'variants')
+            variants = os.listdir(variants_folder) if os.path.isdir(variants_folder) else []
+            for path in originals[:len(originals) - self.max_images]:
+                image_id = os.path.basename(path).split('.', 1)[0]
+                for name in variants:
+                    if name.startswith(image_id):
+                        os.remove(os.path.join(variants_folder, name))
+                os.remove(path)
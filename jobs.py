@@ -0,0 +1,211 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+from artifacts import pid_alive
+
+# Secondi minimi tra due scritture dell'avanzamento nell'indice condiviso
+PERSIST_INTERVAL = 0.5
+
+# Fasi della pipeline mostrate all'utente
+STAGES = (
+    'queued', 'downloading', 'cutting', 'encoding', 'transcribing', 'analysing', 'rendering', 'processing', 'done', 'error'
+)
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.stage = 'queued'
+        self.progress = None
+        self.message = ''
+        self.result = None
+        self.timings = []
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.persisted_at = 0.0
+
+    @property
+    def finished(self):
+        return self.stage in ('done', 'error')
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'stage': self.stage,
+            'progress': self.progress,
+            'message': self.message,
+            'finished': self.finished,
+            'elapsed': round(self.updated_at - self.created_at, 1)
+        }
+        if self.finished:
+            data['result'] = self.result
+            # Durata di ogni fase (download, ffmpeg, Whisper...) per capire dove si è perso tempo
+            data['timings'] = [item.to_dict() for item in self.timings]
+        return data
+
+
+class StoredJob:
+    """Job eseguito da un altro processo del server, letto dall'indice condiviso"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class JobManager:
+    """Coda di job con pool di worker limitato: le richieste HTTP restituiscono subito un job id.
+
+    Con db_path lo stato di ogni job viene scritto anche in SQLite, così
+    qualunque processo del server risponde a /api/jobs/<id>. pools assegna a
+    tipi di job lunghi o secondari un pool proprio ({kind: worker}), così non
+    occupano i worker dei job interattivi; max_pending vale per ciascun pool.
+    """
+
+    def __init__(self, max_workers=2, max_pending=20, retention_seconds=3600, db_path=None, pools=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.executors = {
+            kind: ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f'job-{kind}')
+            for kind, workers in (pools or {}).items()
+        }
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.db_path = db_path
+        self.persist_lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        pid INTEGER NOT NULL,
+                        finished INTEGER NOT NULL,
+                        data TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _persist(self, job, force=False):
+        """Scrive lo stato del job nell'indice condiviso (l'avanzamento al massimo ogni PERSIST_INTERVAL)"""
+        if not self.db_path:
+            return
+        # Serializzato: uno stato vecchio non può sovrascrivere quello finale
+        with self.persist_lock:
+            now = time.time()
+            with self.lock:
+                if not force and now - job.persisted_at < PERSIST_INTERVAL:
+                    return
+                job.persisted_at = now
+                data = job.to_dict()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs (id, pid, finished, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (job.id, os.getpid(), int(data['finished']), json.dumps(data, ensure_ascii=False, default=str), now)
+                )
+
+    def submit(self, kind, func, *args, **kwargs):
+        """Accoda func(progress, *args, **kwargs), che deve restituire (success, result)"""
+        with self.lock:
+            self._prune()
+            pool = kind if kind in self.executors else None
+            pending = sum(
+                1 for j in self.jobs.values()
+                if not j.finished and (j.kind if j.kind in self.executors else None) == pool
+            )
+            if pending >= self.max_pending:
+                return False, "Troppi job in coda, riprova tra qualche minuto"
+            job = Job(kind)
+            self.jobs[job.id] = job
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "DELETE FROM jobs WHERE finished = 1 AND updated_at < ?", (time.time() - self.retention_seconds,)
+                )
+        self._persist(job, force=True)
+        self.executors.get(kind, self.executor).submit(self._run, job, func, args, kwargs)
+        return True, job
+
+    def get(self, job_id):
+        """Job di questo processo, oppure quello salvato da un altro processo (None se sconosciuto)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job or not self.db_path:
+            return job
+        with self._connect() as conn:
+            row = conn.execute("SELECT pid, data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        pid, data = row[0], json.loads(row[1])
+        if not data['finished'] and not pid_alive(pid):
+            data.update(stage='error', finished=True, progress=None,
+                        message='Job interrotto: il processo che lo eseguiva è terminato')
+        return StoredJob(data)
+
+    def _update(self, job, stage=None, progress=None, message=None):
+        changed = stage is not None and stage != job.stage
+        with self.lock:
+            if changed:
+                job.stage = stage
+                job.progress = None
+            if progress is not None:
+                job.progress = round(progress, 1)
+            if message is not None:
+                job.message = message
+            job.updated_at = time.time()
+        self._persist(job, force=changed)
+
+    def _run(self, job, func, args, kwargs):
+        def progress(stage, percent=None, message=None):
+            self._update(job, stage, percent, message)
+
+        started = time.perf_counter()
+        with metrics.collect() as spans:
+            try:
+                success, result = func(progress, *args, **kwargs)
+            except Exception as e:
+                success, result = False, f"Errore del server: {str(e)}"
+        metrics.JOB_SECONDS.observe(
+            time.perf_counter() - started, kind=job.kind, outcome='ok' if success else 'error'
+        )
+
+        with self.lock:
+            job.timings = spans
+            if success:
+                job.stage = 'done'
+                job.result = result
+                job.message = 'Completato'
+            else:
+                job.stage = 'error'
+                job.message = result
+            job.progress = None
+            job.updated_at = time.time()
+        self._persist(job, force=True)
+
+    def _prune(self):
+        """Rimuove i job conclusi da più di retention_seconds (chiamare con il lock)"""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.updated_at < cutoff]:
+            del self.jobs[job_id]
@@ -0,0 +1,353 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from artifacts import pid_alive
+
+# Secondi: dalle chiamate in cache (ms) alle trascrizioni di ore
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BITRATE_BUCKETS = (8, 12, 16, 24, 32, 48, 64, 96, 128)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        """Valori serializzabili in JSON, per sommarli a quelli degli altri processi"""
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def merge(self, snapshots):
+        values = {}
+        for items in snapshots:
+            for key, value in items:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        return values
+
+    def render(self, values=None):
+        if values is None:
+            with self.lock:
+                values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """Valore che sale e scende (es. richieste in coda)"""
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per etichette: [conteggi per bucket (+Inf in coda), somma, conteggio]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self.values.items()]
+
+    def merge(self, snapshots):
+        values = {}
+        for items in snapshots:
+            for key, (counts, total, count) in items:
+                entry = values.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+        return values
+
+    def render(self, values=None):
+        if values is None:
+            with self.lock:
+                values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{float(bound)!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, description, labelnames=()):
+        metric = Counter(name, description, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, description, labelnames=()):
+        metric = Gauge(name, description, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, labelnames=(), buckets=DURATION_BUCKETS):
+        metric = Histogram(name, description, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(self, snapshots=None):
+        """Formato testuale di esposizione Prometheus; con snapshots somma gli stati di più processi"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if snapshots is None:
+                lines.extend(metric.render())
+            else:
+                lines.extend(metric.render(metric.merge(
+                    snapshot[metric.name] for snapshot in snapshots if metric.name in snapshot
+                )))
+        return '\n'.join(lines) + '\n'
+
+
+class SharedMetrics:
+    """Metriche sommate tra i processi dello stesso server (server.py).
+
+    Ogni processo scrive il proprio stato in directory/<pid>.json ogni
+    interval secondi; render li somma, così ogni scrape di /metrics vede
+    l'intero server qualunque processo risponda. Contatori e istogrammi dei
+    processi terminati restano nel totale (non devono diminuire), i gauge
+    contano solo per i processi vivi. La directory va svuotata all'avvio
+    del server.
+    """
+
+    def __init__(self, directory, registry=None, interval=5.0):
+        self.directory = directory
+        self.registry = registry or REGISTRY
+        self.path = os.path.join(directory, f"{os.getpid()}.json")
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.write()
+        threading.Thread(target=self._run, args=(interval,), daemon=True).start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def write(self):
+        # Scrittura atomica: chi legge non vede mai un file a metà
+        temp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.snapshot(), f)
+            os.replace(temp_path, self.path)
+
+    def snapshots(self):
+        gauges = {metric.name for metric in self.registry.metrics if metric.kind == 'gauge'}
+        result = []
+        for name in os.listdir(self.directory):
+            pid, extension = os.path.splitext(name)
+            if extension != '.json' or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not pid_alive(int(pid)):
+                snapshot = {metric: items for metric, items in snapshot.items() if metric not in gauges}
+            result.append(snapshot)
+        return result
+
+    def render(self):
+        self.write()  # Il processo che risponde contribuisce con i valori aggiornati
+        return self.registry.render(self.snapshots())
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'churchpost_stage_seconds', 'Durata delle fasi (yt-dlp, ffmpeg, Whisper, GPT, immagini)', ('stage', 'outcome')
+)
+STAGE_BYTES = REGISTRY.counter(
+    'churchpost_stage_bytes_total', 'Byte letti (in) e prodotti (out) dalle fasi', ('stage', 'direction')
+)
+AUDIO_BITRATE = REGISTRY.histogram(
+    'churchpost_audio_bitrate_kbps', 'Bitrate scelto per la codifica audio', ('profile',), BITRATE_BUCKETS
+)
+OPENAI_TOKENS = REGISTRY.counter('churchpost_openai_tokens_total', 'Token OpenAI consumati', ('model', 'kind'))
+OPENAI_RESPONSES = REGISTRY.counter(
+    'churchpost_openai_http_responses_total', 'Risposte HTTP OpenAI (429 e 5xx vengono ritentate)', ('status',)
+)
+OPENAI_QUEUE_DEPTH = REGISTRY.gauge(
+    'churchpost_openai_queue_depth', 'Chiamate OpenAI in attesa di quota nello scheduler', ('priority',)
+)
+OPENAI_QUEUE_SECONDS = REGISTRY.histogram(
+    'churchpost_openai_queue_seconds', 'Attesa delle chiamate OpenAI prima dell\'invio', ('priority',)
+)
+RETRIES = REGISTRY.counter('churchpost_retries_total', 'Ripetizioni di una fase', ('stage', 'reason'))
+COMPACTION_SAVED_TOKENS = REGISTRY.counter(
+    'churchpost_compaction_saved_tokens_total', 'Token di trascrizione non inviati al modello del post', ('method',)
+)
+JOB_SECONDS = REGISTRY.histogram('churchpost_job_seconds', 'Durata dei job in coda', ('kind', 'outcome'))
+HTTP_SECONDS = REGISTRY.histogram(
+    'churchpost_http_request_seconds', 'Durata delle richieste HTTP', ('endpoint', 'method', 'status')
+)
+
+# Span raccolti dalla richiesta HTTP o dal job in corso (None: solo metriche globali)
+_collector = contextvars.ContextVar('churchpost_spans', default=None)
+
+
+class Span:
+    __slots__ = ('stage', 'started', 'duration', 'ok', 'attrs')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = time.perf_counter()
+        self.duration = None
+        self.ok = True
+        self.attrs = {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def result(self, outcome):
+        """Registra l'esito di una tupla (success, result) e la restituisce"""
+        if not outcome[0]:
+            self.ok = False
+        return outcome
+
+    def to_dict(self):
+        return {'stage': self.stage, 'seconds': round(self.duration, 3), 'ok': self.ok, **self.attrs}
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Misura una fase: durata ed esito nell'istogramma, byte nei contatori, span nel collettore corrente"""
+    current = Span(stage)
+    current.attrs.update(attrs)
+    try:
+        yield current
+    except BaseException:
+        current.ok = False
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.started
+        STAGE_SECONDS.observe(current.duration, stage=stage, outcome='ok' if current.ok else 'error')
+        for direction in ('in', 'out'):
+            size = current.attrs.get(f'bytes_{direction}')
+            if size:
+                STAGE_BYTES.inc(size, stage=stage, direction=direction)
+        spans = _collector.get()
+        if spans is not None:
+            spans.append(current)
+
+
+def record_usage(model, usage):
+    """Token da response.usage (oggetto dell'SDK o dict); restituisce il totale"""
+    if not usage:
+        return 0
+    total = 0
+    # Chat: prompt/completion_tokens; immagini: input/output_tokens
+    for kind, fields in (('prompt', ('prompt_tokens', 'input_tokens')),
+                         ('completion', ('completion_tokens', 'output_tokens'))):
+        for field in fields:
+            value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+            if value:
+                break
+        if value:
+            OPENAI_TOKENS.inc(value, model=model, kind=kind)
+            total += value
+    return total
+
+
+def start_collecting():
+    """Inizia a raccogliere gli span nel contesto corrente: restituisce (lista, token per stop_collecting)"""
+    spans = []
+    return spans, _collector.set(spans)
+
+
+def stop_collecting(token):
+    try:
+        _collector.reset(token)
+    except ValueError:
+        _collector.set(None)  # Fine richiesta in un altro contesto (es. risposta in streaming)
+
+
+@contextmanager
+def collect():
+    spans, token = start_collecting()
+    try:
+        yield spans
+    finally:
+        stop_collecting(token)
+
+
+def bind(func):
+    """func eseguita in una copia del contesto corrente (gli span dei thread del pool restano nel collettore)"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def server_timing(spans, total=None):
+    """Valore dell'header Server-Timing: durata per fase, sommando le fasi ripetute"""
+    stages = {}
+    for item in spans:
+        duration, count = stages.get(item.stage, (0.0, 0))
+        stages[item.stage] = (duration + item.duration, count + 1)
+    parts = [
+        f'{stage};dur={duration * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+        for stage, (duration, count) in stages.items()
+    ]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
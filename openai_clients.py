@@ -0,0 +1,244 @@
+import hashlib
+import importlib.util
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import openai
+
+import metrics
+from openai_scheduler import ScheduledClient
+
+try:
+    import httpx2 as httpx  # Le versioni recenti dell'SDK OpenAI usano httpx2
+except ImportError:
+    import httpx
+
+# HTTP/2 richiede il pacchetto opzionale h2 (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+def key_id_for(api_key):
+    """Identificativo non reversibile della API key, usabile in sessione e nei log"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+
+
+class ApiKeyStore:
+    """API key registrate, condivise tra i processi del server (la sessione contiene solo il key_id).
+
+    Le key sono in chiaro in un file leggibile solo dall'utente che esegue il
+    server e scadono dopo ttl secondi senza utilizzo; quelle scadute vengono
+    eliminate a ogni registrazione.
+    """
+
+    def __init__(self, db_path, ttl=24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        os.close(os.open(db_path, os.O_CREAT | os.O_WRONLY, 0o600))
+        # Anche un file creato prima con permessi più larghi
+        os.chmod(db_path, 0o600)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS api_keys (
+                    key_id TEXT PRIMARY KEY,
+                    api_key TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+        self.reap()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def put(self, key_id, api_key):
+        now = time.time()
+        self.reap()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO api_keys (key_id, api_key, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key_id, api_key, now, now + self.ttl)
+            )
+
+    def get(self, key_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT api_key FROM api_keys WHERE key_id = ? AND expires_at >= ?", (key_id, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def touch(self, key_id):
+        """Rinnova la scadenza di una key ancora in uso"""
+        with self._connect() as conn:
+            conn.execute("UPDATE api_keys SET expires_at = ? WHERE key_id = ?", (time.time() + self.ttl, key_id))
+
+    def reap(self):
+        """Elimina le key scadute; restituisce quante"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM api_keys WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def stats(self):
+        with self._connect() as conn:
+            keys = conn.execute("SELECT COUNT(*) FROM api_keys WHERE expires_at >= ?", (time.time(),)).fetchone()[0]
+        return {'keys': keys, 'ttl_hours': round(self.ttl / 3600, 1)}
+
+
+class ClientEntry:
+    def __init__(self, key_id, client, http_client, services):
+        self.key_id = key_id
+        self.client = client
+        self.http_client = http_client
+        self.services = services
+        self.touched_at = time.time()
+
+    def close(self):
+        self.http_client.close()
+
+
+class ClientRegistry:
+    """Client OpenAI condivisi per API key, ognuno con il proprio pool di connessioni keep-alive.
+
+    services_factory(client) costruisce gli oggetti di servizio (trascrizione,
+    post, immagini) associati al client; le voci meno usate vengono chiuse
+    quando si supera max_clients. Con uno scheduler i servizi ricevono un
+    ScheduledClient e i retry passano dall'SDK allo scheduler; senza, ricevono lo stesso wrapper
+    che chiama il client direttamente. Le voci meno usate
+    escono dal registro oltre max_clients senza chiudere il client: job, batch e
+    stream che lo stanno usando terminano, le connessioni si chiudono quando
+    l'ultimo riferimento viene rilasciato. Con un key_store
+    una key registrata in un processo è utilizzabile da tutti gli altri.
+    """
+
+    def __init__(self, services_factory, max_clients=16, max_connections=20,
+                 timeout=600.0, connect_timeout=10.0, max_retries=3, scheduler=None, key_store=None):
+        self.services_factory = services_factory
+        self.max_clients = max_clients
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.scheduler = scheduler
+        self.key_store = key_store
+        # Key da ambiente: non esce mai dal registro
+        self.pinned_key_id = None
+        self.entries = OrderedDict()
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def _build_http_client(self):
+        hooks = [self._count_response]
+        if self.scheduler:
+            # Gli header x-ratelimit-* di ogni risposta aggiornano le quote dello scheduler
+            hooks.append(self.scheduler.observe)
+        return httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=120
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            follow_redirects=True,
+            # Ogni risposta, anche quelle ritentate dall'SDK (429, 5xx), finisce nelle metriche
+            event_hooks={'response': hooks}
+        )
+
+    @staticmethod
+    def _count_response(response):
+        metrics.OPENAI_RESPONSES.inc(status=response.status_code)
+
+    def register(self, api_key, pinned=False):
+        """Restituisce (True, key_id) riusando il client esistente, oppure (False, errore).
+
+        La verifica con models.list() avviene solo la prima volta che la key viene vista.
+        Una key pinned (quella da ambiente) non esce mai dal registro.
+        """
+        key_id = key_id_for(api_key)
+        if pinned:
+            self.pinned_key_id = key_id
+        if self.get(key_id):
+            return True, key_id
+
+        success, error = self._add(key_id, api_key, verify=True)
+        if not success:
+            return False, error
+        if self.key_store:
+            self.key_store.put(key_id, api_key)
+        return True, key_id
+
+    def _add(self, key_id, api_key, verify):
+        """Crea il client della key (verificandola con models.list() se richiesto) e lo aggiunge al registro"""
+        http_client = self._build_http_client()
+        try:
+            # Retry con backoff esponenziale e jitter: dello scheduler se presente, altrimenti del client OpenAI
+            client = openai.OpenAI(
+                api_key=api_key, http_client=http_client, max_retries=0 if self.scheduler else self.max_retries
+            )
+            if verify:
+                client.models.list()
+        except Exception as e:
+            http_client.close()
+            return False, f"Errore API Key: {str(e)}"
+
+        # Anche senza scheduler: il wrapper applica il call_limiter dei batch
+        services_client = ScheduledClient(client, self.scheduler, key_id)
+        entry = ClientEntry(key_id, client, http_client, self.services_factory(services_client))
+        with self.lock:
+            existing = self.entries.get(key_id)
+            if not existing:
+                self.entries[key_id] = entry
+                while len(self.entries) > self.max_clients:
+                    victim = next(k for k in self.entries if k != self.pinned_key_id)
+                    # Solo da questo processo: con un key_store get() la ricrea alla prossima richiesta
+                    del self.entries[victim]
+                    self.evicted += 1
+        if existing:
+            # Registrata in parallelo da un'altra richiesta: tieni quella (questa non è mai stata usata)
+            entry.close()
+        return True, None
+
+    def get(self, key_id):
+        """Voce del key_id; se la key è stata registrata da un altro processo il client viene ricreato qui"""
+        with self.lock:
+            entry = self.entries.get(key_id)
+            if entry:
+                self.entries.move_to_end(key_id)
+                touch = self.key_store and time.time() - entry.touched_at > self.key_store.ttl / 10
+                if touch:
+                    entry.touched_at = time.time()
+        if entry:
+            if touch:
+                self.key_store.touch(key_id)
+            return entry
+        api_key = self.key_store.get(key_id) if self.key_store and key_id else None
+        if not api_key:
+            return None
+        # Già verificata dal processo che l'ha registrata
+        success, _ = self._add(key_id, api_key, verify=False)
+        if not success:
+            return None
+        with self.lock:
+            return self.entries.get(key_id)
+
+    def stats(self):
+        shared_keys = self.key_store.stats() if self.key_store else None
+        with self.lock:
+            return {
+                'clients': len(self.entries),
+                'max_clients': self.max_clients,
+                'evicted': self.evicted,
+                'http2': HTTP2_AVAILABLE,
+                'scheduler': self.scheduler is not None,
+                'shared_keys': shared_keys
+            }
@@ -0,0 +1,509 @@
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import openai
+
+import metrics
+from artifacts import pid_alive
+from transcript_compaction import count_tokens
+
+# Classi di priorità, dalla più urgente: l'operatore in attesa passa davanti ai batch
+PRIORITIES = ('interactive', 'background')
+# Quote al minuto riportate dagli header x-ratelimit-<limit|remaining|reset>-<dimensione>
+DIMENSIONS = ('requests', 'tokens', 'images')
+# Token di risposta stimati per una chat senza max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+# Con lo stato condiviso: ogni quanto ricontrollare quota e code degli altri processi
+SHARED_POLL_INTERVAL = 0.25
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+_priority = contextvars.ContextVar('openai_priority', default='interactive')
+# Bucket della chiamata in corso: l'hook di httpx gli passa gli header di ogni risposta
+_current_bucket = contextvars.ContextVar('openai_bucket', default=None)
+# Limite aggiuntivo (RateLimiter dei batch) per le chiamate del blocco in corso
+_call_limiter = contextvars.ContextVar('openai_call_limiter', default=None)
+
+
+@contextmanager
+def priority(name):
+    """Le chiamate OpenAI nel blocco (anche nei thread avviati con metrics.bind) usano questa priorità"""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextmanager
+def call_limiter(limiter):
+    """Ogni chiamata OpenAI nel blocco (anche ritentata o nei thread avviati con metrics.bind) spende
+    anche la quota di limiter.acquire(requests, tokens)"""
+    token = _call_limiter.set(limiter)
+    try:
+        yield
+    finally:
+        _call_limiter.reset(token)
+
+
+def parse_duration(value):
+    """Secondi da un reset OpenAI ('20ms', '1s', '6m0s', '1h2m3.5s'), None se non interpretabile"""
+    parts = _DURATION_RE.findall(value or '')
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelBucket:
+    """Token bucket di una API key per un modello, con le quote apprese dagli header di risposta.
+
+    Finché OpenAI non ha riportato il limite di una dimensione quella
+    dimensione non frena le chiamate; dopo un 429 il bucket resta in pausa
+    fino al reset indicato.
+    """
+
+    def __init__(self):
+        self.limits = {}
+        self.levels = {}
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        for dimension, limit in self.limits.items():
+            self.levels[dimension] = min(limit, self.levels[dimension] + elapsed * limit / 60)
+
+    def delay(self, cost, now):
+        """Secondi da attendere prima di poter spendere cost (0: subito)"""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        for dimension, amount in cost.items():
+            limit = self.limits.get(dimension)
+            if not limit or not amount:
+                continue
+            # Una richiesta più grande dell'intera quota parte a bucket pieno
+            amount = min(amount, limit)
+            if self.levels[dimension] < amount:
+                wait = max(wait, (amount - self.levels[dimension]) * 60 / limit)
+        return wait
+
+    def take(self, cost):
+        for dimension, amount in cost.items():
+            if dimension in self.limits:
+                self.levels[dimension] -= min(amount, self.limits[dimension])
+
+    def observe(self, headers, now):
+        """Aggiorna limiti e disponibilità dagli header x-ratelimit-* di una risposta"""
+        self._refill(now)
+        for dimension in DIMENSIONS:
+            limit = _number(headers.get(f'x-ratelimit-limit-{dimension}'))
+            if not limit:
+                continue
+            self.limits[dimension] = limit
+            level = self.levels.get(dimension, limit)
+            remaining = _number(headers.get(f'x-ratelimit-remaining-{dimension}'))
+            # Il server non conta ancora le richieste in volo: si tiene la stima più prudente
+            self.levels[dimension] = min(level, remaining) if remaining is not None else level
+
+    def pause(self, seconds, now):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def to_state(self):
+        return {
+            'limits': self.limits, 'levels': self.levels,
+            'updated_at': self.updated_at, 'paused_until': self.paused_until
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        bucket = cls()
+        bucket.limits = state['limits']
+        bucket.levels = state['levels']
+        bucket.updated_at = state['updated_at']
+        bucket.paused_until = state['paused_until']
+        return bucket
+
+    def to_dict(self, now):
+        self._refill(now)
+        return {
+            'limits': {dimension: int(limit) for dimension, limit in self.limits.items()},
+            'available': {dimension: int(level) for dimension, level in self.levels.items()},
+            'paused_seconds': round(max(0.0, self.paused_until - now), 1)
+        }
+
+
+def _bucket_name(key):
+    key_id, model = key
+    return f"{key_id}:{model}"
+
+
+class SharedBuckets:
+    """Stato dei bucket in SQLite, condiviso dai processi del server (server.py).
+
+    Quote, pause dopo un 429 e chiamate in attesa per priorità stanno in un
+    unico file: N processi rispettano insieme la quota di una API key, e una
+    chiamata di background attende finché un altro processo ha chiamate
+    interattive in coda sullo stesso bucket. I tempi sono time.time(), comuni
+    a tutti i processi.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            # Fuori dalla transazione: SQLite non cambia journal_mode dentro BEGIN
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    state TEXT NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS waiting (
+                    name TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    priority INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (name, pid, priority)
+                )"""
+            )
+            # Attese lasciate da processi terminati
+            pids = {row[0] for row in conn.execute("SELECT DISTINCT pid FROM waiting")}
+            for pid in pids:
+                if not pid_alive(pid):
+                    conn.execute("DELETE FROM waiting WHERE pid = ?", (pid,))
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            # Lettura e aggiornamento del bucket come un'unica transazione tra processi
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _load(conn, name):
+        row = conn.execute("SELECT state FROM buckets WHERE name = ?", (name,)).fetchone()
+        return ModelBucket.from_state(json.loads(row[0])) if row else ModelBucket()
+
+    @staticmethod
+    def _save(conn, name, bucket):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, state) VALUES (?, ?)", (name, json.dumps(bucket.to_state()))
+        )
+
+    def reserve(self, key, cost, priority_index):
+        """Spende cost se c'è quota e nessun altro processo ha chiamate più urgenti in coda; altrimenti i secondi da attendere"""
+        name = _bucket_name(key)
+        with self._connect() as conn:
+            if priority_index:
+                urgent = conn.execute(
+                    "SELECT DISTINCT pid FROM waiting WHERE name = ? AND priority < ? AND count > 0 AND pid != ?",
+                    (name, priority_index, os.getpid())
+                ).fetchall()
+                if any(pid_alive(pid) for pid, in urgent):
+                    return SHARED_POLL_INTERVAL
+            bucket = self._load(conn, name)
+            wait = bucket.delay(cost, time.time())
+            if wait <= 0:
+                bucket.take(cost)
+            self._save(conn, name, bucket)
+        # Un altro processo può spendere o ricevere nuovi limiti nel frattempo
+        return wait if wait <= 0 else min(wait, SHARED_POLL_INTERVAL * 4)
+
+    def waiting(self, key, priority_index, delta):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO waiting (name, pid, priority, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name, pid, priority) DO UPDATE SET count = count + excluded.count",
+                (_bucket_name(key), os.getpid(), priority_index, delta)
+            )
+
+    def observe(self, key, headers):
+        name = _bucket_name(key)
+        with self._connect() as conn:
+            bucket = self._load(conn, name)
+            bucket.observe(headers, time.time())
+            self._save(conn, name, bucket)
+
+    def pause(self, key, seconds):
+        name = _bucket_name(key)
+        with self._connect() as conn:
+            bucket = self._load(conn, name)
+            bucket.pause(seconds, time.time())
+            self._save(conn, name, bucket)
+
+    def snapshot(self):
+        """{nome: (ModelBucket, chiamate in coda)} di tutti i processi"""
+        with self._connect() as conn:
+            buckets = {name: ModelBucket.from_state(json.loads(state))
+                       for name, state in conn.execute("SELECT name, state FROM buckets")}
+            queued = dict(conn.execute("SELECT name, SUM(count) FROM waiting GROUP BY name").fetchall())
+        return {name: (bucket, queued.get(name, 0)) for name, bucket in buckets.items()}
+
+
+class OpenAIScheduler:
+    """Coda unica per tutte le chiamate OpenAI: quota per (API key, modello), priorità e retry.
+
+    Ogni chiamata attende il proprio turno nella coda del bucket (prima le
+    interattive, poi in ordine di arrivo) e parte solo quando c'è quota; 429,
+    5xx e errori di connessione vengono ritentati con backoff esponenziale e
+    jitter, rispettando Retry-After. Un 429 mette in pausa l'intero bucket,
+    così le altre chiamate aspettano invece di fallire a loro volta. Con db_path
+    quote, pause e priorità valgono per tutti i processi del server
+    (SharedBuckets); l'ordine di arrivo resta per processo.
+    """
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=60.0, db_path=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.shared = SharedBuckets(db_path) if db_path else None
+        self.buckets = {}
+        self.queues = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, key, cost, priority_name=None):
+        """Attende il turno e la quota nel bucket key; restituisce i secondi di attesa"""
+        priority_name = priority_name or _priority.get()
+        ticket = (PRIORITIES.index(priority_name), next(self.sequence))
+        started = time.monotonic()
+        metrics.OPENAI_QUEUE_DEPTH.inc(priority=priority_name)
+        if self.shared:
+            self.shared.waiting(key, ticket[0], 1)
+        try:
+            with self.condition:
+                bucket = self.buckets.setdefault(key, ModelBucket())
+                queue = self.queues.setdefault(key, [])
+                heapq.heappush(queue, ticket)
+                try:
+                    while True:
+                        wait = None
+                        if queue[0] == ticket and self.shared:
+                            wait = self.shared.reserve(key, cost, ticket[0])
+                            if wait <= 0:
+                                break
+                        elif queue[0] == ticket:
+                            wait = bucket.delay(cost, time.monotonic())
+                            if wait <= 0:
+                                bucket.take(cost)
+                                break
+                        self.condition.wait(wait)
+                finally:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                    # Il prossimo in coda ricontrolla subito la quota
+                    self.condition.notify_all()
+        finally:
+            if self.shared:
+                self.shared.waiting(key, ticket[0], -1)
+            metrics.OPENAI_QUEUE_DEPTH.dec(priority=priority_name)
+        waited = time.monotonic() - started
+        metrics.OPENAI_QUEUE_SECONDS.observe(waited, priority=priority_name)
+        return waited
+
+    def observe(self, response):
+        """Hook di risposta httpx: passa gli header al bucket della chiamata in corso"""
+        key = _current_bucket.get()
+        if key is None:
+            return
+        if self.shared:
+            self.shared.observe(key, response.headers)
+            return
+        with self.condition:
+            bucket = self.buckets.get(key)
+            if bucket:
+                bucket.observe(response.headers, time.monotonic())
+
+    def call(self, key, func, cost, rewind=None):
+        """func() con quota, priorità e retry; restituisce il suo risultato o solleva l'ultimo errore.
+
+        rewind viene chiamata prima di ogni nuovo tentativo (es. riportare
+        all'inizio il file audio da inviare).
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(key, cost)
+            token = _current_bucket.set(key)
+            try:
+                return func()
+            except Exception as e:
+                reason = self._retry_reason(e)
+                if reason is None or attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+            finally:
+                _current_bucket.reset(token)
+            metrics.RETRIES.inc(stage='openai', reason=reason)
+            if reason == '429' and self.shared:
+                self.shared.pause(key, delay)
+            elif reason == '429':
+                # Quota esaurita per tutti: il bucket si ferma, le chiamate in coda attendono il reset
+                with self.condition:
+                    self.buckets[key].pause(delay, time.monotonic())
+            else:
+                time.sleep(delay)
+            if rewind:
+                rewind()
+
+    @staticmethod
+    def _retry_reason(error):
+        """Motivo del retry ('429', '5xx', 'connection'...) oppure None se l'errore è definitivo"""
+        if isinstance(error, openai.APIConnectionError):
+            return 'connection'  # Include i timeout
+        if not isinstance(error, openai.APIStatusError):
+            return None
+        if error.status_code == 429:
+            # Credito esaurito: riprovare non serve
+            return None if getattr(error, 'code', None) == 'insufficient_quota' else '429'
+        if error.status_code >= 500:
+            return '5xx'
+        if error.status_code in (408, 409):
+            return str(error.status_code)
+        return None
+
+    def _retry_delay(self, error, attempt):
+        """Backoff esponenziale con jitter completo; Retry-After o il reset della quota se indicati"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, 'response', None)
+        if response is None:
+            return delay
+        headers = response.headers
+        hint = None
+        if _number(headers.get('retry-after-ms')) is not None:
+            hint = _number(headers.get('retry-after-ms')) / 1000
+        elif _number(headers.get('retry-after')) is not None:
+            hint = _number(headers.get('retry-after'))
+        else:
+            resets = [parse_duration(headers.get(f'x-ratelimit-reset-{dimension}')) for dimension in DIMENSIONS]
+            resets = [reset for reset in resets if reset is not None]
+            hint = max(resets) if resets else None
+        if hint is None:
+            return delay
+        # Un po' di jitter anche sul reset, per non ripartire tutti nello stesso istante
+        return min(self.max_delay, hint + random.uniform(0, self.base_delay))
+
+    def stats(self):
+        if self.shared:
+            now = time.time()
+            return {
+                'max_retries': self.max_retries,
+                'shared': True,
+                'buckets': {
+                    f"{name[:8]}:{name.split(':', 1)[1]}": {**bucket.to_dict(now), 'queued': queued}
+                    for name, (bucket, queued) in self.shared.snapshot().items()
+                }
+            }
+        now = time.monotonic()
+        with self.condition:
+            return {
+                'max_retries': self.max_retries,
+                'shared': False,
+                'buckets': {
+                    f"{key_id[:8]}:{model}": {**bucket.to_dict(now), 'queued': len(self.queues.get((key_id, model), []))}
+                    for (key_id, model), bucket in self.buckets.items()
+                }
+            }
+
+
+class ScheduledClient:
+    """Client OpenAI con le chiamate usate dai servizi (chat, trascrizioni, immagini) instradate nello scheduler.
+
+    Ogni tentativo spende anche la quota del call_limiter attivo. Senza
+    scheduler le chiamate partono direttamente (i retry interni dell'SDK non
+    passano dal limiter). Gli altri attributi sono quelli del client originale.
+    """
+
+    def __init__(self, client, scheduler, key_id):
+        self.client = client
+        self.scheduler = scheduler
+        self.key_id = key_id
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=self._scheduled(client.chat.completions.create, self._chat_cost)
+        ))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(
+            create=self._scheduled(client.audio.transcriptions.create, lambda kwargs: {'requests': 1})
+        ))
+        self.images = SimpleNamespace(
+            generate=self._scheduled(client.images.generate, self._image_cost),
+            edit=self._scheduled(client.images.edit, self._image_cost)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _scheduled(self, method, cost):
+        def call(**kwargs):
+            amount = cost(kwargs)
+            limiter = _call_limiter.get()
+            reserve = (lambda: limiter.acquire(amount['requests'], amount.get('tokens', 0))) if limiter else None
+            if reserve:
+                reserve()
+            if not self.scheduler:
+                return method(**kwargs)
+            # Prima di ogni nuovo tentativo: file riportati all'inizio e nuova quota del limiter
+            steps = [step for step in (self._rewinder(kwargs), reserve) if step]
+            return self.scheduler.call(
+                (self.key_id, kwargs.get('model')), lambda: method(**kwargs), amount,
+                (lambda: [step() for step in steps]) if steps else None
+            )
+        return call
+
+    @staticmethod
+    def _chat_cost(kwargs):
+        """Token conteggiati da OpenAI per la quota: prompt + massimo della risposta"""
+        model = kwargs.get('model')
+        prompt = sum(
+            count_tokens(message.get('content') or '', model) for message in kwargs.get('messages', [])
+            if isinstance(message.get('content'), str)
+        )
+        completion = kwargs.get('max_tokens') or kwargs.get('max_completion_tokens') or DEFAULT_COMPLETION_TOKENS
+        return {'requests': 1, 'tokens': prompt + completion}
+
+    @staticmethod
+    def _image_cost(kwargs):
+        return {'requests': 1, 'images': kwargs.get('n') or 1}
+
+    @staticmethod
+    def _rewinder(kwargs):
+        """Riporta i file da caricare alla posizione iniziale (un tentativo fallito li ha già letti)"""
+        files = []
+        for name in ('file', 'image'):
+            value = kwargs.get(name)
+            stream = value[1] if isinstance(value, tuple) and len(value) > 1 else value
+            if hasattr(stream, 'seek') and hasattr(stream, 'tell'):
+                files.append((stream, stream.tell()))
+        if not files:
+            return None
+        return lambda: [stream.seek(position) for stream, position in files]
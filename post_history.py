@@ -0,0 +1,211 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+NUM_PERM = 64
+SHINGLE_WORDS = 3
+# Primo sotto 2^32: a < 2^31 e x < 2^32, quindi a*x+b resta entro uint64
+_PRIME = np.uint64(4294967291)
+_SEED = 1717
+
+_HASHTAG_RE = re.compile(r'#(\w+)', re.UNICODE)
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def hashtags(post):
+    return {tag.lower() for tag in _HASHTAG_RE.findall(post)}
+
+
+def opener(post):
+    """La prima riga con parole vere (la frase d'impatto)"""
+    for line in post.splitlines():
+        if len(_WORD_RE.findall(line)) >= 3:
+            return line.strip()
+    return ''
+
+
+def _words(text):
+    return [w.lower() for w in _WORD_RE.findall(_HASHTAG_RE.sub(' ', text))]
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class PostHistory:
+    """Storico dei post generati con indice di similarità in memoria.
+
+    Ogni post ha una firma MinHash (NUM_PERM minimi su shingle di parole) conservata
+    in un array NumPy circolare degli ultimi max_posts post: il confronto con tutto lo
+    storico è un solo confronto vettoriale. Apertura e hashtag si confrontano con Jaccard.
+    Prima di ogni confronto l'indice carica i post aggiunti dagli altri processi del server.
+    """
+
+    def __init__(self, db_path, max_posts=200, threshold=0.5, hashtag_threshold=0.8):
+        self.db_path = db_path
+        self.max_posts = max_posts
+        self.threshold = threshold
+        self.hashtag_threshold = hashtag_threshold
+        self.lock = threading.Lock()
+        rng = np.random.RandomState(_SEED)  # Permutazioni fisse: le firme salvate restano confrontabili
+        self.a = rng.randint(1, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+        self.b = rng.randint(0, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+        self.signatures = np.zeros((max_posts, NUM_PERM), dtype=np.uint32)
+        self.openers = [None] * max_posts
+        self.opener_words = [None] * max_posts
+        self.tags = [None] * max_posts
+        self.count = 0
+        self.position = 0
+        # Ultimo id di SQLite già nell'indice in memoria
+        self.last_id = 0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    opener TEXT NOT NULL,
+                    hashtags TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+        with self.lock:
+            self._sync()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def signature(self, text):
+        words = _words(text)
+        if not words:
+            return None
+        shingles = {
+            ' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+        }
+        values = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        hashes = (np.outer(values, self.a) + self.b) % _PRIME
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def _sync(self):
+        """Aggiunge all'indice i post salvati dopo last_id, anche da altri processi (chiamare con il lock)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, opener, hashtags, signature FROM posts WHERE id > ? ORDER BY id DESC LIMIT ?",
+                (self.last_id, self.max_posts)
+            ).fetchall()
+        for post_id, first_line, tags, signature in reversed(rows):
+            self._append(np.frombuffer(signature, dtype='<u4'), first_line, set(tags.split()))
+            self.last_id = post_id
+
+    def _append(self, signature, first_line, tags):
+        self.signatures[self.position] = signature
+        self.openers[self.position] = first_line
+        self.opener_words[self.position] = set(_words(first_line))
+        self.tags[self.position] = tags
+        self.position = (self.position + 1) % self.max_posts
+        self.count = min(self.count + 1, self.max_posts)
+
+    def check(self, post):
+        """Confronta il post con lo storico recente.
+
+        Restituisce similarità del testo (MinHash), dell'apertura e degli hashtag
+        rispetto al post più simile, e se il post va considerato un duplicato.
+        """
+        result = {'duplicate': False, 'score': 0.0, 'similarity': 0.0, 'opener_similarity': 0.0,
+                  'hashtag_similarity': 0.0, 'opener': None, 'hashtags': []}
+        signature = self.signature(post)
+        post_opener = set(_words(opener(post)))
+        post_tags = hashtags(post)
+        with self.lock:
+            self._sync()
+            if not self.count:
+                return result
+            if signature is not None:
+                scores = np.count_nonzero(self.signatures[:self.count] == signature, axis=1) / NUM_PERM
+                result['similarity'] = float(scores.max())
+            opener_scores = [_jaccard(post_opener, words) for words in self.opener_words[:self.count]]
+            tag_scores = [_jaccard(post_tags, tags) for tags in self.tags[:self.count]]
+            opener_best = max(range(self.count), key=opener_scores.__getitem__)
+            tag_best = max(range(self.count), key=tag_scores.__getitem__)
+            result['opener_similarity'] = opener_scores[opener_best]
+            result['hashtag_similarity'] = tag_scores[tag_best]
+            result['opener'] = self.openers[opener_best]
+            result['hashtags'] = sorted(self.tags[tag_best])
+        # Hashtag riportati alla scala della soglia del testo
+        result['score'] = max(
+            result['similarity'], result['opener_similarity'],
+            result['hashtag_similarity'] * self.threshold / self.hashtag_threshold
+        )
+        result['duplicate'] = result['score'] >= self.threshold
+        return result
+
+    def add(self, post):
+        signature = self.signature(post)
+        if signature is None:
+            return
+        first_line = opener(post)
+        tags = hashtags(post)
+        with self.lock:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO posts (text, opener, hashtags, signature, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (post, first_line, ' '.join(sorted(tags)), signature.astype('<u4').tobytes(), time.time())
+                )
+                # Su disco solo i post ancora confrontati
+                conn.execute(
+                    "DELETE FROM posts WHERE id <= (SELECT MAX(id) FROM posts) - ?", (self.max_posts,)
+                )
+            # Carica anche il post appena salvato, dopo quelli degli altri processi
+            self._sync()
+
+    def recent(self, limit=5):
+        """Aperture e hashtag più usati negli ultimi post, per il prompt"""
+        with self.lock:
+            self._sync()
+            indexes = [(self.position - 1 - i) % self.max_posts for i in range(min(limit, self.count))]
+            openers = [self.openers[i] for i in indexes if self.openers[i]]
+            counts = {}
+            for i in range(self.count):
+                for tag in self.tags[i]:
+                    counts[tag] = counts.get(tag, 0) + 1
+        common = sorted(counts, key=lambda tag: (-counts[tag], tag))[:limit * 2]
+        return openers, common
+
+    def avoid_prompt(self, check=None, limit=5):
+        """Istruzioni da aggiungere al prompt per non ripetere aperture e hashtag già usati"""
+        openers, common = self.recent(limit)
+        if check and check.get('opener') and check['opener'] not in openers:
+            openers.insert(0, check['opener'])
+        if check:
+            common = list(dict.fromkeys(check.get('hashtags', []) + common))
+        if not openers and not common:
+            return ''
+        lines = ["EVITA RIPETIZIONI DEI POST GIÀ PUBBLICATI:"]
+        if openers:
+            lines.append("- Non iniziare con frasi simili a queste:")
+            lines.extend(f'  "{line}"' for line in openers)
+        if common:
+            lines.append(f"- Usa hashtag diversi da: {' '.join('#' + tag for tag in common)}")
+        return '\n'.join(lines)
+
+    def stats(self):
+        with self.lock:
+            return {'posts': self.count, 'max_posts': self.max_posts, 'threshold': self.threshold}
@@ -0,0 +1,190 @@
+import math
+import re
+import subprocess
+import threading
+
+# Analisi economica: mono 8kHz, un valore RMS ogni FRAME_SECONDS
+ANALYSIS_SAMPLE_RATE = 8000
+FRAME_SECONDS = 0.05
+WINDOW_SECONDS = 5
+SILENCE_DB = -40
+SILENCE_MIN_SECONDS = 1.0
+
+# Titoli dei capitoli che indicano la predicazione
+SERMON_CHAPTER_RE = re.compile(
+    r'predic|sermon|messaggio|parola|omelia|insegnamento|preach|message|homily|teaching',
+    re.IGNORECASE
+)
+
+_SILENCE_RE = re.compile(r'silence_(start|end): (-?[\d.]+)')
+
+
+def seconds_to_hhmmss(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+def make_candidate(start, end, confidence, source, label):
+    return {
+        'start_time': seconds_to_hhmmss(start),
+        'end_time': seconds_to_hhmmss(end),
+        'start_seconds': int(start),
+        'end_seconds': int(end),
+        'duration_seconds': int(end - start),
+        'confidence': round(confidence, 2),
+        'source': source,
+        'label': label,
+    }
+
+
+def chapter_candidates(chapters):
+    """Candidati dai capitoli yt-dlp il cui titolo richiama la predicazione"""
+    candidates = []
+    for chapter in chapters or []:
+        title = chapter.get('title') or ''
+        start, end = chapter.get('start_time'), chapter.get('end_time')
+        if start is None or end is None or end <= start or not SERMON_CHAPTER_RE.search(title):
+            continue
+        candidates.append(make_candidate(start, end, 0.9, 'chapters', title))
+    return candidates
+
+
+def analyse_audio(input_args, duration=None, progress=None):
+    """Una sola passata ffmpeg a bassa risoluzione: energia per frame e silenzi.
+
+    input_args sono gli argomenti di input ffmpeg (es. ['-i', url]).
+    Restituisce (lista dei livelli RMS in dB per frame, lista di (inizio, fine) dei silenzi).
+    """
+    frame_samples = int(ANALYSIS_SAMPLE_RATE * FRAME_SECONDS)
+    filters = ','.join([
+        f'aresample={ANALYSIS_SAMPLE_RATE}',
+        'aformat=channel_layouts=mono',
+        f'asetnsamples=n={frame_samples}:p=0',
+        'astats=metadata=1:reset=1:measure_overall=RMS_level:measure_perchannel=none',
+        'ametadata=print:key=lavfi.astats.Overall.RMS_level:file=-',
+        f'silencedetect=n={SILENCE_DB}dB:d={SILENCE_MIN_SECONDS}',
+    ])
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-progress', 'pipe:2', *input_args,
+           '-vn', '-af', filters, '-f', 'null', '-']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    silences = []
+    errors = []
+
+    def read_stderr():
+        # stderr contiene silencedetect, -progress e gli eventuali errori
+        silence_start = None
+        for raw_line in process.stderr:
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            match = _SILENCE_RE.search(line)
+            if match:
+                value = max(0.0, float(match.group(2)))
+                if match.group(1) == 'start':
+                    silence_start = value
+                elif silence_start is not None:
+                    silences.append((silence_start, value))
+                    silence_start = None
+            elif line.startswith('out_time_us=') and progress and duration:
+                value = line.split('=', 1)[1]
+                if value.isdigit():
+                    progress('analysing', min(100, int(value) / 1e6 * 100 / duration))
+            elif 'error' in line.lower():
+                errors.append(line)
+
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    levels = []
+    try:
+        for raw_line in process.stdout:
+            key, _, value = raw_line.decode('ascii', errors='replace').strip().partition('=')
+            if key == 'lavfi.astats.Overall.RMS_level':
+                try:
+                    levels.append(max(float(value), -90.0))
+                except ValueError:
+                    levels.append(-90.0)  # -inf: silenzio digitale
+        process.wait()
+        stderr_thread.join()
+    except Exception:
+        process.kill()
+        raise
+    if process.returncode != 0 and not levels:
+        raise RuntimeError(f"Errore nell'analisi audio: {' '.join(errors[-5:])}")
+    return levels, silences
+
+
+def classify_windows(levels, frames_per_window=int(WINDOW_SECONDS / FRAME_SECONDS)):
+    """Etichetta ogni finestra come 'silence', 'speech' o 'music'.
+
+    Il parlato alterna sillabe e brevi pause, quindi ha molti frame a bassa
+    energia rispetto alla media della finestra; la musica ha un'energia più costante.
+    """
+    labels = []
+    for i in range(0, len(levels), frames_per_window):
+        window = levels[i:i + frames_per_window]
+        powers = [10 ** (db / 10) for db in window]
+        mean_power = sum(powers) / len(powers)
+        mean_db = -90.0 if mean_power <= 0 else 10 * math.log10(mean_power)
+        if mean_db < SILENCE_DB:
+            labels.append('silence')
+            continue
+        low_energy_ratio = sum(1 for p in powers if p < 0.5 * mean_power) / len(powers)
+        labels.append('speech' if low_energy_ratio >= 0.3 else 'music')
+    return smooth_labels(labels)
+
+
+def smooth_labels(labels, radius=3):
+    """Filtro a maggioranza su 2*radius+1 finestre per eliminare le etichette isolate"""
+    smoothed = []
+    for i in range(len(labels)):
+        neighbourhood = labels[max(0, i - radius):i + radius + 1]
+        smoothed.append(max(set(neighbourhood), key=neighbourhood.count))
+    return smoothed
+
+
+def speech_runs(labels, window_seconds=WINDOW_SECONDS, max_gap_seconds=30):
+    """Intervalli (inizio, fine, quota di parlato) di parlato continuo, unendo pause brevi"""
+    runs = []
+    start = end = None
+    speech_windows = 0
+    for i, label in enumerate(labels):
+        if label != 'speech':
+            continue
+        t = i * window_seconds
+        if start is not None and t - end <= max_gap_seconds:
+            end = t + window_seconds
+            speech_windows += 1
+            continue
+        if start is not None:
+            runs.append((start, end, speech_windows * window_seconds / (end - start)))
+        start, end, speech_windows = t, t + window_seconds, 1
+    if start is not None:
+        runs.append((start, end, speech_windows * window_seconds / (end - start)))
+    return runs
+
+
+def snap_to_silence(seconds, silences, edge, tolerance=20):
+    """Sposta un confine sul silenzio più vicino (fine del silenzio per l'inizio, inizio per la fine)"""
+    # Mai spostarsi di più di una finestra verso l'interno del parlato
+    if edge == 'start':
+        nearby = [end for start, end in silences if seconds - tolerance <= end <= seconds + WINDOW_SECONDS]
+    else:
+        nearby = [start for start, end in silences if seconds - WINDOW_SECONDS <= start <= seconds + tolerance]
+    return min(nearby, key=lambda p: abs(p - seconds)) if nearby else seconds
+
+
+def audio_candidates(levels, silences, min_seconds=600, max_candidates=3):
+    """Candidati dai tratti di parlato continuo più lunghi (la predicazione di solito lo è)"""
+    labels = classify_windows(levels)
+    total = len(levels) * FRAME_SECONDS
+    candidates = []
+    for start, end, speech_ratio in speech_runs(labels):
+        if end - start < min_seconds:
+            continue
+        start = snap_to_silence(start, silences, 'start')
+        end = min(total, snap_to_silence(end, silences, 'end'))
+        # Più è lungo e continuo, più è probabile che sia la predicazione
+        confidence = min(0.85, 0.4 + 0.45 * speech_ratio * min(1.0, (end - start) / 1800))
+        candidates.append(make_candidate(start, end, confidence, 'audio', 'Parlato continuo'))
+    candidates.sort(key=lambda c: c['duration_seconds'], reverse=True)
+    return candidates[:max_candidates]
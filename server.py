@@ -0,0 +1,122 @@
+"""Server di produzione: più processi waitress sulla stessa porta per usare tutti i core.
+
+Ogni processo ha il proprio pool di thread per le richieste e i job; job,
+API key, cache e file temporanei sono condivisi tramite SQLite e il
+filesystem in CACHE_FOLDER, ffmpeg e Whisper locale passano dal pool
+TRANSCODE_WORKERS comune a tutti i processi e /metrics somma le metriche
+di tutti. Su Linux i processi si dividono la porta con SO_REUSEPORT e il
+supervisore riavvia quelli che terminano; altrove il server gira in un
+solo processo.
+
+    python server.py --processes 4 --threads 8 --port 5000
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# Attesa prima di riavviare un processo terminato, per non ciclare su un errore all'avvio
+RESTART_DELAY = 2.0
+# Secondi concessi ai processi per chiudere le richieste in corso allo spegnimento
+SHUTDOWN_TIMEOUT = 10.0
+
+REUSEPORT_AVAILABLE = sys.platform.startswith('linux') and hasattr(socket, 'SO_REUSEPORT')
+
+
+def bind_socket(host, port):
+    """Socket in ascolto condivisibile con gli altri processi (SO_REUSEPORT: il kernel distribuisce le connessioni)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if REUSEPORT_AVAILABLE:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_worker(host, port, threads):
+    """Un processo del server: importa l'app (dopo aver impostato l'ambiente) e serve sulla porta condivisa"""
+    from waitress import serve
+
+    import app as churchpost
+
+    serve(churchpost.app, sockets=[bind_socket(host, port)], threads=threads)
+
+
+def spawn(args):
+    return subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), '--worker',
+        '--host', args.host, '--port', str(args.port), '--threads', str(args.threads)
+    ])
+
+
+def supervise(args):
+    """Avvia i processi, li riavvia se terminano e li chiude su SIGTERM/SIGINT"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Metriche sommate tra i processi (METRICS_DIR dell'app): si riparte da zero a ogni avvio del server
+    metrics_dir = os.environ.setdefault('METRICS_DIR', os.path.join('cache', 'metrics'))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    workers = [spawn(args) for _ in range(args.processes)]
+    print(f"🚀 Server su http://{args.host}:{args.port}: {args.processes} processi × {args.threads} thread")
+    while not stopping:
+        time.sleep(0.5)
+        for index, worker in enumerate(workers):
+            if worker.poll() is not None and not stopping:
+                print(f"⚠️ Processo {worker.pid} terminato (codice {worker.returncode}), riavvio")
+                time.sleep(RESTART_DELAY)
+                workers[index] = spawn(args)
+
+    for worker in workers:
+        if worker.poll() is None:
+            worker.terminate()
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for worker in workers:
+        try:
+            worker.wait(max(0.1, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            worker.kill()
+            worker.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Server multi-processo di ChurchPost')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('SERVER_PROCESSES', os.cpu_count() or 1)),
+                        help='processi del server (predefinito: SERVER_PROCESSES o il numero di core)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVER_THREADS', 4)),
+                        help='thread per processo (predefinito: SERVER_THREADS o 4)')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    processes = max(1, args.processes)
+    if processes > 1 and not REUSEPORT_AVAILABLE:
+        print("ℹ️ SO_REUSEPORT non disponibile su questo sistema: avvio in un solo processo")
+        processes = 1
+    # Letto dall'app all'import: con più processi le API key vanno condivise
+    os.environ['SERVER_PROCESSES'] = str(processes)
+    os.environ['SERVER_THREADS'] = str(args.threads)
+
+    if args.worker or processes == 1:
+        if not args.worker:
+            print(f"🚀 Server su http://{args.host}:{args.port}: 1 processo × {args.threads} thread")
+        run_worker(args.host, args.port, args.threads)
+        return
+    args.processes = processes
+    supervise(args)
+
+
+if __name__ == '__main__':
+    main()
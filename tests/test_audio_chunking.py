@@ -0,0 +1,42 @@
+from audio_chunking import merge_overlap, plan_chunks, stitch_transcripts
+
+
+def test_plan_chunks_short_audio_is_one_chunk():
+    assert plan_chunks(100, [], 600) == [(0.0, 100)]
+
+
+def test_plan_chunks_cuts_at_last_silence_in_window():
+    # Finestra di ricerca: [480, 600] per chunk da 600s; vince l'ultima pausa
+    silences = [(300, 302), (500, 502), (580, 582), (700, 702)]
+    chunks = plan_chunks(1000, silences, 600, overlap_seconds=1.5)
+    assert chunks == [(0.0, 581.0), (579.5, 1000)]
+
+
+def test_plan_chunks_without_silences_cuts_at_target_with_overlap():
+    # L'ultimo chunk può superare chunk_seconds fino a search_window (700 < 720)
+    chunks = plan_chunks(1900, [], 600, overlap_seconds=2)
+    assert chunks == [(0.0, 600), (598, 1200), (1198, 1900)]
+    # Ogni chunk riparte prima della fine del precedente
+    assert all(start < previous_end for (_, previous_end), (start, _) in zip(chunks, chunks[1:]))
+
+
+def test_merge_overlap_drops_repeated_words():
+    previous = 'and Moses said let my people go'.split()
+    following = 'my people go into the desert'.split()
+    assert merge_overlap(previous, following) == ['into', 'the', 'desert']
+
+
+def test_merge_overlap_ignores_case_and_punctuation():
+    previous = 'let my People, go!'.split()
+    following = 'people go. Into the desert'.split()
+    assert merge_overlap(previous, following) == ['Into', 'the', 'desert']
+
+
+def test_merge_overlap_keeps_single_word_match():
+    # Una sola parola in comune non basta per considerarla sovrapposizione
+    assert merge_overlap(['the', 'end'], ['end', 'of', 'days']) == ['end', 'of', 'days']
+
+
+def test_stitch_transcripts():
+    texts = ['In the beginning God created', 'God created the heavens', None, 'the heavens and the earth']
+    assert stitch_transcripts(texts) == 'In the beginning God created the heavens and the earth'
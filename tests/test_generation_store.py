@@ -0,0 +1,50 @@
+from generation_store import GenerationStore, generation_key
+
+
+def test_generation_key_depends_on_every_input():
+    base = generation_key('post', 'gpt', 1, {'temperature': 0.7}, 'testo')
+    assert base.startswith('post:')
+    assert base == generation_key('post', 'gpt', 1, {'temperature': 0.7}, 'testo')
+    assert base != generation_key('post', 'gpt', 2, {'temperature': 0.7}, 'testo')
+    assert base != generation_key('post', 'gpt', 1, {'temperature': 0.8}, 'testo')
+    assert base != generation_key('post', 'gpt', 1, {'temperature': 0.7}, 'altro')
+
+
+def test_variants_keep_stable_ids_when_old_ones_are_pruned(tmp_path):
+    store = GenerationStore(str(tmp_path / 'g.sqlite3'), max_variants=2)
+    first = store.put('k', 'a')
+    second = store.put('k', 'b')
+    assert (second['position'], second['variants'], second['previous']) == (1, 2, first['variant'])
+    third = store.put('k', 'c')
+    # La prima variante è stata eliminata: il suo id non punta a un'altra versione
+    assert store.get('k', first['variant']) is None
+    assert store.get('k', second['variant'])['value'] == 'b'
+    assert store.get('k', second['variant'])['position'] == 0
+    assert store.get('k')['variant'] == third['variant']
+    assert store.position('k', second['variant'])['next'] == third['variant']
+
+
+def test_variant_ids_are_not_reused_after_discard(tmp_path):
+    store = GenerationStore(str(tmp_path / 'g.sqlite3'))
+    old = store.put('k', 'a')
+    store.discard('k', old['variant'])
+    assert store.get('k') is None
+    new = store.put('k', 'b')
+    assert new['variant'] != old['variant']
+    assert store.get('k', old['variant']) is None
+    # Anche riaprendo l'archivio
+    reopened = GenerationStore(str(tmp_path / 'g.sqlite3'))
+    assert reopened.put('k', 'c')['variant'] > new['variant']
+
+
+def test_eviction_drops_least_recently_used_keys(tmp_path):
+    store = GenerationStore(str(tmp_path / 'g.sqlite3'), max_bytes=250)
+    store.put('old', 'x' * 100)
+    store.put('used', 'y' * 100)
+    store.get('old')  # Ora 'used' è la meno recente
+    store.put('new', 'z' * 100)
+    assert store.get('used') is None
+    assert store.get('old')['value'] == 'x' * 100
+    assert store.get('new')['value'] == 'z' * 100
+    stats = store.stats()
+    assert stats['keys'] == 2 and stats['size_bytes'] <= 250
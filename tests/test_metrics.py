@@ -0,0 +1,37 @@
+import json
+
+from metrics import Registry, SharedMetrics, server_timing, span
+
+
+def test_shared_metrics_sum_processes(tmp_path):
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Richieste', ('status',))
+    queue = registry.gauge('queue_depth', 'In coda')
+    seconds = registry.histogram('seconds', 'Durata', buckets=(1, 10))
+    requests.inc(2, status='200')
+    queue.inc(3)
+    seconds.observe(0.5)
+    # Stato di un processo già terminato: i contatori restano, il gauge no
+    (tmp_path / '999999999.json').write_text(json.dumps({
+        'requests_total': [[['200'], 5], [['500'], 1]],
+        'queue_depth': [[[], 7]],
+        'seconds': [[[], [[0, 1, 0], 5.0, 1]]]
+    }))
+    lines = SharedMetrics(str(tmp_path), registry, interval=3600).render().splitlines()
+    assert 'requests_total{status="200"} 7' in lines
+    assert 'requests_total{status="500"} 1' in lines
+    assert 'queue_depth 3' in lines
+    assert 'seconds_bucket{le="1.0"} 1' in lines
+    assert 'seconds_bucket{le="10.0"} 2' in lines
+    assert 'seconds_count 2' in lines
+
+
+def test_server_timing_sums_repeated_stages():
+    spans = []
+    for stage in ('whisper', 'whisper', 'gpt_post'):
+        with span(stage) as current:
+            pass
+        spans.append(current)
+    header = server_timing(spans, total=1.5)
+    assert header.startswith('whisper;dur=')
+    assert 'desc="x2"' in header and header.endswith('total;dur=1500.0')
@@ -0,0 +1,37 @@
+import os
+import stat
+
+import openai_clients
+from openai_clients import ApiKeyStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_api_keys_expire_after_ttl_without_use(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(openai_clients, 'time', clock)
+    store = ApiKeyStore(str(tmp_path / 'keys.sqlite3'), ttl=60)
+    store.put('a', 'sk-a')
+    store.put('b', 'sk-b')
+    clock.now += 50
+    store.touch('a')
+    clock.now += 20
+    # 'b' è scaduta, 'a' è stata rinnovata dall'utilizzo
+    assert store.get('a') == 'sk-a'
+    assert store.get('b') is None
+    assert store.stats()['keys'] == 1
+    assert store.reap() == 1
+
+
+def test_api_key_file_is_private(tmp_path):
+    path = tmp_path / 'keys.sqlite3'
+    path.write_bytes(b'')
+    os.chmod(path, 0o644)
+    ApiKeyStore(str(path))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
@@ -0,0 +1,48 @@
+import pytest
+
+from openai_scheduler import ModelBucket, parse_duration
+
+
+@pytest.mark.parametrize('value, seconds', [('20ms', 0.02), ('1s', 1), ('6m0s', 360), ('1h2m3.5s', 3723.5)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize('value', ['', None, 'soon'])
+def test_parse_duration_invalid(value):
+    assert parse_duration(value) is None
+
+
+def test_bucket_learns_limits_from_headers():
+    bucket = ModelBucket()
+    assert bucket.delay({'requests': 1, 'tokens': 5000}, 0.0) == 0
+    bucket.observe({
+        'x-ratelimit-limit-requests': '60', 'x-ratelimit-remaining-requests': '0',
+        'x-ratelimit-limit-tokens': '10000', 'x-ratelimit-remaining-tokens': '9000',
+        'x-ratelimit-limit-images': 'n/a'
+    }, 0.0)
+    assert bucket.limits == {'requests': 60.0, 'tokens': 10000.0}
+    # Nessuna richiesta disponibile: 60 al minuto, una al secondo
+    assert bucket.delay({'requests': 1}, 0.0) == pytest.approx(1.0)
+    assert bucket.delay({'requests': 1}, 1.0) == pytest.approx(0.0)
+
+
+def test_bucket_keeps_the_most_cautious_remaining():
+    bucket = ModelBucket()
+    headers = {'x-ratelimit-limit-tokens': '6000', 'x-ratelimit-remaining-tokens': '5000'}
+    bucket.observe(headers, 0.0)
+    bucket.take({'tokens': 3000})
+    # Il server non conta ancora i token in volo: resta la stima locale più bassa
+    bucket.observe(headers, 0.0)
+    assert bucket.levels['tokens'] == pytest.approx(2000)
+    # Costo oltre la quota: si attende il bucket pieno, non per sempre
+    assert bucket.delay({'tokens': 60000}, 0.0) == pytest.approx(40.0)
+
+
+def test_bucket_pause_and_state_round_trip():
+    bucket = ModelBucket()
+    bucket.observe({'x-ratelimit-limit-requests': '10'}, 0.0)
+    bucket.pause(5, 0.0)
+    restored = ModelBucket.from_state(bucket.to_state())
+    assert restored.delay({'requests': 1}, 1.0) == pytest.approx(4.0)
+    assert restored.to_dict(1.0)['paused_seconds'] == 4.0
@@ -0,0 +1,57 @@
+from timed_transcript import TimedTranscript
+
+
+def _chunk(segments, words):
+    return TimedTranscript.from_parts(segments, words)
+
+
+def _first_chunk():
+    return _chunk(
+        [(0, 4, 'Let my people go says the Lord'), (4, 8, 'and Moses go forth')],
+        [(0, 0.5, 'Let'), (0.5, 1, 'my'), (1, 1.5, 'people'), (1.5, 2, 'go'), (2, 2.5, 'says'),
+         (2.5, 3, 'the'), (3, 4, 'Lord'), (4, 5, 'and'), (5, 6, 'Moses'), (6, 7, 'go'), (7, 8, 'forth')]
+    )
+
+
+def test_concat_drops_overlap_from_boundary_segment():
+    # Il secondo chunk ripete "go forth" della sovrapposizione, con tempi precedenti al confine
+    second = _chunk(
+        [(6.2, 11, 'go forth into the desert'), (11, 13, 'and pray')],
+        [(6.2, 7, 'go'), (7.1, 7.9, 'forth'), (8.1, 9, 'into'), (9, 10, 'the'), (10, 11, 'desert'),
+         (11, 12, 'and'), (12, 13, 'pray')]
+    )
+    merged = TimedTranscript.concat([_first_chunk(), second])
+    assert merged.text == 'Let my people go says the Lord and Moses go forth into the desert and pray'
+    assert list(merged.iter_segments())[2] == (8.1, 11.0, 'into the desert')
+    assert [w for _, _, w in merged.iter_words()][-5:] == ['into', 'the', 'desert', 'and', 'pray']
+
+
+def test_concat_drops_repeated_words_with_late_timestamps():
+    # Tempi del chunk successivo spostati oltre il confine: decide il confronto del testo
+    second = _chunk(
+        [(8.1, 12, 'Moses go forth into the desert')],
+        [(8.1, 8.5, 'Moses'), (8.5, 9, 'go'), (9, 9.5, 'forth'), (9.5, 10, 'into'), (10, 11, 'the'),
+         (11, 12, 'desert')]
+    )
+    merged = TimedTranscript.concat([_first_chunk(), second])
+    assert merged.text == 'Let my people go says the Lord and Moses go forth into the desert'
+    words = list(merged.iter_words())
+    assert words[-3] == (9.5, 10.0, 'into')
+    # Gli offset delle parole puntano ancora al testo giusto
+    for _, _, word in words:
+        assert word
+
+
+def test_concat_segments_only_uses_text_overlap():
+    first = TimedTranscript.from_parts([(0, 5, 'in principio era il verbo')], [])
+    second = TimedTranscript.from_parts([(4.5, 9, 'era il verbo e il verbo era presso Dio')], [])
+    merged = TimedTranscript.concat([first, second])
+    assert merged.text == 'in principio era il verbo e il verbo era presso Dio'
+
+
+def test_shift_and_srt():
+    transcript = _chunk([(0, 1.5, 'Pace a voi'), (1.5, 3.25, 'fratelli')], []).shift(3600)
+    srt = transcript.to_srt()
+    assert '01:00:00,000 --> 01:00:01,500' in srt
+    assert '01:00:01,500 --> 01:00:03,250' in srt
+    assert 'fratelli' in srt
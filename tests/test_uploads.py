@@ -0,0 +1,58 @@
+import io
+
+from uploads import UploadStore, sniff_audio
+
+MP3 = b'ID3' + b'\x00' * 29
+
+
+def _store(tmp_path, **kwargs):
+    return UploadStore(str(tmp_path / 'uploads'), str(tmp_path / 'uploads.sqlite3'), max_bytes=1024, **kwargs)
+
+
+def test_sniff_audio():
+    assert sniff_audio(b'RIFF\x00\x00\x00\x00WAVEfmt ') == 'wav'
+    assert sniff_audio(b'fLaC' + b'\x00' * 8) == 'flac'
+    assert sniff_audio(b'\x00\x00\x00\x20ftypM4A ') == 'mp4'
+    assert sniff_audio(b'<html><body>') is None
+
+
+def test_upload_resumes_from_confirmed_offset(tmp_path):
+    store = _store(tmp_path)
+    upload = store.create('predica.mp3', len(MP3), 'it', 'openai')
+    assert (upload['offset'], upload['complete']) == (0, False)
+
+    success, upload = store.append(upload['id'], io.BytesIO(MP3[:20]))
+    assert success and upload['offset'] == 20
+    # Dopo un'interruzione lo stato riporta l'offset da cui riprendere
+    assert store.get(upload['id'])['offset'] == 20
+
+    success, upload = store.append(upload['id'], io.BytesIO(MP3[20:]))
+    assert success and upload['complete']
+    with open(store.path(upload['id'], 'predica.mp3'), 'rb') as f:
+        assert f.read() == MP3
+    # Tutti i blocchi sono arrivati a questo processo: l'hash è disponibile
+    assert store.digest(upload['id']) is not None
+
+
+def test_upload_rejects_bytes_beyond_declared_size(tmp_path):
+    store = _store(tmp_path)
+    upload = store.create('predica.mp3', 16, 'it', 'openai')
+    success, error = store.append(upload['id'], io.BytesIO(MP3))
+    assert not success and 'dimensione dichiarata' in error
+    assert store.get(upload['id'])['offset'] == 0
+
+
+def test_upload_rejects_non_audio(tmp_path):
+    store = _store(tmp_path)
+    upload = store.create('predica.mp3', 32, 'it', 'openai')
+    success, error = store.append(upload['id'], io.BytesIO(b'<html>' + b'x' * 26))
+    assert not success and error == 'Il file non è un audio riconosciuto'
+
+
+def test_closed_or_expired_uploads_are_gone(tmp_path):
+    store = _store(tmp_path)
+    upload = store.create('predica.mp3', 32, 'it', 'openai')
+    store.close(upload['id'])
+    assert store.get(upload['id']) is None
+    expired = _store(tmp_path, ttl=-1).create('predica.mp3', 32, 'it', 'openai')
+    assert expired is None
@@ -0,0 +1,280 @@
+import json
+import re
+from array import array
+
+from audio_chunking import merge_overlap
+
+_WORD_RE = re.compile(r'[^\w]+', re.UNICODE)
+# Citazione tra virgolette di almeno quattro parole
+_QUOTE_RE = re.compile(r'[«“"]([^«»“”"]+?)[»”"]')
+_SENTENCE_RE = re.compile(r'[^.!?\n]+')
+
+
+def _get(obj, name, default=None):
+    """Campo di una risposta dell'SDK (oggetto) o di un dict"""
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _normalize(word):
+    return _WORD_RE.sub('', word.lower())
+
+
+def _ms(seconds):
+    return int(round(float(seconds) * 1000))
+
+
+def _format_time(ms, separator):
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{ms:03d}"
+
+
+def opening_quote(post):
+    """La frase con cui si apre il post: la prima citazione tra virgolette, altrimenti la prima frase"""
+    head = post[:600]
+    for match in _QUOTE_RE.finditer(head):
+        if len(match.group(1).split()) >= 4:
+            return match.group(1)
+    for match in _SENTENCE_RE.finditer(head):
+        # Salta titoli ed emoji: serve una frase con parole vere
+        if len([w for w in match.group(0).split() if _normalize(w)]) >= 4:
+            return match.group(0)
+    return ''
+
+
+class TimedTranscript:
+    """Trascrizione con tempi in forma colonnare.
+
+    Il testo è una sola stringa; segmenti e parole sono array paralleli di
+    inizio/fine in millisecondi e offset (e lunghezza) nel testo, invece di
+    un dict per parola.
+    """
+
+    def __init__(self, text='', segments=None, words=None):
+        self.text = text
+        segments = segments or {}
+        words = words or {}
+        self.seg_start = array('q', segments.get('start', []))
+        self.seg_end = array('q', segments.get('end', []))
+        self.seg_offset = array('q', segments.get('offset', []))
+        self.word_start = array('q', words.get('start', []))
+        self.word_end = array('q', words.get('end', []))
+        self.word_offset = array('q', words.get('offset', []))
+        self.word_length = array('q', words.get('length', []))
+
+    @classmethod
+    def from_parts(cls, segments, words):
+        """Costruisce da liste [(inizio_s, fine_s, testo)] di segmenti e parole"""
+        transcript = cls()
+        pieces = []
+        position = 0
+        for start, end, text in segments:
+            text = text.strip()
+            if not text:
+                continue
+            if pieces:
+                position += 1  # Spazio separatore
+            transcript.seg_start.append(_ms(start))
+            transcript.seg_end.append(_ms(end))
+            transcript.seg_offset.append(position)
+            pieces.append(text)
+            position += len(text)
+        if not pieces:
+            # Solo parole: il testo è la loro sequenza
+            pieces = [w.strip() for _, _, w in words if w.strip()]
+        transcript.text = ' '.join(pieces)
+
+        lowered = transcript.text.lower()
+        cursor = 0
+        for start, end, word in words:
+            word = word.strip()
+            if not word:
+                continue
+            index = lowered.find(word.lower(), cursor)
+            # Parola non ritrovata nel testo dei segmenti: resta con i soli tempi
+            if index >= 0:
+                cursor = index + len(word)
+            transcript.word_start.append(_ms(start))
+            transcript.word_end.append(_ms(end))
+            transcript.word_offset.append(index)
+            transcript.word_length.append(len(word) if index >= 0 else 0)
+        return transcript
+
+    @classmethod
+    def from_verbose(cls, response):
+        """Da una risposta Whisper verbose_json (segment e word timestamps)"""
+        segments = [
+            (_get(s, 'start', 0), _get(s, 'end', 0), _get(s, 'text', ''))
+            for s in _get(response, 'segments') or []
+        ]
+        words = [
+            (_get(w, 'start', 0), _get(w, 'end', 0), _get(w, 'word', ''))
+            for w in _get(response, 'words') or []
+        ]
+        if not segments and not words:
+            text = _get(response, 'text', '') or ''
+            return cls(text)
+        return cls.from_parts(segments, words)
+
+    @classmethod
+    def concat(cls, parts):
+        """Unisce trascrizioni consecutive (già spostate al tempo assoluto).
+
+        Nelle sovrapposizioni tra chunk tiene la versione precedente: scarta
+        le parole del chunk successivo che iniziano prima della fine dell'ultima
+        parola già acquisita (più quelle che ripetono la coda, come
+        stitch_transcripts, per i tempi imprecisi) e taglia il testo del
+        segmento di confine dalla prima parola tenuta.
+        """
+        segments, words = [], []
+        cutoff = None
+        for part in parts:
+            part_segments = list(part.iter_segments())
+            part_words = list(part.iter_words())
+            if cutoff is not None and part_words:
+                first = next((i for i, w in enumerate(part_words) if w[0] >= cutoff), len(part_words))
+                texts = [w[2] for w in part_words[first:]]
+                first += len(texts) - len(merge_overlap([w[2] for w in words], texts))
+                part_segments = part._segments_from_word(first)
+                part_words = part_words[first:]
+            elif cutoff is not None:
+                # Solo segmenti: confine per tempo, poi le parole ripetute in testa al primo
+                part_segments = [s for s in part_segments if (s[0] + s[1]) / 2 >= cutoff]
+                if part_segments and segments:
+                    previous = ' '.join(s[2] for s in segments).split()
+                    start, end, text = part_segments[0]
+                    part_segments[0] = (start, end, ' '.join(merge_overlap(previous, text.split())))
+            segments.extend(part_segments)
+            words.extend(part_words)
+            if words:
+                cutoff = words[-1][1]
+            elif segments:
+                cutoff = segments[-1][1]
+        return cls.from_parts(segments, words)
+
+    def _segments_from_word(self, index):
+        """Segmenti dalla parola index in poi: quello che la contiene parte da lei (testo e inizio)"""
+        if index >= len(self.word_offset):
+            return []
+        found = [i for i in range(index, len(self.word_offset)) if self.word_offset[i] >= 0]
+        if not found:
+            return [s for s in self.iter_segments() if s[0] >= self.word_start[index] / 1000]
+        position = self.word_offset[found[0]]
+        start_time = self.word_start[found[0]] / 1000
+        result = []
+        for i, (start, end, text) in enumerate(self.iter_segments()):
+            end_offset = self.seg_offset[i + 1] if i + 1 < len(self.seg_offset) else len(self.text)
+            if end_offset <= position:
+                continue
+            if self.seg_offset[i] < position:
+                text = self.text[position:end_offset].strip()
+                start = max(start, start_time)
+            result.append((start, end, text))
+        return result
+
+    def shift(self, seconds):
+        """Copia con tutti i tempi spostati di seconds (es. inizio del segmento YouTube)"""
+        delta = _ms(seconds)
+        shifted = TimedTranscript(self.text)
+        for name in ('seg_start', 'seg_end', 'word_start', 'word_end'):
+            setattr(shifted, name, array('q', (t + delta for t in getattr(self, name))))
+        shifted.seg_offset = array('q', self.seg_offset)
+        shifted.word_offset = array('q', self.word_offset)
+        shifted.word_length = array('q', self.word_length)
+        return shifted
+
+    def iter_segments(self):
+        """(inizio_s, fine_s, testo) per ogni segmento"""
+        for i in range(len(self.seg_start)):
+            end_offset = self.seg_offset[i + 1] if i + 1 < len(self.seg_offset) else len(self.text)
+            text = self.text[self.seg_offset[i]:end_offset].strip()
+            yield self.seg_start[i] / 1000, self.seg_end[i] / 1000, text
+
+    def iter_words(self):
+        """(inizio_s, fine_s, parola) per ogni parola"""
+        for i in range(len(self.word_start)):
+            offset = self.word_offset[i]
+            word = self.text[offset:offset + self.word_length[i]] if offset >= 0 else ''
+            yield self.word_start[i] / 1000, self.word_end[i] / 1000, word
+
+    def find_quote(self, quote, max_words=8, min_words=3):
+        """Secondi di inizio del punto che corrisponde meglio all'inizio di quote, o None"""
+        target = [w for w in (_normalize(w) for w in quote.split()) if w][:max_words]
+        if len(target) < min_words:
+            return None
+        words = [_normalize(w) for _, _, w in self.iter_words()]
+        # Il post può parafrasare le prime parole: riprova saltandone una o due
+        for skip in range(3):
+            sequence = target[skip:]
+            if len(sequence) < min_words:
+                break
+            best_length, best_index = 0, None
+            for i in range(len(words)):
+                if words[i] != sequence[0]:
+                    continue
+                length = 1
+                while length < len(sequence) and i + length < len(words) and words[i + length] == sequence[length]:
+                    length += 1
+                if length > best_length:
+                    best_length, best_index = length, i
+                    if length == len(sequence):
+                        break
+            if best_length >= min_words:
+                return self.word_start[best_index] / 1000
+        return None
+
+    def to_dict(self):
+        """Forma compatta serializzabile (liste di interi, tempi in ms)"""
+        return {
+            'v': 1,
+            'text': self.text,
+            'segments': {
+                'start': self.seg_start.tolist(),
+                'end': self.seg_end.tolist(),
+                'offset': self.seg_offset.tolist(),
+            },
+            'words': {
+                'start': self.word_start.tolist(),
+                'end': self.word_end.tolist(),
+                'offset': self.word_offset.tolist(),
+                'length': self.word_length.tolist(),
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('text', ''), data.get('segments'), data.get('words'))
+
+    def _cues(self):
+        """(inizio_ms, fine_ms, testo) dei segmenti non vuoti"""
+        for i, (_, _, text) in enumerate(self.iter_segments()):
+            if text:
+                yield self.seg_start[i], self.seg_end[i], text
+
+    def to_srt(self):
+        return '\n'.join(
+            f"{n}\n{_format_time(start, ',')} --> {_format_time(end, ',')}\n{text}\n"
+            for n, (start, end, text) in enumerate(self._cues(), start=1)
+        )
+
+    def to_vtt(self):
+        cues = '\n'.join(
+            f"{_format_time(start, '.')} --> {_format_time(end, '.')}\n{text}\n"
+            for start, end, text in self._cues()
+        )
+        return f"WEBVTT\n\n{cues}"
+
+    def to_json(self):
+        """Esportazione leggibile: segmenti e parole con tempi in secondi"""
+        return json.dumps({
+            'text': self.text,
+            'segments': [
+                {'start': start, 'end': end, 'text': text} for start, end, text in self.iter_segments()
+            ],
+            'words': [
+                {'start': start, 'end': end, 'word': word} for start, end, word in self.iter_words()
+            ],
+        }, ensure_ascii=False, indent=2)
@@ -0,0 +1,149 @@
+import math
+import re
+import threading
+
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken è opzionale: senza, ~4 caratteri per token
+    tiktoken = None
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+')
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Parole troppo comuni per distinguere un passaggio (italiano e inglese)
+STOPWORDS = frozenset("""
+il lo la i gli le un uno una di a da in con su per tra fra e ed o ma se che chi cui non più anche come
+del dello della dei degli delle al allo alla ai agli alle dal dallo dalla dai dagli dalle nel nello nella
+nei negli nelle sul sullo sulla sui sugli sulle col coi questo questa questi queste quello quella quelli
+quelle ci vi si mi ti ne lui lei noi voi loro io tu mio mia tuo tua suo sua nostro nostra vostro vostra
+è sono era erano sia essere ha hanno ho hai abbiamo avere fare fa fatto molto poi quando dove perché
+quindi allora così già ancora sempre ogni tutto tutti tutta tutte qui là oggi
+the a an and or but of to in on for with at by from as is are was were be been it this that these those
+we you he she they i not no so if then than there here what which who
+""".split())
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model):
+    """Encoding tiktoken del modello (None se tiktoken manca o non riesce a caricarlo, es. offline)"""
+    if tiktoken is None:
+        return None
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding('o200k_base')
+            except Exception:
+                encoding = None  # File BPE non scaricabili: si usa la stima
+            _encodings[model] = encoding
+        return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4.5-preview"):
+    """Token del testo per il modello, stimati se tiktoken non è disponibile"""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_sentences(text, max_words=60):
+    """Frasi del testo; le trascrizioni senza punteggiatura vengono divise ogni max_words parole"""
+    sentences = []
+    for part in _SENTENCE_RE.split(text.strip()):
+        words = part.split()
+        for start in range(0, len(words), max_words):
+            sentences.append(' '.join(words[start:start + max_words]))
+    return sentences
+
+
+def split_chunks(text, max_tokens, model="gpt-4.5-preview"):
+    """Blocchi di frasi consecutive di al massimo ~max_tokens token"""
+    chunks = []
+    current, size = [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence, model)
+        if current and size + tokens > max_tokens:
+            chunks.append(' '.join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += tokens
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def textrank(sentences, damping=0.85, iterations=50, tolerance=1e-6):
+    """Punteggio di centralità di ogni frase: PageRank sul grafo delle similarità coseno TF-IDF"""
+    terms = [[w for w in _WORD_RE.findall(s.lower()) if len(w) > 2 and w not in STOPWORDS] for s in sentences]
+    vocabulary = {}
+    for words in terms:
+        for word in words:
+            vocabulary.setdefault(word, len(vocabulary))
+    count = len(sentences)
+    if not vocabulary or count < 2:
+        return np.ones(count, dtype=np.float64)
+
+    tf = np.zeros((count, len(vocabulary)), dtype=np.float32)
+    for row, words in enumerate(terms):
+        for word in words:
+            tf[row, vocabulary[word]] += 1
+    document_frequency = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + count) / (1 + document_frequency)) + 1
+    vectors = tf * idf.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0)
+    weights = similarity.sum(axis=1)
+    # Normalizzando per il grado massimo (non per riga) le frasi poco collegate
+    # restituiscono la massa al teletrasporto: altrimenti ogni componente
+    # sconnessa terrebbe la sua quota e i punteggi resterebbero quasi uniformi
+    transition = similarity / max(float(weights.max()), 1e-12)
+    leak = 1 - weights / max(float(weights.max()), 1e-12)
+    scores = np.full(count, 1.0 / count)
+    for _ in range(iterations):
+        updated = (1 - damping) / count + damping * (transition.T @ scores + (leak @ scores) / count)
+        if np.abs(updated - scores).sum() < tolerance:
+            return updated
+        scores = updated
+    return scores
+
+
+def extractive_summary(text, budget_tokens, model="gpt-4.5-preview"):
+    """Passaggi più centrali (TextRank) entro budget_tokens, nell'ordine originale.
+
+    I salti tra frasi non consecutive sono segnati con [...], così il modello
+    sa che il testo è una selezione.
+    """
+    sentences = split_sentences(text)
+    if len(sentences) < 3:
+        return text
+    scores = textrank(sentences)
+    sizes = [count_tokens(sentence, model) for sentence in sentences]
+    selected = []
+    used = 0
+    for index in np.argsort(-scores, kind='stable'):
+        if used + sizes[index] > budget_tokens:
+            continue
+        selected.append(int(index))
+        used += sizes[index]
+    selected.sort()
+
+    parts = []
+    previous = None
+    for index in selected:
+        if previous is not None and index != previous + 1:
+            parts.append('[...]')
+        parts.append(sentences[index])
+        previous = index
+    return ' '.join(parts)
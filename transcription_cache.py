@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _engine_suffix(engine):
+    # Le chiavi del motore OpenAI restano quelle di sempre: la cache esistente rimane valida
+    return '' if engine in (None, 'openai') else f":{engine}"
+
+
+def youtube_cache_key(video_id, start_seconds, end_seconds, language, engine=None):
+    """Chiave per un segmento YouTube: (video id, inizio, fine, lingua, motore)"""
+    return f"yt:{video_id}:{int(start_seconds)}:{int(end_seconds)}:{language}{_engine_suffix(engine)}"
+
+
+def segments_cache_key(video_id):
+    """Chiave per i segmenti della predicazione rilevati in un video"""
+    return f"segments:{video_id}"
+
+
+def file_cache_key(content_hash, language, engine=None):
+    """Chiave per un file caricato: (hash del contenuto, lingua, motore)"""
+    return f"file:{content_hash}:{language}{_engine_suffix(engine)}"
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """SHA-256 del contenuto del file, letto a blocchi"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptionCache:
+    """Cache persistente (SQLite) delle trascrizioni con evizione per età e dimensione"""
+
+    def __init__(self, db_path, max_bytes=200 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            # WAL: i processi del server leggono mentre un altro scrive
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS transcriptions (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    metadata TEXT,
+                    timing TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_transcriptions_accessed ON transcriptions(accessed_at)")
+            # Cache creata prima dei timestamp: aggiungi la colonna
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(transcriptions)")]
+            if 'timing' not in columns:
+                conn.execute("ALTER TABLE transcriptions ADD COLUMN timing TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Restituisce {'text', 'metadata', 'timing'} oppure None (timing è None se assente)"""
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT text, metadata, created_at, timing FROM transcriptions WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[2] <= self.max_age_seconds:
+                conn.execute("UPDATE transcriptions SET accessed_at = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return {
+                    'text': row[0],
+                    'metadata': json.loads(row[1]) if row[1] else {},
+                    'timing': json.loads(row[3]) if row[3] else None
+                }
+            self.misses += 1
+            return None
+
+    def put(self, key, text, metadata=None, timing=None):
+        """timing è la forma compatta di TimedTranscript.to_dict()"""
+        now = time.time()
+        encoded_metadata = json.dumps(metadata) if metadata else None
+        encoded_timing = json.dumps(timing, separators=(',', ':')) if timing else None
+        size = len(text.encode('utf-8')) + len(encoded_metadata or '') + len(encoded_timing or '')
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcriptions (key, text, metadata, timing, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, text, encoded_metadata, encoded_timing, size, now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """Elimina le voci scadute, poi le meno usate finché la cache non rientra nella quota"""
+        conn.execute("DELETE FROM transcriptions WHERE created_at < ?", (now - self.max_age_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM transcriptions ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM transcriptions WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock, self._connect() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcriptions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'size_bytes': total,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
@@ -0,0 +1,134 @@
+import os
+import threading
+
+from audio_chunking import WHISPER_MAX_BYTES
+from timed_transcript import TimedTranscript
+
+try:
+    import faster_whisper
+except ImportError:  # Motore locale opzionale: pip install faster-whisper
+    faster_whisper = None
+
+
+class OpenAIWhisperEngine:
+    """Trascrizione tramite API OpenAI (whisper-1): upload massimo 25MB per richiesta"""
+
+    name = 'openai'
+    max_upload_bytes = WHISPER_MAX_BYTES
+
+    def __init__(self, openai_client):
+        self.client = openai_client
+
+    def transcribe(self, audio, language, timed=False, progress=None):
+        """audio è un file aperto o una tupla (nome, buffer); restituisce (success, testo o TimedTranscript)"""
+        if not self.client:
+            return False, "API Key non configurata"
+        try:
+            if timed:
+                # Stesso costo: in più i tempi di segmenti e parole
+                transcript = self.client.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=audio,
+                    language=language if language != "auto" else None,
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment", "word"]
+                )
+                return True, TimedTranscript.from_verbose(transcript)
+
+            transcript = self.client.audio.transcriptions.create(
+                model="whisper-1",  # Nuovo modello 2025 - migliore e più economico
+                file=audio,
+                language=language if language != "auto" else None,
+                response_format="text"  # Formato compatibile con gpt-4o-mini-transcribe
+            )
+
+            # Estrai il testo dalla risposta
+            text = transcript if isinstance(transcript, str) else str(transcript)
+            return True, text
+
+        except Exception as e:
+            error_msg = str(e)
+            if "file size" in error_msg.lower():
+                return False, "File troppo grande. OpenAI Whisper accetta max 25MB"
+            elif "invalid file format" in error_msg.lower():
+                return False, "Formato file non supportato da Whisper"
+            else:
+                return False, f"Errore nella trascrizione: {error_msg}"
+
+
+class FasterWhisperEngine:
+    """Trascrizione locale su CPU con faster-whisper (CTranslate2).
+
+    Modello quantizzato int8, filtro VAD per saltare silenzi e musica, decodifica
+    a batch su tutti i core. Nessun limite di dimensione: l'audio non viene diviso.
+    Il modello viene caricato alla prima richiesta e condiviso da tutte le sessioni.
+    """
+
+    name = 'local'
+    max_upload_bytes = None
+
+    def __init__(self, model_size='small', device='cpu', compute_type='int8', cpu_threads=None,
+                 batch_size=8, download_root=None, run_slots=None):
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads or os.cpu_count() or 4
+        self.batch_size = batch_size
+        self.download_root = download_root
+        self.pipeline = None
+        self.load_lock = threading.Lock()
+        # Una trascrizione alla volta: il batch usa già tutti i core. Con più processi
+        # run_slots (WorkerSlots da un posto) estende il limite a tutto il server
+        self.run_lock = threading.Lock()
+        self.run_slots = run_slots
+
+    @staticmethod
+    def available():
+        return faster_whisper is not None
+
+    def _load(self):
+        with self.load_lock:
+            if self.pipeline is None:
+                model = faster_whisper.WhisperModel(
+                    self.model_size,
+                    device=self.device,
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                    download_root=self.download_root
+                )
+                batched = getattr(faster_whisper, 'BatchedInferencePipeline', None)
+                # Versioni senza pipeline a batch: decodifica sequenziale del modello
+                self.pipeline = batched(model=model) if batched else model
+            return self.pipeline
+
+    def transcribe(self, audio, language, timed=False, progress=None):
+        """audio è un percorso, un file aperto o una tupla (nome, buffer)"""
+        if not self.available():
+            return False, "Motore locale non disponibile (installa faster-whisper)"
+        if isinstance(audio, tuple):
+            audio = audio[1]
+        try:
+            pipeline = self._load()
+            options = {
+                'language': language if language != "auto" else None,
+                'vad_filter': True,
+                'word_timestamps': timed,
+            }
+            if not isinstance(pipeline, faster_whisper.WhisperModel):
+                options['batch_size'] = self.batch_size
+            with self.run_slots.slot() if self.run_slots else self.run_lock:
+                segments_iter, info = pipeline.transcribe(audio, **options)
+                segments, words = [], []
+                # I segmenti arrivano man mano che vengono decodificati
+                for segment in segments_iter:
+                    segments.append((segment.start, segment.end, segment.text))
+                    for word in segment.words or []:
+                        words.append((word.start, word.end, word.word))
+                    if progress and info.duration:
+                        progress('transcribing', min(100, segment.end * 100 / info.duration))
+        except Exception as e:
+            return False, f"Errore nella trascrizione locale: {str(e)}"
+
+        if timed:
+            return True, TimedTranscript.from_parts(segments, words)
+        return True, ' '.join(text.strip() for _, _, text in segments if text.strip())
@@ -0,0 +1,314 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: il server gira in un solo processo, basta il controllo in memoria
+    fcntl = None
+
+# Byte iniziali necessari per riconoscere il contenitore audio
+SNIFF_BYTES = 12
+
+
+def sniff_audio(head):
+    """Formato dai magic byte iniziali (mp3, wav, flac, mp4, webm, ogg, mpeg) oppure None"""
+    if head.startswith(b'ID3'):
+        return 'mp3'  # Tag ID3 davanti a MP3 (a volte anche a FLAC)
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(b'fLaC'):
+        return 'flac'
+    if head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide'):
+        return 'mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'webm'
+    if head.startswith(b'OggS'):
+        return 'ogg'
+    if head[:4] in (b'\x00\x00\x01\xba', b'\x00\x00\x01\xb3'):
+        return 'mpeg'
+    # Sincronismo di frame MPEG audio (MP3 senza tag, AAC ADTS)
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return 'mp3'
+    return None
+
+
+class UploadSink:
+    """File di destinazione scritto a blocchi man mano che il body arriva.
+
+    Dimensione, firma del formato e SHA-256 vengono verificati durante la
+    scrittura: un file non audio o troppo grande si ferma ai primi byte e il
+    resto del body viene scartato. Fa da stream_factory per il multipart di
+    Werkzeug (niente copia temporanea) e da destinazione dei PATCH ripresi.
+    """
+
+    def __init__(self, path, max_bytes=None, offset=0, digest=None, owner=None, error=None, too_large=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.too_large = too_large or f"File troppo grande (max {(max_bytes or 0) // (1024 * 1024)}MB)"
+        self.owner = owner
+        self.error = error
+        self.size = offset
+        self.claimed = False
+        # Dopo una ripresa l'hash continua solo se il chiamante ha lo stato dei byte precedenti
+        if digest is None and not offset:
+            digest = hashlib.sha256()
+        self.digest = digest
+        # La firma si verifica una volta sola, sui primi byte del file
+        self.head = b''
+        self.sniffed = offset >= SNIFF_BYTES
+        if offset and not self.sniffed:
+            with open(path, 'rb') as f:
+                self.head = f.read(offset)
+        self.file = open(path, 'a+b' if offset else 'w+b')
+        self.closed = False
+
+    def write(self, data):
+        if self.error:
+            return len(data)
+        if self.max_bytes is not None and self.size + len(data) > self.max_bytes:
+            self.error = self.too_large
+            return len(data)
+        if not self.sniffed:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self.sniffed = True
+                if not sniff_audio(self.head):
+                    self.error = 'Il file non è un audio riconosciuto'
+                    return len(data)
+        self.file.write(data)
+        if self.digest is not None:
+            self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def finish(self):
+        """Chiude il file e completa le verifiche: restituisce (success, errore)"""
+        self.close()
+        if self.error:
+            return False, self.error
+        if not self.size:
+            return False, 'File vuoto'
+        if not self.sniffed and not sniff_audio(self.head):
+            return False, 'Il file non è un audio riconosciuto'
+        return True, None
+
+    @property
+    def hexdigest(self):
+        return self.digest.hexdigest() if self.digest is not None else None
+
+    # Interfaccia file richiesta da Werkzeug (FileStorage rilegge lo stream dall'inizio)
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+            self.closed = True
+
+
+class UploadStore:
+    """Upload ripresi (stile tus): sessioni in SQLite, dati appesi a blocchi all'offset corrente.
+
+    L'offset confermato è la dimensione del file su disco: un PATCH interrotto
+    lascia i byte già scritti e il client riprende da lì. Lo SHA-256 prosegue
+    in memoria finché i blocchi arrivano in ordine a questo processo. Un file
+    di lock per upload impedisce a due processi del server di scrivere insieme.
+    """
+
+    def __init__(self, folder, db_path, max_bytes, chunk_size=8 * 1024 * 1024, ttl=24 * 3600):
+        self.folder = folder
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.digests = {}
+        self.active = set()
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS uploads (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    engine TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def path(self, upload_id, filename):
+        return os.path.join(self.folder, f"{upload_id}_{filename}")
+
+    def _lock_path(self, upload_id):
+        # Coperto dal pattern <id>_* che protegge il file parziale
+        return os.path.join(self.folder, f"{upload_id}_.lock")
+
+    def _try_lock(self, upload_id):
+        """Handle del lock esclusivo sull'upload (tra processi), None se un altro PATCH lo tiene"""
+        if fcntl is None:
+            return False
+        handle = open(self._lock_path(upload_id), 'a+b')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+        return handle
+
+    @staticmethod
+    def _unlock(handle):
+        if handle:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def create(self, filename, size, language, engine):
+        """Nuova sessione (il file viene creato dal primo blocco); restituisce il suo stato"""
+        upload_id = str(uuid.uuid4())
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            expired = [row[0] for row in conn.execute("SELECT id FROM uploads WHERE expires_at < ?", (now,))]
+            conn.execute("DELETE FROM uploads WHERE expires_at < ?", (now,))
+            for expired_id in expired:
+                self.digests.pop(expired_id, None)
+            conn.execute(
+                "INSERT INTO uploads (id, filename, size, language, engine, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, filename, size, language, engine, now, now + self.ttl)
+            )
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        """Stato della sessione (offset = byte già ricevuti) oppure None se sconosciuta o scaduta"""
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT filename, size, language, engine, expires_at FROM uploads WHERE id = ?", (upload_id,)
+            ).fetchone()
+        if not row or row[4] < time.time():
+            return None
+        filename, size, language, engine, expires_at = row
+        path = self.path(upload_id, filename)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        return {
+            'id': upload_id,
+            'filename': filename,
+            'size': size,
+            'offset': offset,
+            'complete': offset == size,
+            'language': language,
+            'engine': engine,
+            'chunk_size': self.chunk_size,
+            'expires_at': expires_at
+        }
+
+    def append(self, upload_id, stream):
+        """Scrive il body di un PATCH in coda al file; restituisce (success, stato|errore)"""
+        upload = self.get(upload_id)
+        if not upload:
+            return False, 'Upload non trovato o scaduto'
+        with self.lock:
+            if upload_id in self.active:
+                return False, 'Upload già in corso'
+            self.active.add(upload_id)
+        handle = self._try_lock(upload_id)
+        if handle is None:
+            with self.lock:
+                self.active.discard(upload_id)
+            return False, 'Upload già in corso'
+        with self.lock:
+            offset, digest = self.digests.pop(upload_id, (None, None))
+        try:
+            # Riletto sotto lock: un altro processo può aver appena scritto dei byte
+            current = self.get(upload_id)
+            if not current or current['offset'] != upload['offset']:
+                return False, 'Upload già in corso'
+            sink = UploadSink(
+                self.path(upload_id, upload['filename']), max_bytes=upload['size'],
+                offset=upload['offset'], digest=digest if offset == upload['offset'] else None,
+                too_large='Il file supera la dimensione dichiarata'
+            )
+            try:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    sink.write(block)
+                    if sink.error:
+                        break
+            finally:
+                sink.close()
+            with self.lock:
+                if sink.digest is not None:
+                    self.digests[upload_id] = (sink.size, sink.digest)
+            if sink.error:
+                return False, sink.error
+            upload = self.get(upload_id)
+            if upload['complete']:
+                success, error = sink.finish()
+                if not success:
+                    # Riparte da zero: un file non valido non deve risultare completo
+                    os.remove(sink.path)
+                    return False, error
+            return True, upload
+        finally:
+            self._unlock(handle)
+            with self.lock:
+                self.active.discard(upload_id)
+
+    def busy(self, upload_id):
+        """True se un altro PATCH sta scrivendo (es. richiesta precedente ancora in corso dopo un timeout)"""
+        with self.lock:
+            if upload_id in self.active:
+                return True
+        handle = self._try_lock(upload_id)
+        self._unlock(handle)
+        return handle is None
+
+    def digest(self, upload_id):
+        """SHA-256 calcolato durante l'upload, None se i blocchi non sono arrivati tutti a questo processo"""
+        upload = self.get(upload_id)
+        with self.lock:
+            offset, digest = self.digests.get(upload_id, (None, None))
+        if not upload or offset != upload['size']:
+            return None
+        return digest.hexdigest()
+
+    def close(self, upload_id):
+        """Chiude la sessione lasciando il file a chi lo elabora"""
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+            self.digests.pop(upload_id, None)
+        try:
+            os.remove(self._lock_path(upload_id))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock, self._connect() as conn:
+            sessions = conn.execute(
+                "SELECT COUNT(*) FROM uploads WHERE expires_at >= ?", (time.time(),)
+            ).fetchone()[0]
+        return {'sessions': sessions, 'max_bytes': self.max_bytes, 'chunk_size': self.chunk_size}
@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: il server gira in un solo processo, basta il semaforo
+    fcntl = None
+
+
+class WorkerSlots:
+    """Pool di posti per il lavoro CPU (ffmpeg, Whisper locale) condiviso da tutti i processi del server.
+
+    Ogni posto è un file di lock in lock_dir tenuto con flock: il kernel lo
+    rilascia anche se il processo muore, quindi non restano lock orfani. Il
+    semaforo evita che i thread dello stesso processo girino a vuoto sui file.
+    """
+
+    def __init__(self, name, size, lock_dir=None, poll_interval=0.05):
+        self.name = name
+        self.size = max(1, size)
+        self.lock_dir = lock_dir if fcntl else None
+        self.poll_interval = poll_interval
+        self.semaphore = threading.BoundedSemaphore(self.size)
+        self.active = 0
+        self.lock = threading.Lock()
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _acquire_file(self):
+        while True:
+            for index in range(self.size):
+                handle = open(os.path.join(self.lock_dir, f"{self.name}-{index}.lock"), 'a+b')
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return handle
+                except BlockingIOError:
+                    handle.close()
+            time.sleep(self.poll_interval)
+
+    @contextmanager
+    def slot(self):
+        """Attende un posto libero (l'attesa è la fase <name>_wait) e lo tiene per il blocco"""
+        with metrics.span(f'{self.name}_wait'):
+            self.semaphore.acquire()
+            try:
+                handle = self._acquire_file() if self.lock_dir else None
+            except BaseException:
+                self.semaphore.release()
+                raise
+        with self.lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+            if handle:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+            self.semaphore.release()
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size, 'active_here': self.active, 'shared': self.lock_dir is not None}